@@ -16,6 +16,10 @@ import trio
 
 AsyncFnsAndArgsType = Union[Callable[..., Awaitable[Any]], Tuple[Any, ...]]
 
+# The type of the `task_status` argument of functions meant to be run with
+# `nursery.start`.
+TaskStatus = Any
+
 
 async def gather(*async_fns_and_args: AsyncFnsAndArgsType) -> Tuple[Any, ...]:
     """
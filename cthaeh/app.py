@@ -1,18 +1,32 @@
 import logging
 import pathlib
-from typing import Optional
+from typing import Any, Dict, Optional, Union
 
 from async_service import Service
 from eth_typing import BlockNumber
 from sqlalchemy import orm
 import trio
-from web3 import Web3
 
+from cthaeh.cache import BlockCache
+from cthaeh.client import JSONRPCClientAPI
+from cthaeh.commit import CommitPolicy
 from cthaeh.exfiltration import Exfiltrator
-from cthaeh.ir import Block as BlockIR
+from cthaeh.head import DEFAULT_POLL_INTERVAL
+from cthaeh.indexes import IndexBuilder
 from cthaeh.loader import BlockLoader
+from cthaeh.log_exfiltration import LogExfiltrator
 from cthaeh.models import Header
+from cthaeh.retention import (
+    DEFAULT_PRUNE_BATCH_SIZE,
+    DEFAULT_PRUNE_INTERVAL,
+    Pruner,
+    RetentionPolicy,
+)
+from cthaeh.retention import metadata as retention_metadata
+from cthaeh.rows import LoadableBlock
 from cthaeh.rpc import RPCServer
+from cthaeh.sqlite import SQLiteProfile
+from cthaeh.writer import DatabaseWriterAPI, InlineWriter
 
 
 def determine_start_block(session: orm.Session) -> BlockNumber:
@@ -34,35 +48,154 @@ class Application(Service):
 
     def __init__(
         self,
-        w3: Web3,
+        client: JSONRPCClientAPI,
         session: orm.Session,
         start_block: Optional[BlockNumber],
         end_block: Optional[BlockNumber],
         concurrency: int,
         ipc_path: Optional[pathlib.Path],
+        batch_size: Optional[int] = None,
+        min_concurrency: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        logs_only: bool = False,
+        cache: Optional[BlockCache] = None,
+        window_size: Optional[int] = None,
+        head_poll_interval: float = DEFAULT_POLL_INTERVAL,
+        extraction_workers: Optional[int] = None,
+        load_batch_size: Optional[int] = None,
+        sqlite_profile: Optional[SQLiteProfile] = None,
+        commit_policy: Optional[CommitPolicy] = None,
+        index_builder: Optional[IndexBuilder] = None,
+        writer: Optional[DatabaseWriterAPI] = None,
+        retention_policy: Optional[RetentionPolicy] = None,
+        prune_batch_size: int = DEFAULT_PRUNE_BATCH_SIZE,
+        prune_interval: float = DEFAULT_PRUNE_INTERVAL,
     ) -> None:
-        block_send_channel, block_receive_channel = trio.open_memory_channel[BlockIR](
-            128
-        )
+        # Each item in the channel is a batch of blocks when blocks are
+        # loaded in batches, so the channel holds fewer of them.
+        if load_batch_size is None or logs_only:
+            channel_size = 128
+        else:
+            channel_size = max(1, 128 // load_batch_size)
+        block_send_channel, block_receive_channel = trio.open_memory_channel[
+            LoadableBlock
+        ](channel_size)
         if start_block is None:
             start_block = determine_start_block(session)
 
-        self.exfiltrator = Exfiltrator(
-            w3=w3,
-            block_send_channel=block_send_channel,
-            start_at=start_block,
-            end_at=end_block,
-            concurrency_factor=concurrency,
-        )
+        # With a writer of its own, `session` is only read from, by the
+        # JSON-RPC server, and ends its transactions to see what the writer
+        # commits.
+        if writer is None:
+            self.writer: DatabaseWriterAPI = InlineWriter(session)
+            is_read_only = False
+        else:
+            self.writer = writer
+            is_read_only = True
+            session.rollback()  # type: ignore
+
+        self.client = client
+        self.session = session
+        self.sqlite_profile = sqlite_profile
+        self.index_builder = index_builder
+        self.exfiltrator: Union[Exfiltrator, LogExfiltrator]
+        if logs_only:
+            self.exfiltrator = LogExfiltrator(
+                client=client,
+                block_send_channel=block_send_channel,
+                start_at=start_block,
+                end_at=end_block,
+                batch_size=batch_size,
+                head_poll_interval=head_poll_interval,
+            )
+        else:
+            self.exfiltrator = Exfiltrator(
+                client=client,
+                block_send_channel=block_send_channel,
+                start_at=start_block,
+                end_at=end_block,
+                concurrency_factor=concurrency,
+                batch_size=batch_size,
+                min_concurrency_factor=min_concurrency,
+                max_concurrency_factor=max_concurrency,
+                cache=cache,
+                window_size=window_size,
+                head_poll_interval=head_poll_interval,
+                extraction_workers=extraction_workers,
+                load_batch_size=load_batch_size,
+            )
         self.loader = BlockLoader(
-            session=session, block_receive_channel=block_receive_channel
+            session=session,
+            block_receive_channel=block_receive_channel,
+            report_stats=self.get_stats,
+            commit_policy=commit_policy,
+            writer=self.writer,
         )
+        if retention_policy is None:
+            self.pruner: Optional[Pruner] = None
+        else:
+            # The JSON-RPC server refuses requests for pruned blocks once it
+            # finds the table recording them.
+            retention_metadata.create_all(session.get_bind())
+            self.pruner = Pruner(
+                session.get_bind(),
+                self.writer,
+                retention_policy,
+                batch_size=prune_batch_size,
+                interval=prune_interval,
+                commit=self.loader.commit,
+            )
         if ipc_path is not None:
-            self.rpc_server = RPCServer(ipc_path=ipc_path, session=session)
+            self.rpc_server = RPCServer(
+                ipc_path=ipc_path,
+                session=session,
+                indexes_ready=None if index_builder is None else index_builder.ready,
+                end_transactions=is_read_only,
+            )
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.exfiltrator.get_stats(), **self.client.get_stats())
 
     async def run(self) -> None:
-        self.manager.run_daemon_child_service(self.exfiltrator)
-        self.manager.run_daemon_child_service(self.loader)
+        self.manager.run_daemon_child_service(self.client)
+        self.manager.run_daemon_child_service(self.writer)
+        self.manager.run_child_service(self.exfiltrator)
+        self.manager.run_child_service(self.loader)
+        if self.sqlite_profile is not None and self.sqlite_profile.is_backfilling:
+            self.manager.run_task(self._leave_backfill)
+        if self.index_builder is not None and not self.index_builder.ready.is_set():
+            self.manager.run_task(self._build_indexes_once_loaded)
+        if self.pruner is not None:
+            self.manager.run_daemon_child_service(self.pruner)
         if self.rpc_server is not None:
             self.manager.run_daemon_child_service(self.rpc_server)
         await self.manager.wait_finished()
+
+    async def _leave_backfill(self) -> None:
+        # Commits are made durable once loading is done, or stops for any
+        # other reason, and not only when the head of the chain is reached.
+        assert self.sqlite_profile is not None
+        try:
+            await self._wait_until_loaded()
+        finally:
+            with trio.CancelScope(shield=True):
+                await self.writer.write(self.sqlite_profile.make_durable)
+
+    async def _wait_until_loaded(self) -> None:
+        """
+        Wait until the head of the chain has been reached, or the range of
+        blocks being loaded has been loaded.
+        """
+        async with trio.open_nursery() as nursery:
+
+            async def _wait_then_stop(event: trio.Event) -> None:
+                await event.wait()
+                nursery.cancel_scope.cancel()
+
+            nursery.start_soon(_wait_then_stop, self.exfiltrator.caught_up)
+            nursery.start_soon(_wait_then_stop, self.loader.loaded)
+
+    async def _build_indexes_once_loaded(self) -> None:
+        await self._wait_until_loaded()
+        assert self.index_builder is not None
+        await self.index_builder.build(self.writer)
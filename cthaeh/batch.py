@@ -0,0 +1,180 @@
+import json
+import socket
+from typing import Any, Iterable, Optional, Sequence, Tuple, cast
+
+from eth_typing import URI
+from eth_utils import to_tuple
+from eth_utils.toolz import partition_all
+from web3 import HTTPProvider, IPCProvider
+from web3._utils.method_formatters import get_result_formatters
+from web3._utils.request import make_post_request
+from web3._utils.threads import Timeout
+from web3.providers.base import BaseProvider
+from web3.providers.ipc import has_valid_json_rpc_ending
+from web3.types import RPCEndpoint
+
+RPCRequestArgs = Tuple[RPCEndpoint, Sequence[Any]]
+
+
+class BatchRequestError(Exception):
+    """
+    Raised when one of the requests within a JSON-RPC batch fails.  `error`
+    holds the JSON-RPC error the node sent, if there was one.
+    """
+
+    def __init__(self, message: str, error: Any = None) -> None:
+        super().__init__(message)
+        self.error = error
+
+
+def encode_batch_request(
+    requests: Sequence[RPCRequestArgs], request_ids: Optional[Sequence[int]] = None
+) -> bytes:
+    if request_ids is None:
+        request_ids = range(len(requests))
+
+    return json.dumps(
+        [
+            {"jsonrpc": "2.0", "method": method, "params": list(params), "id": idx}
+            for idx, (method, params) in zip(request_ids, requests)
+        ]
+    ).encode("utf8")
+
+
+def _make_http_batch_request(provider: HTTPProvider, payload: bytes) -> Any:
+    raw_response = make_post_request(
+        cast(URI, provider.endpoint_uri), payload, **provider.get_request_kwargs()
+    )
+    return json.loads(raw_response)
+
+
+def _make_ipc_batch_request(provider: IPCProvider, payload: bytes) -> Any:
+    decoder = json.JSONDecoder()
+
+    # Mirrors `IPCProvider.make_request` so that batches share the provider's
+    # persistent socket and lock with any regular requests.
+    with provider._lock, provider._socket as sock:  # type: ignore
+        try:
+            sock.sendall(payload)
+        except BrokenPipeError:
+            sock = provider._socket.reset()  # type: ignore
+            sock.sendall(payload)
+
+        raw_response = b""
+        with Timeout(provider.timeout) as timeout:
+            while True:
+                try:
+                    raw_response += sock.recv(65536)
+                except socket.timeout:
+                    timeout.sleep(0)
+                    continue
+
+                if not has_valid_json_rpc_ending(raw_response):
+                    timeout.sleep(0)
+                    continue
+
+                try:
+                    response, _ = decoder.raw_decode(raw_response.decode("utf8"))
+                except json.JSONDecodeError:
+                    timeout.sleep(0)
+                    continue
+                else:
+                    return response
+
+
+@to_tuple
+def _make_sequential_requests(
+    provider: BaseProvider, requests: Sequence[RPCRequestArgs]
+) -> Iterable[Any]:
+    for idx, (method, params) in enumerate(requests):
+        yield dict(provider.make_request(method, params), id=idx)
+
+
+def make_batch_request(
+    provider: BaseProvider, requests: Sequence[RPCRequestArgs]
+) -> Tuple[Any, ...]:
+    """
+    Send the given requests to the node as a single JSON-RPC batch and return
+    the raw, unformatted results in the same order as the requests.
+
+    Providers without a batch capable transport fall back to issuing the
+    requests one at a time.
+
+    This is a blocking call and should be run in a worker thread.
+    """
+    if not requests:
+        return ()
+
+    if isinstance(provider, HTTPProvider):
+        responses = _make_http_batch_request(provider, encode_batch_request(requests))
+    elif isinstance(provider, IPCProvider):
+        responses = _make_ipc_batch_request(provider, encode_batch_request(requests))
+    else:
+        responses = _make_sequential_requests(provider, requests)
+
+    return unwrap_batch_response(requests, responses, range(len(requests)))
+
+
+def unwrap_batch_response(
+    requests: Sequence[RPCRequestArgs], responses: Any, request_ids: Sequence[int]
+) -> Tuple[Any, ...]:
+    """
+    Return the results from a batch response in the same order as the
+    requests, raising `BatchRequestError` if any of the requests failed.
+    """
+    if not isinstance(responses, list) and not isinstance(responses, tuple):
+        raise BatchRequestError(
+            f"Invalid batch response: {responses!r}",
+            responses.get("error") if isinstance(responses, dict) else None,
+        )
+    elif len(responses) != len(requests):
+        raise BatchRequestError(
+            f"Expected {len(requests)} responses to batch request. "
+            f"Got {len(responses)}"
+        )
+
+    # The JSON-RPC spec allows batch responses to be returned in any order.
+    responses_by_id = {response.get("id"): response for response in responses}
+    if any(request_id not in responses_by_id for request_id in request_ids):
+        # Errors the node cannot attribute to a request are sent with a
+        # `null` id.
+        raise BatchRequestError(
+            f"Invalid batch response: {responses!r}",
+            responses_by_id.get(None, {}).get("error"),
+        )
+
+    return tuple(
+        _unwrap_response(method, params, responses_by_id[request_id])
+        for request_id, (method, params) in zip(request_ids, requests)
+    )
+
+
+def _unwrap_response(method: RPCEndpoint, params: Sequence[Any], response: Any) -> Any:
+    if "error" in response:
+        raise BatchRequestError(
+            f"Error during batch request: method={method} params={params} "
+            f"error={response['error']}",
+            response["error"],
+        )
+    return response["result"]
+
+
+def format_results(
+    requests: Sequence[RPCRequestArgs], results: Sequence[Any]
+) -> Tuple[Any, ...]:
+    """
+    Apply the same result formatters that web3 would have applied had each
+    request been made through the `w3.eth` API.
+    """
+    return tuple(
+        get_result_formatters(method)(result)  # type: ignore
+        for (method, _), result in zip(requests, results)
+    )
+
+
+def chunk_requests(
+    requests: Sequence[RPCRequestArgs], max_batch_size: int
+) -> Tuple[Tuple[RPCRequestArgs, ...], ...]:
+    if max_batch_size < 1:
+        raise ValueError(f"Batch size must be positive: {max_batch_size}")
+    return tuple(partition_all(max_batch_size, requests))
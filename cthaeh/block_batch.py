@@ -0,0 +1,543 @@
+"""
+A columnar representation of a batch of blocks.
+
+Rather than an object per header, transaction, receipt and log, a
+`BlockBatch` holds every value of a field for all of its blocks in a single
+column: fixed width values such as hashes back to back in one buffer,
+variable length values in one buffer with an array of end offsets, and
+integers in an `array`.  Relations between tables, such as the transactions
+of each block, are arrays of end offsets into the child columns.
+
+Batches are cheap to build, to concatenate and to pickle, and the `ir`
+objects for any block can still be read from a batch as views.
+"""
+from array import array
+from typing import Iterable, Iterator, Optional, Union
+
+from eth_typing import Address, Hash32
+
+from cthaeh.extraction import (
+    RawBlockData,
+    RawData,
+    _get_any,
+    decode_hex,
+    decode_quantity,
+    decode_quantity_bytes,
+)
+from cthaeh.ir import Block, Header, Log, Receipt, Transaction
+
+
+def _offset_range(offsets: "array[int]", index: int) -> range:
+    start = offsets[index - 1] if index else 0
+    return range(start, offsets[index])
+
+
+def _extend_offsets(offsets: "array[int]", other: "array[int]") -> None:
+    base = offsets[-1] if offsets else 0
+    offsets.extend(base + offset for offset in other)
+
+
+class FixedColumn:
+    """
+    Byte strings which are all `width` bytes long, stored back to back.
+    """
+
+    __slots__ = ("width", "data")
+
+    def __init__(self, width: int) -> None:
+        self.width = width
+        self.data = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.data) // self.width
+
+    def __getitem__(self, index: int) -> bytes:
+        start = index * self.width
+        return bytes(self.data[start : start + self.width])  # noqa: E203
+
+    def __iter__(self) -> Iterator[bytes]:
+        return (self[index] for index in range(len(self)))
+
+    def append(self, value: bytes) -> None:
+        if len(value) != self.width:
+            raise ValueError(f"Expected {self.width} bytes: {value!r}")
+        self.data += value
+
+    def extend(self, other: "FixedColumn") -> None:
+        self.data += other.data
+
+
+class VarColumn:
+    """
+    Byte strings of any length, stored back to back along with the offset
+    at which each one ends.
+    """
+
+    __slots__ = ("data", "offsets")
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self.offsets = array("Q")
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> bytes:
+        span = _offset_range(self.offsets, index)
+        return bytes(self.data[span.start : span.stop])  # noqa: E203
+
+    def __iter__(self) -> Iterator[bytes]:
+        return (self[index] for index in range(len(self)))
+
+    def append(self, value: bytes) -> None:
+        self.data += value
+        self.offsets.append(len(self.data))
+
+    def extend(self, other: "VarColumn") -> None:
+        _extend_offsets(self.offsets, other.offsets)
+        self.data += other.data
+
+
+def _int_column() -> "array[int]":
+    return array("q")
+
+
+def _column_nbytes(column: Union[FixedColumn, VarColumn, "array[int]"]) -> int:
+    if isinstance(column, FixedColumn):
+        return len(column.data)
+    elif isinstance(column, VarColumn):
+        return len(column.data) + len(column.offsets) * column.offsets.itemsize
+    else:
+        return len(column) * column.itemsize
+
+
+class HeaderColumns:
+    __slots__ = (
+        "is_canonical",
+        "hash",
+        "parent_hash",
+        "uncles_hash",
+        "coinbase",
+        "state_root",
+        "transaction_root",
+        "receipt_root",
+        "bloom",
+        "difficulty",
+        "block_number",
+        "gas_limit",
+        "gas_used",
+        "timestamp",
+        "extra_data",
+        "nonce",
+    )
+
+    def __init__(self) -> None:
+        self.is_canonical = array("b")
+        self.hash = FixedColumn(32)
+        self.parent_hash = FixedColumn(32)
+        self.uncles_hash = FixedColumn(32)
+        self.coinbase = FixedColumn(20)
+        self.state_root = FixedColumn(32)
+        self.transaction_root = FixedColumn(32)
+        self.receipt_root = FixedColumn(32)
+        self.bloom = VarColumn()
+        self.difficulty = VarColumn()
+        self.block_number = _int_column()
+        self.gas_limit = _int_column()
+        self.gas_used = _int_column()
+        self.timestamp = _int_column()
+        self.extra_data = VarColumn()
+        self.nonce = VarColumn()
+
+    def __len__(self) -> int:
+        return len(self.block_number)
+
+    def __getitem__(self, index: int) -> Header:
+        return Header(
+            is_canonical=bool(self.is_canonical[index]),
+            hash=Hash32(self.hash[index]),
+            parent_hash=Hash32(self.parent_hash[index]),
+            uncles_hash=Hash32(self.uncles_hash[index]),
+            coinbase=Address(self.coinbase[index]),
+            state_root=Hash32(self.state_root[index]),
+            transaction_root=Hash32(self.transaction_root[index]),
+            receipt_root=Hash32(self.receipt_root[index]),
+            bloom=self.bloom[index],
+            difficulty=self.difficulty[index],
+            block_number=self.block_number[index],
+            gas_limit=self.gas_limit[index],
+            gas_used=self.gas_used[index],
+            timestamp=self.timestamp[index],
+            extra_data=self.extra_data[index],
+            nonce=self.nonce[index],
+        )
+
+    def append(self, header: Header) -> None:
+        self.is_canonical.append(header.is_canonical)
+        self.hash.append(header.hash)
+        self.parent_hash.append(header.parent_hash)
+        self.uncles_hash.append(header.uncles_hash)
+        self.coinbase.append(header.coinbase)
+        self.state_root.append(header.state_root)
+        self.transaction_root.append(header.transaction_root)
+        self.receipt_root.append(header.receipt_root)
+        self.bloom.append(header.bloom)
+        self.difficulty.append(header.difficulty)
+        self.block_number.append(header.block_number)
+        self.gas_limit.append(header.gas_limit)
+        self.gas_used.append(header.gas_used)
+        self.timestamp.append(header.timestamp)
+        self.extra_data.append(header.extra_data)
+        self.nonce.append(header.nonce)
+
+    def append_raw(self, header_data: RawData, is_canonical: bool) -> None:
+        self.is_canonical.append(is_canonical)
+        self.hash.append(decode_hex(header_data["hash"]))
+        self.parent_hash.append(decode_hex(header_data["parentHash"]))
+        self.uncles_hash.append(decode_hex(header_data["sha3Uncles"]))
+        self.coinbase.append(decode_hex(header_data["miner"]))
+        self.state_root.append(decode_hex(header_data["stateRoot"]))
+        self.transaction_root.append(decode_hex(header_data["transactionsRoot"]))
+        self.receipt_root.append(
+            decode_hex(
+                _get_any(header_data, "receiptsRoot", "receiptRoot", "receipts_root")
+            )
+        )
+        self.bloom.append(decode_hex(_get_any(header_data, "logsBloom", "logs_bloom")))
+        self.difficulty.append(decode_quantity_bytes(header_data["difficulty"]))
+        self.block_number.append(decode_quantity(header_data["number"]))
+        self.gas_limit.append(decode_quantity(header_data["gasLimit"]))
+        self.gas_used.append(decode_quantity(header_data["gasUsed"]))
+        self.timestamp.append(decode_quantity(header_data["timestamp"]))
+        self.extra_data.append(decode_hex(header_data["extraData"]))
+        self.nonce.append(decode_hex(header_data["nonce"]))
+
+    def extend(self, other: "HeaderColumns") -> None:
+        for name in self.__slots__:
+            getattr(self, name).extend(getattr(other, name))
+
+
+class TransactionColumns:
+    """
+    The columns for transactions.  A contract creation is stored with an
+    empty `to` address.
+    """
+
+    __slots__ = (
+        "hash",
+        "nonce",
+        "gas_price",
+        "gas",
+        "to",
+        "value",
+        "data",
+        "v",
+        "r",
+        "s",
+        "sender",
+    )
+
+    def __init__(self) -> None:
+        self.hash = FixedColumn(32)
+        self.nonce = _int_column()
+        self.gas_price = _int_column()
+        self.gas = _int_column()
+        self.to = VarColumn()
+        self.value = VarColumn()
+        self.data = VarColumn()
+        self.v = VarColumn()
+        self.r = VarColumn()
+        self.s = VarColumn()
+        self.sender = FixedColumn(20)
+
+    def __len__(self) -> int:
+        return len(self.nonce)
+
+    def __getitem__(self, index: int) -> Transaction:
+        to = self.to[index]
+        return Transaction(
+            hash=Hash32(self.hash[index]),
+            nonce=self.nonce[index],
+            gas_price=self.gas_price[index],
+            gas=self.gas[index],
+            to=Address(to) if to else None,
+            value=self.value[index],
+            data=self.data[index],
+            v=self.v[index],
+            r=self.r[index],
+            s=self.s[index],
+            sender=Address(self.sender[index]),
+        )
+
+    def append(self, transaction: Transaction) -> None:
+        self.hash.append(transaction.hash)
+        self.nonce.append(transaction.nonce)
+        self.gas_price.append(transaction.gas_price)
+        self.gas.append(transaction.gas)
+        self.to.append(b"" if transaction.to is None else transaction.to)
+        self.value.append(transaction.value)
+        self.data.append(transaction.data)
+        self.v.append(transaction.v)
+        self.r.append(transaction.r)
+        self.s.append(transaction.s)
+        self.sender.append(transaction.sender)
+
+    def append_raw(self, transaction_data: RawData) -> None:
+        to = transaction_data["to"]
+        self.hash.append(decode_hex(transaction_data["hash"]))
+        self.nonce.append(decode_quantity(transaction_data["nonce"]))
+        self.gas_price.append(decode_quantity(transaction_data["gasPrice"]))
+        self.gas.append(decode_quantity(transaction_data["gas"]))
+        self.to.append(b"" if to is None else decode_hex(to))
+        self.value.append(decode_quantity_bytes(transaction_data["value"]))
+        self.data.append(decode_hex(transaction_data["input"]))
+        self.v.append(decode_quantity_bytes(transaction_data["v"]))
+        self.r.append(decode_hex(transaction_data["r"]))
+        self.s.append(decode_hex(transaction_data["s"]))
+        self.sender.append(decode_hex(transaction_data["from"]))
+
+    def extend(self, other: "TransactionColumns") -> None:
+        for name in self.__slots__:
+            getattr(self, name).extend(getattr(other, name))
+
+
+class ReceiptColumns:
+    """
+    The columns for receipts along with their logs.  The logs of each
+    receipt end at the offset in `log_ends`, and the topics of each log at
+    the offset in `topic_ends`.
+    """
+
+    __slots__ = (
+        "state_root",
+        "gas_used",
+        "bloom",
+        "log_ends",
+        "log_address",
+        "log_data",
+        "topic_ends",
+        "topics",
+    )
+
+    def __init__(self) -> None:
+        self.state_root = VarColumn()
+        self.gas_used = _int_column()
+        self.bloom = VarColumn()
+        self.log_ends = array("Q")
+        self.log_address = FixedColumn(20)
+        self.log_data = VarColumn()
+        self.topic_ends = array("Q")
+        self.topics = FixedColumn(32)
+
+    def __len__(self) -> int:
+        return len(self.gas_used)
+
+    def __getitem__(self, index: int) -> Receipt:
+        return Receipt(
+            state_root=Hash32(self.state_root[index]),
+            gas_used=self.gas_used[index],
+            bloom=self.bloom[index],
+            logs=tuple(
+                self.get_log(log_index)
+                for log_index in _offset_range(self.log_ends, index)
+            ),
+        )
+
+    def get_log(self, log_index: int) -> Log:
+        return Log(
+            address=Address(self.log_address[log_index]),
+            topics=tuple(
+                Hash32(self.topics[topic_index])
+                for topic_index in _offset_range(self.topic_ends, log_index)
+            ),
+            data=self.log_data[log_index],
+        )
+
+    def get_log_range(self, index: int) -> range:
+        return _offset_range(self.log_ends, index)
+
+    def get_topic_range(self, log_index: int) -> range:
+        return _offset_range(self.topic_ends, log_index)
+
+    def _append_log(self, address: bytes, topics: Iterable[bytes], data: bytes) -> None:
+        self.log_address.append(address)
+        self.log_data.append(data)
+        for topic in topics:
+            self.topics.append(topic)
+        self.topic_ends.append(len(self.topics))
+
+    def append(self, receipt: Receipt) -> None:
+        self.state_root.append(receipt.state_root)
+        self.gas_used.append(receipt.gas_used)
+        self.bloom.append(receipt.bloom)
+        for log in receipt.logs:
+            self._append_log(log.address, log.topics, log.data)
+        self.log_ends.append(len(self.log_address))
+
+    def append_raw(self, receipt_data: RawData) -> None:
+        self.state_root.append(decode_hex(receipt_data["root"]))
+        self.gas_used.append(decode_quantity(receipt_data["gasUsed"]))
+        self.bloom.append(decode_hex(receipt_data["logsBloom"]))
+        for log_data in receipt_data["logs"]:
+            self._append_log(
+                decode_hex(log_data["address"]),
+                (decode_hex(topic) for topic in log_data["topics"]),
+                decode_hex(log_data["data"]),
+            )
+        self.log_ends.append(len(self.log_address))
+
+    def extend(self, other: "ReceiptColumns") -> None:
+        self.state_root.extend(other.state_root)
+        self.gas_used.extend(other.gas_used)
+        self.bloom.extend(other.bloom)
+        _extend_offsets(self.log_ends, other.log_ends)
+        self.log_address.extend(other.log_address)
+        self.log_data.extend(other.log_data)
+        _extend_offsets(self.topic_ends, other.topic_ends)
+        self.topics.extend(other.topics)
+
+
+class BlockBatch:
+    """
+    A batch of consecutive blocks stored as columns.
+
+    The transactions and receipts of each block end at the offset in
+    `transaction_ends`, and its uncles at the offset in `uncle_ends`.
+    Indexing or iterating over a batch gives `ir.Block` views of its blocks.
+    """
+
+    __slots__ = (
+        "headers",
+        "uncles",
+        "uncle_ends",
+        "transactions",
+        "receipts",
+        "transaction_ends",
+    )
+
+    def __init__(self) -> None:
+        self.headers = HeaderColumns()
+        self.uncles = HeaderColumns()
+        self.uncle_ends = array("Q")
+        self.transactions = TransactionColumns()
+        self.receipts = ReceiptColumns()
+        self.transaction_ends = array("Q")
+
+    @classmethod
+    def from_blocks(cls, blocks: Iterable[Block]) -> "BlockBatch":
+        batch = cls()
+        for block in blocks:
+            batch.append(block)
+        return batch
+
+    @classmethod
+    def from_raw_blocks(cls, raw_blocks: Iterable[RawBlockData]) -> "BlockBatch":
+        batch = cls()
+        for raw_block in raw_blocks:
+            batch.append_raw(raw_block)
+        return batch
+
+    @classmethod
+    def concat(cls, batches: Iterable["BlockBatch"]) -> "BlockBatch":
+        result = cls()
+        for batch in batches:
+            result.extend(batch)
+        return result
+
+    def __len__(self) -> int:
+        return len(self.headers)
+
+    def __getitem__(self, index: int) -> Block:
+        return Block(
+            header=self.headers[index],
+            transactions=tuple(
+                self.transactions[transaction_index]
+                for transaction_index in self.get_transaction_range(index)
+            ),
+            uncles=tuple(
+                self.uncles[uncle_index] for uncle_index in self.get_uncle_range(index)
+            ),
+            receipts=tuple(
+                self.receipts[transaction_index]
+                for transaction_index in self.get_transaction_range(index)
+            ),
+        )
+
+    def __iter__(self) -> Iterator[Block]:
+        return (self[index] for index in range(len(self)))
+
+    def __repr__(self) -> str:
+        if self.headers.block_number:
+            return (
+                f"BlockBatch(#{self.headers.block_number[0]}-"
+                f"#{self.headers.block_number[-1]})"
+            )
+        else:
+            return "BlockBatch()"
+
+    @property
+    def last_block_number(self) -> Optional[int]:
+        if self.headers.block_number:
+            return self.headers.block_number[-1]
+        else:
+            return None
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of the buffers holding the columns of the batch.
+        """
+        total = 0
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, (HeaderColumns, TransactionColumns, ReceiptColumns)):
+                total += sum(
+                    _column_nbytes(getattr(value, column_name))
+                    for column_name in value.__slots__
+                )
+            else:
+                total += _column_nbytes(value)
+        return total
+
+    def get_transaction_range(self, index: int) -> range:
+        return _offset_range(self.transaction_ends, index)
+
+    def get_uncle_range(self, index: int) -> range:
+        return _offset_range(self.uncle_ends, index)
+
+    def append(self, block: Block) -> None:
+        self.headers.append(block.header)
+        for uncle in block.uncles:
+            self.uncles.append(uncle)
+        self.uncle_ends.append(len(self.uncles))
+        for transaction, receipt in zip(block.transactions, block.receipts):
+            self.transactions.append(transaction)
+            self.receipts.append(receipt)
+        self.transaction_ends.append(len(self.transactions))
+
+    def append_raw(self, raw_block: RawBlockData) -> None:
+        transactions_data = raw_block.block["transactions"]
+        if len(transactions_data) != len(raw_block.receipts):
+            raise ValueError(
+                f"Block #{raw_block.block['number']} has {len(transactions_data)} "
+                f"transactions but {len(raw_block.receipts)} receipts"
+            )
+
+        self.headers.append_raw(raw_block.block, is_canonical=True)
+        for uncle_data in raw_block.uncles:
+            self.uncles.append_raw(uncle_data, is_canonical=False)
+        self.uncle_ends.append(len(self.uncles))
+        for transaction_data, receipt_data in zip(
+            transactions_data, raw_block.receipts
+        ):
+            self.transactions.append_raw(transaction_data)
+            self.receipts.append_raw(receipt_data)
+        self.transaction_ends.append(len(self.transactions))
+
+    def extend(self, other: "BlockBatch") -> None:
+        self.headers.extend(other.headers)
+        self.uncles.extend(other.uncles)
+        _extend_offsets(self.uncle_ends, other.uncle_ends)
+        self.transactions.extend(other.transactions)
+        self.receipts.extend(other.receipts)
+        _extend_offsets(self.transaction_ends, other.transaction_ends)
@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import pathlib
+import struct
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+import zlib
+
+from eth_typing import Hash32
+
+from cthaeh.extraction import RawBlockData, decode_hash32, decode_quantity
+from cthaeh.xdg import get_xdg_cthaeh_root
+
+# Each record within a segment is the block number, the block hash and the
+# length of the compressed payload followed by the payload itself.
+RECORD_HEADER = struct.Struct(">Q32sI")
+
+SEGMENT_SUFFIX = ".seg"
+
+DEFAULT_SEGMENT_SIZE = 1000
+
+# Minimum number of seconds between refreshing the access time of a segment.
+TOUCH_INTERVAL = 60
+
+
+def get_default_cache_path() -> pathlib.Path:
+    return get_xdg_cthaeh_root() / "block-cache"
+
+
+class _Record(NamedTuple):
+    block_hash: Hash32
+    offset: int
+    length: int
+
+
+class CacheStats(NamedTuple):
+    num_segments: int
+    num_blocks: int
+    size: int
+    max_size: int
+    lowest_block: Optional[int]
+    highest_block: Optional[int]
+
+
+class BlockCache:
+    """
+    An on-disk cache of the raw JSON-RPC data for blocks.
+
+    Blocks are stored in append-only segment files, each holding the blocks
+    within a range of `segment_size` block numbers, with every record
+    compressed and keyed by block number and hash.  If a block number is
+    stored more than once the most recently stored block is returned.
+
+    Once the total size exceeds `max_size` bytes, the least recently used
+    segments are deleted.
+
+    All methods are blocking and thread safe.
+    """
+
+    logger = logging.getLogger("cthaeh.cache.BlockCache")
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        max_size: int,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+    ) -> None:
+        if segment_size < 1:
+            raise ValueError(f"Segment size must be positive: {segment_size}")
+
+        self.path = path
+        self.max_size = max_size
+        self.segment_size = segment_size
+
+        self._lock = threading.Lock()
+        self._indices: Dict[int, Dict[int, _Record]] = {}
+        self._touched_at: Dict[int, float] = {}
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._sizes = {
+            self._segment_id(segment_path): segment_path.stat().st_size
+            for segment_path in self.path.glob(f"*{SEGMENT_SUFFIX}")
+        }
+        # The size cap may have been lowered since the cache was last used.
+        if sum(self._sizes.values()) > self.max_size:
+            self._evict()
+
+    #
+    # Segments
+    #
+    def _segment_id(self, segment_path: pathlib.Path) -> int:
+        return int(segment_path.stem) // self.segment_size
+
+    def _segment_path(self, segment_id: int) -> pathlib.Path:
+        return self.path / f"{segment_id * self.segment_size:012d}{SEGMENT_SUFFIX}"
+
+    def _get_index(self, segment_id: int) -> Dict[int, _Record]:
+        if segment_id not in self._indices:
+            self._indices[segment_id] = self._load_index(segment_id)
+        return self._indices[segment_id]
+
+    def _load_index(self, segment_id: int) -> Dict[int, _Record]:
+        index: Dict[int, _Record] = {}
+        segment_path = self._segment_path(segment_id)
+        if segment_id not in self._sizes:
+            return index
+
+        size = self._sizes[segment_id]
+        offset = 0
+        with segment_path.open("rb") as segment_file:
+            while offset + RECORD_HEADER.size <= size:
+                header = segment_file.read(RECORD_HEADER.size)
+                block_number, block_hash, length = RECORD_HEADER.unpack(header)
+                if offset + RECORD_HEADER.size + length > size:
+                    break
+                index[block_number] = _Record(
+                    Hash32(block_hash), offset + RECORD_HEADER.size, length
+                )
+                offset += RECORD_HEADER.size + length
+                segment_file.seek(offset)
+
+        # Drop any partially written record left behind by a crash.
+        if offset < size:
+            self.logger.warning(
+                "Truncating partial record at end of segment %s", segment_path
+            )
+            with segment_path.open("r+b") as segment_file:
+                segment_file.truncate(offset)
+            self._sizes[segment_id] = offset
+
+        return index
+
+    def _touch(self, segment_id: int) -> None:
+        now = time.time()
+        if now - self._touched_at.get(segment_id, 0) >= TOUCH_INTERVAL:
+            os.utime(self._segment_path(segment_id))
+            self._touched_at[segment_id] = now
+
+    def _evict(self, keep_segment_id: Optional[int] = None) -> None:
+        by_last_use = sorted(
+            (segment_id for segment_id in self._sizes if segment_id != keep_segment_id),
+            key=lambda segment_id: self._segment_path(segment_id).stat().st_mtime,
+        )
+        for segment_id in by_last_use:
+            if sum(self._sizes.values()) <= self.max_size:
+                break
+            self.logger.debug("Evicting segment %s", self._segment_path(segment_id))
+            self._segment_path(segment_id).unlink()
+            self._sizes.pop(segment_id)
+            self._indices.pop(segment_id, None)
+            self._touched_at.pop(segment_id, None)
+
+    #
+    # API
+    #
+    def get(
+        self, block_number: int, block_hash: Optional[Hash32] = None
+    ) -> Optional[RawBlockData]:
+        """
+        Return the block with the given number, or `None` if it is not in
+        the cache.  If `block_hash` is given the stored block must also have
+        that hash.
+        """
+        segment_id = block_number // self.segment_size
+        with self._lock:
+            record = self._get_index(segment_id).get(block_number)
+            if record is None:
+                return None
+            elif block_hash is not None and record.block_hash != block_hash:
+                return None
+
+            with self._segment_path(segment_id).open("rb") as segment_file:
+                segment_file.seek(record.offset)
+                payload = segment_file.read(record.length)
+            self._touch(segment_id)
+
+        block_data, uncles_data, receipts_data = json.loads(zlib.decompress(payload))
+        return RawBlockData(
+            block=block_data, uncles=tuple(uncles_data), receipts=tuple(receipts_data)
+        )
+
+    def put(self, raw_block: RawBlockData) -> None:
+        block_number = decode_quantity(raw_block.block["number"])
+        block_hash = decode_hash32(raw_block.block["hash"])
+        payload = zlib.compress(
+            json.dumps(
+                (raw_block.block, raw_block.uncles, raw_block.receipts),
+                separators=(",", ":"),
+            ).encode("utf8")
+        )
+        segment_id = block_number // self.segment_size
+
+        with self._lock:
+            index = self._get_index(segment_id)
+            record = index.get(block_number)
+            if record is not None and record.block_hash == block_hash:
+                return
+
+            offset = self._sizes.get(segment_id, 0)
+            with self._segment_path(segment_id).open("ab") as segment_file:
+                segment_file.write(
+                    RECORD_HEADER.pack(block_number, block_hash, len(payload)) + payload
+                )
+            index[block_number] = _Record(
+                block_hash, offset + RECORD_HEADER.size, len(payload)
+            )
+            self._sizes[segment_id] = offset + RECORD_HEADER.size + len(payload)
+            self._touched_at[segment_id] = time.time()
+
+            if sum(self._sizes.values()) > self.max_size:
+                self._evict(keep_segment_id=segment_id)
+
+    def get_stats(self) -> CacheStats:
+        with self._lock:
+            block_numbers = tuple(
+                block_number
+                for segment_id in self._sizes
+                for block_number in self._get_index(segment_id)
+            )
+            return CacheStats(
+                num_segments=len(self._sizes),
+                num_blocks=len(block_numbers),
+                size=sum(self._sizes.values()),
+                max_size=self.max_size,
+                lowest_block=min(block_numbers, default=None),
+                highest_block=max(block_numbers, default=None),
+            )
@@ -2,7 +2,22 @@ import argparse
 import pathlib
 
 from cthaeh import __version__
-from cthaeh.commands import do_initialize_database, do_main
+from cthaeh.commands import (
+    do_cache_prefill,
+    do_cache_stats,
+    do_count_rows,
+    do_initialize_database,
+    do_main,
+)
+from cthaeh.commit import (
+    DEFAULT_MAX_AGE,
+    DEFAULT_MAX_BLOCKS,
+    DEFAULT_MAX_BYTES,
+    DEFAULT_MAX_ROWS,
+    DEFAULT_TARGET_LATENCY,
+)
+from cthaeh.retention import DEFAULT_PRUNE_BATCH_SIZE, DEFAULT_PRUNE_INTERVAL
+from cthaeh.topics import DEFAULT_MAX_TOPICS
 
 parser = argparse.ArgumentParser(description="Cthaeh")
 parser.set_defaults(func=do_main)
@@ -16,8 +31,11 @@ subparser = parser.add_subparsers(dest="subcommand")
 # Argument Groups
 #
 cthaeh_parser = parser.add_argument_group("core")
+node_parser = parser.add_argument_group("node")
 loading_parser = parser.add_argument_group("loading")
 database_parser = parser.add_argument_group("database")
+retention_parser = parser.add_argument_group("retention")
+cache_parser = parser.add_argument_group("cache")
 logging_parser = parser.add_argument_group("logging")
 jsonrpc_parser = parser.add_argument_group("jsonrpc")
 
@@ -38,6 +56,83 @@ logging_parser.add_argument(
     help=("Configure the logging level. "),
 )
 
+#
+# Node
+#
+node_parser.add_argument(
+    "--provider-uri",
+    type=str,
+    action="append",
+    dest="provider_uris",
+    help=(
+        "The IPC path or HTTP URI of a node that data is pulled from.  May be "
+        "given multiple times to spread requests across a pool of nodes.  "
+        "Defaults to the default geth IPC path."
+    ),
+)
+node_parser.add_argument(
+    "--native-client",
+    action="store_true",
+    dest="native_client",
+    help=(
+        "Talk to the node with the trio native JSON-RPC client rather than "
+        "making thread-hopped web3 requests."
+    ),
+)
+node_parser.add_argument(
+    "--client-pool-size",
+    type=int,
+    dest="client_pool_size",
+    default=4,
+    help=("The number of persistent connections the native client keeps open"),
+)
+node_parser.add_argument(
+    "--request-retries",
+    type=int,
+    dest="request_retries",
+    default=3,
+    help=("The number of times a request that fails with a transient error is retried"),
+)
+node_parser.add_argument(
+    "--retry-backoff",
+    type=float,
+    dest="retry_backoff",
+    default=0.1,
+    help=(
+        "The base delay in seconds between retries.  The delay is randomized "
+        "and doubles with each attempt."
+    ),
+)
+node_parser.add_argument(
+    "--request-timeout",
+    type=float,
+    dest="request_timeout",
+    default=30.0,
+    help=("The number of seconds after which a request is abandoned and retried"),
+)
+node_parser.add_argument(
+    "--hedge-percentile",
+    type=float,
+    dest="hedge_percentile",
+    help=(
+        "Send a duplicate of any request which is still outstanding after this "
+        "percentile of recent latencies for the same method, using whichever "
+        "answer arrives first.  Disabled if not present."
+    ),
+)
+
+node_parser.add_argument(
+    "--head-poll-interval",
+    type=float,
+    dest="head_poll_interval",
+    default=1.0,
+    help=(
+        "The number of seconds between polls for the head of the chain when "
+        "following it.  New heads are pushed by the node without polling "
+        "when it is connected to over IPC."
+    ),
+)
+
 #
 # Database
 #
@@ -57,11 +152,114 @@ database_url_parser.add_argument(
     help=("Use an in-memory sqlite3 database."),
 )
 
+database_parser.add_argument(
+    "--compact-schema",
+    action="store_true",
+    dest="compact_schema",
+    help=(
+        "Create the database with integer keys relating headers, "
+        "transactions and logs rather than their hashes, which makes tables "
+        "and indexes much smaller.  Existing databases are used with the "
+        "schema they were created with."
+    ),
+)
+
+database_parser.add_argument(
+    "--flat-logs",
+    action="store_true",
+    dest="flat_logs",
+    help=(
+        "Create the database with an additional denormalized copy of the "
+        "logs, which lets eth_getLogs be answered without joining tables at "
+        "the cost of storing each log twice.  Existing databases keep the "
+        "copy if they have one."
+    ),
+)
+
+database_parser.add_argument(
+    "--log-partition-width",
+    type=int,
+    dest="log_partition_width",
+    default=None,
+    help=(
+        "Create the denormalized copy of the logs (see --flat-logs) "
+        "partitioned by block number into ranges of this many blocks, so that "
+        "each range is stored, vacuumed and indexed on its own.  Partitions "
+        "are created as blocks are loaded.  Only supported on PostgreSQL."
+    ),
+)
+
+database_parser.add_argument(
+    "--defer-indexes",
+    action="store_true",
+    dest="defer_indexes",
+    help=(
+        "Create the database without its secondary indexes, which are built "
+        "in one pass once the blocks being loaded have been loaded or the "
+        "head of the chain is reached.  The JSON-RPC server refuses queries "
+        "until then.  Indexes missing from an existing database are built "
+        "the same way."
+    ),
+)
+
+#
+# Retention
+#
+retention_parser.add_argument(
+    "--retain-blocks",
+    type=int,
+    dest="retain_blocks",
+    default=None,
+    help=(
+        "Keep only this many of the most recent blocks, pruning older ones "
+        "as new blocks are loaded.  eth_getLogs refuses requests reaching "
+        "back to pruned blocks."
+    ),
+)
+retention_parser.add_argument(
+    "--retain-age",
+    type=float,
+    dest="retain_age",
+    default=None,
+    help=(
+        "Keep only the blocks with a timestamp within this many seconds of "
+        "the most recent block, pruning older ones.  May be combined with "
+        "--retain-blocks, in which case blocks outside of either are pruned."
+    ),
+)
+retention_parser.add_argument(
+    "--prune-batch-size",
+    type=int,
+    dest="prune_batch_size",
+    default=DEFAULT_PRUNE_BATCH_SIZE,
+    help=(
+        "The number of blocks pruned in each transaction, which bounds how "
+        "long pruning holds its locks"
+    ),
+)
+retention_parser.add_argument(
+    "--prune-interval",
+    type=float,
+    dest="prune_interval",
+    default=DEFAULT_PRUNE_INTERVAL,
+    help="The number of seconds between checks for blocks to prune",
+)
+
 initialize_database_parser = subparser.add_parser(
     "init-db", help="Initialize the database schema"
 )
 initialize_database_parser.set_defaults(func=do_initialize_database)
 
+count_rows_parser = subparser.add_parser(
+    "count-rows",
+    help=(
+        "Count the rows of each table for the blocks from --start-block to "
+        "--end-block by querying the database, to verify the counts reported "
+        "while loading.  This is slow on a large database."
+    ),
+)
+count_rows_parser.set_defaults(func=do_count_rows)
+
 #
 # Data loading
 #
@@ -70,7 +268,144 @@ loading_parser.add_argument(
     type=int,
     dest="concurrency",
     default=3,
-    help=("The level of concurrency which which to pull data"),
+    help=(
+        "The level of concurrency which which to pull data.  When "
+        "--max-concurrency is set this is the starting level which is then "
+        "tuned automatically."
+    ),
+)
+loading_parser.add_argument(
+    "--min-concurrency",
+    type=int,
+    dest="min_concurrency",
+    help=(
+        "The lowest level of concurrency that automatic tuning may choose.  "
+        "Defaults to 1 when --max-concurrency is set."
+    ),
+)
+loading_parser.add_argument(
+    "--max-concurrency",
+    type=int,
+    dest="max_concurrency",
+    help=(
+        "Automatically tune the level of concurrency based on node latency, "
+        "errors and reorder window depth, up to this value."
+    ),
+)
+loading_parser.add_argument(
+    "--fetch-window",
+    type=int,
+    dest="fetch_window",
+    help=(
+        "The most blocks that may be fetched ahead of the next block to be "
+        "loaded, which bounds the memory used to put blocks back in order.  "
+        "Fetching pauses while the window is full.  Defaults to four times "
+        "the highest concurrency."
+    ),
+)
+loading_parser.add_argument(
+    "--batch-size",
+    type=int,
+    dest="batch_size",
+    help=(
+        "Fetch transaction receipts and uncles using JSON-RPC batch requests "
+        "containing at most this many requests each.  If not present each "
+        "item is fetched with its own request."
+    ),
+)
+loading_parser.add_argument(
+    "--extraction-workers",
+    type=int,
+    dest="extraction_workers",
+    help=(
+        "Extract blocks into columnar batches and prepare their rows in a "
+        "pool of this many worker processes rather than in the main "
+        "process.  Ignored with --logs-only."
+    ),
+)
+loading_parser.add_argument(
+    "--load-batch-size",
+    type=int,
+    default=16,
+    dest="load_batch_size",
+    help=(
+        "The most consecutive blocks, among those already fetched, that are "
+        "loaded into the database together with a single insert per table.  "
+        "Ignored with --logs-only."
+    ),
+)
+loading_parser.add_argument(
+    "--sqlite-backfill",
+    action="store_true",
+    dest="sqlite_backfill",
+    help=(
+        "Turn off fsync for SQLite commits while catching up with the chain, "
+        "until the head is reached or loading stops.  Faster, but losing "
+        "power meanwhile may lose recent blocks or corrupt the database."
+    ),
+)
+loading_parser.add_argument(
+    "--commit-max-blocks",
+    type=int,
+    default=DEFAULT_MAX_BLOCKS,
+    dest="commit_max_blocks",
+    help="Commit once at least this many blocks have been loaded.",
+)
+loading_parser.add_argument(
+    "--commit-max-rows",
+    type=int,
+    default=DEFAULT_MAX_ROWS,
+    dest="commit_max_rows",
+    help=(
+        "Commit once at least this many rows have been loaded.  The limit is "
+        "lowered automatically while commits take longer than "
+        "--commit-target-latency."
+    ),
+)
+loading_parser.add_argument(
+    "--commit-max-bytes",
+    type=int,
+    default=DEFAULT_MAX_BYTES,
+    dest="commit_max_bytes",
+    help="Commit once blocks of at least this many bytes have been loaded.",
+)
+loading_parser.add_argument(
+    "--commit-max-age",
+    type=float,
+    default=DEFAULT_MAX_AGE,
+    dest="commit_max_age",
+    help=(
+        "The most seconds a loaded block may wait to be committed, which "
+        "bounds how long new blocks take to be served at the head of the chain."
+    ),
+)
+loading_parser.add_argument(
+    "--commit-target-latency",
+    type=float,
+    default=DEFAULT_TARGET_LATENCY,
+    dest="commit_target_latency",
+    help="The number of seconds that a single commit should take at most.",
+)
+loading_parser.add_argument(
+    "--max-known-topics",
+    type=int,
+    default=DEFAULT_MAX_TOPICS,
+    dest="max_known_topics",
+    help=(
+        "The number of topics to remember as being in the database, so that "
+        "they are not inserted again.  Each takes about 150 bytes of memory, "
+        "and up to this many are read from the database on startup."
+    ),
+)
+loading_parser.add_argument(
+    "--logs-only",
+    action="store_true",
+    dest="logs_only",
+    help=(
+        "Only load the data needed to serve eth_getLogs, pulling logs for "
+        "windows of blocks with eth_getLogs rather than fetching every "
+        "transaction and receipt.  The concurrency options are ignored."
+    ),
 )
 loading_parser.add_argument(
     "--start-block",
@@ -88,6 +423,47 @@ loading_parser.add_argument(
     ),
 )
 
+#
+# Block cache
+#
+cache_parser.add_argument(
+    "--block-cache",
+    type=pathlib.Path,
+    nargs="?",
+    const=True,
+    dest="block_cache",
+    help=(
+        "Keep the raw data for fetched blocks in an on-disk cache which is "
+        "read before going to the node, making re-imports cheap.  Optionally "
+        "takes the directory for the cache, which defaults to a directory "
+        "under the cthaeh data directory.  Ignored with --logs-only."
+    ),
+)
+cache_parser.add_argument(
+    "--block-cache-size",
+    type=int,
+    dest="block_cache_size",
+    default=4096,
+    help=(
+        "The size in MiB that the block cache may grow to before the least "
+        "recently used blocks are evicted"
+    ),
+)
+
+cache_stats_parser = subparser.add_parser(
+    "cache-stats", help="Show the contents of the block cache"
+)
+cache_stats_parser.set_defaults(func=do_cache_stats)
+
+cache_prefill_parser = subparser.add_parser(
+    "cache-prefill",
+    help=(
+        "Fill the block cache from the node for the range given by "
+        "--start-block and --end-block without loading the database"
+    ),
+)
+cache_prefill_parser.set_defaults(func=do_cache_prefill)
+
 #
 # JSON-RPC
 #
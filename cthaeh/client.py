@@ -0,0 +1,631 @@
+from abc import abstractmethod
+import itertools
+import json
+import logging
+import pathlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+from async_service import Service
+import trio
+from web3 import Web3
+from web3.providers.ipc import has_valid_json_rpc_ending
+from web3.types import RPCEndpoint
+
+from cthaeh._utils import TaskStatus
+from cthaeh.batch import (
+    RPCRequestArgs,
+    encode_batch_request,
+    make_batch_request,
+    unwrap_batch_response,
+)
+
+
+class RPCError(Exception):
+    """
+    Raised when the node responds to a request with an error.
+    """
+
+    def __init__(self, method: RPCEndpoint, params: Sequence[Any], error: Any) -> None:
+        super().__init__(
+            f"Error during request: method={method} params={params} " f"error={error}"
+        )
+        self.method = method
+        self.params = params
+        self.error = error
+
+
+class BlockHashMismatch(Exception):
+    """
+    Raised when nodes disagree about the hash of a block, which happens while
+    they are on different sides of a re-organization.
+    """
+
+    pass
+
+
+class SubscriptionsNotSupported(Exception):
+    """
+    Raised when a client or the node behind it cannot push notifications
+    through `eth_subscribe`.
+    """
+
+    pass
+
+
+def _unwrap_response(method: RPCEndpoint, params: Sequence[Any], response: Any) -> Any:
+    if "error" in response:
+        raise RPCError(method, params, response["error"])
+    return response["result"]
+
+
+class JSONRPCClientAPI(Service):
+    """
+    A client for the node's JSON-RPC API which returns the raw, unformatted
+    JSON results.  Clients are services and must be running before requests
+    are made through them.
+    """
+
+    @abstractmethod
+    async def make_request(self, method: RPCEndpoint, params: Sequence[Any]) -> Any:
+        ...
+
+    @abstractmethod
+    async def make_batch_request(
+        self, requests: Sequence[RPCRequestArgs]
+    ) -> Tuple[Any, ...]:
+        """
+        Send the requests as a single JSON-RPC batch and return the results
+        in the same order as the requests.
+        """
+        ...
+
+    async def subscribe_new_heads(
+        self,
+        send_channel: trio.abc.SendChannel[Any],
+        *,
+        task_status: TaskStatus = trio.TASK_STATUS_IGNORED,
+    ) -> None:
+        """
+        Subscribe to `newHeads` and send every raw header the node pushes to
+        `send_channel`, returning or raising only once the subscription is
+        lost.  Meant to be run with `nursery.start`, which returns once the
+        subscription is in place.  Raises `SubscriptionsNotSupported` if the
+        client or node cannot push notifications.
+        """
+        raise SubscriptionsNotSupported(
+            f"{type(self).__name__} does not support subscriptions"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Return counters to be included in the import report.
+        """
+        return {}
+
+
+class Web3Client(JSONRPCClientAPI):
+    """
+    Make requests through a web3 provider, running each blocking request in a
+    worker thread.
+    """
+
+    def __init__(self, w3: Web3) -> None:
+        self.w3 = w3
+
+    async def run(self) -> None:
+        await self.manager.wait_finished()
+
+    async def make_request(self, method: RPCEndpoint, params: Sequence[Any]) -> Any:
+        response = await trio.to_thread.run_sync(
+            self.w3.provider.make_request, method, params
+        )
+        return _unwrap_response(method, params, response)
+
+    async def make_batch_request(
+        self, requests: Sequence[RPCRequestArgs]
+    ) -> Tuple[Any, ...]:
+        return await trio.to_thread.run_sync(
+            make_batch_request, self.w3.provider, requests
+        )
+
+
+class _PendingResponse:
+    def __init__(self) -> None:
+        self.ready = trio.Event()
+        self.response: Any = None
+        self.error: Optional[Exception] = None
+
+    def set_response(self, response: Any) -> None:
+        self.response = response
+        self.ready.set()
+
+    def set_error(self, error: Exception) -> None:
+        self.error = error
+        self.ready.set()
+
+    async def wait(self) -> Any:
+        await self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+# The number of notifications an IPC connection holds before dropping new
+# ones.
+NOTIFICATION_BUFFER_SIZE = 64
+
+
+class _IPCConnection:
+    """
+    A single persistent IPC connection.  Any number of requests may be in
+    flight on the connection at once; responses are matched back to their
+    requests by id.
+    """
+
+    logger = logging.getLogger("cthaeh.client._IPCConnection")
+
+    def __init__(self, stream: trio.abc.Stream) -> None:
+        self._stream = stream
+        self._send_lock = trio.Lock()
+        self._pending: Dict[int, _PendingResponse] = {}
+        self._batch_ids: Dict[int, int] = {}
+        self.is_closed = False
+        (
+            self._notification_send_channel,
+            self.notifications,
+        ) = trio.open_memory_channel[Any](NOTIFICATION_BUFFER_SIZE)
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._pending)
+
+    async def send(
+        self, request_id: int, payload: bytes, batch_ids: Sequence[int] = ()
+    ) -> Any:
+        """
+        Send the payload and wait for its response.  A batch is registered
+        under `request_id`, and `batch_ids` are the ids of all of the
+        requests in the batch.
+        """
+        if self.is_closed:
+            raise ConnectionError("IPC connection is closed")
+
+        pending = _PendingResponse()
+        self._pending[request_id] = pending
+        for batch_id in batch_ids:
+            self._batch_ids[batch_id] = request_id
+        try:
+            async with self._send_lock:
+                await self._stream.send_all(payload)
+            return await pending.wait()
+        finally:
+            self._pending.pop(request_id, None)
+            for batch_id in batch_ids:
+                self._batch_ids.pop(batch_id, None)
+
+    async def read_responses(self) -> None:
+        decoder = json.JSONDecoder()
+        buffer = bytearray()
+
+        try:
+            while True:
+                try:
+                    data = await self._stream.receive_some(65536)
+                except (trio.BrokenResourceError, trio.ClosedResourceError):
+                    break
+                if not data:
+                    break
+                buffer += data
+
+                # Only attempt to decode once the buffer could end with a
+                # complete message, so that a large response which arrives
+                # over many reads is not re-parsed after every one of them.
+                # A buffer which ends in `}` or `]` cannot end part way
+                # through a multibyte character.
+                if not has_valid_json_rpc_ending(data):
+                    continue
+
+                text = buffer.decode("utf8")
+                offset = 0
+                while True:
+                    while offset < len(text) and text[offset].isspace():
+                        offset += 1
+                    if offset == len(text):
+                        break
+                    try:
+                        response, offset = decoder.raw_decode(text, offset)
+                    except json.JSONDecodeError:
+                        break
+                    self._dispatch(response)
+                buffer = bytearray(text[offset:].encode("utf8"))
+        finally:
+            self.is_closed = True
+            for pending in tuple(self._pending.values()):
+                pending.set_error(ConnectionError("IPC connection closed"))
+            await self._notification_send_channel.aclose()
+            await self._stream.aclose()
+
+    def _dispatch(self, response: Any) -> None:
+        request_id: Optional[int]
+        if isinstance(response, list):
+            # Batch replies are matched through the id of any of their
+            # requests, skipping the error replies which have no id.
+            request_id = next(
+                (
+                    self._batch_ids[item["id"]]
+                    for item in response
+                    if isinstance(item, dict) and item.get("id") in self._batch_ids
+                ),
+                None,
+            )
+            if request_id is None and not any(
+                isinstance(item, dict) and item.get("id") is not None
+                for item in response
+            ):
+                self._fail_oldest(response)
+                return
+        elif not isinstance(response, dict):
+            self.logger.debug("Dropping invalid message: %r", response)
+            return
+        elif response.get("method") == "eth_subscription":
+            try:
+                self._notification_send_channel.send_nowait(response["params"])
+            except trio.WouldBlock:
+                self.logger.debug("Dropping notification: %r", response)
+            return
+        elif response.get("id") is None and "error" in response:
+            # The node could not tell which request this error belongs to,
+            # as happens when a batch cannot be parsed.
+            self._fail_oldest(response)
+            return
+        else:
+            request_id = response.get("id")
+
+        if request_id in self._pending:
+            self._pending[request_id].set_response(response)
+        else:
+            self.logger.debug("Dropping unexpected message: %r", response)
+
+    def _fail_oldest(self, response: Any) -> None:
+        # Request ids only increase, so the lowest pending id belongs to the
+        # oldest request.  Its caller raises when it unwraps the error.
+        if not self._pending:
+            self.logger.debug("Dropping unexpected error: %r", response)
+            return
+
+        request_id = min(self._pending)
+        if isinstance(response, list) and request_id not in self._batch_ids:
+            # A single request unwraps a single response, so it is handed the
+            # error out of a batch shaped reply.
+            response = next(
+                (
+                    item
+                    for item in response
+                    if isinstance(item, dict) and "error" in item
+                ),
+                {"error": response},
+            )
+        self._pending[request_id].set_response(response)
+
+
+class IPCClient(JSONRPCClientAPI):
+    """
+    A trio native client which talks to the node over a pool of persistent
+    IPC connections.  Requests are pipelined, with each request sent over the
+    connection with the fewest requests in flight.
+    """
+
+    logger = logging.getLogger("cthaeh.client.IPCClient")
+
+    def __init__(self, ipc_path: pathlib.Path, pool_size: int = 4) -> None:
+        if pool_size < 1:
+            raise ValueError(f"Pool size must be positive: {pool_size}")
+        self.ipc_path = ipc_path
+        self._pool_size = pool_size
+        self._connections: List[_IPCConnection] = []
+        self._request_ids = itertools.count()
+        self._connect_lock = trio.Lock()
+        self._ready = trio.Event()
+
+    async def run(self) -> None:
+        for _ in range(self._pool_size):
+            await self._open_connection()
+
+        self.logger.info(
+            "Opened %d IPC connections to %s", self._pool_size, self.ipc_path
+        )
+        self._ready.set()
+        await self.manager.wait_finished()
+
+    async def _open_connection(self) -> _IPCConnection:
+        stream = await trio.open_unix_socket(str(self.ipc_path))
+        connection = _IPCConnection(stream)
+        self._connections.append(connection)
+        self.manager.run_task(connection.read_responses)
+        return connection
+
+    async def _get_connection(self) -> _IPCConnection:
+        await self._ready.wait()
+
+        if any(conn.is_closed for conn in self._connections):
+            async with self._connect_lock:
+                closed = tuple(conn for conn in self._connections if conn.is_closed)
+                for connection in closed:
+                    self.logger.debug("Replacing closed IPC connection")
+                    self._connections.remove(connection)
+                    await self._open_connection()
+
+        return min(self._connections, key=lambda conn: conn.num_pending)
+
+    async def make_request(self, method: RPCEndpoint, params: Sequence[Any]) -> Any:
+        request_id = next(self._request_ids)
+        payload = json.dumps(
+            {
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": list(params),
+                "id": request_id,
+            }
+        ).encode("utf8")
+
+        connection = await self._get_connection()
+        response = await connection.send(request_id, payload)
+        return _unwrap_response(method, params, response)
+
+    async def make_batch_request(
+        self, requests: Sequence[RPCRequestArgs]
+    ) -> Tuple[Any, ...]:
+        if not requests:
+            return ()
+
+        request_ids = tuple(next(self._request_ids) for _ in requests)
+        payload = encode_batch_request(requests, request_ids)
+
+        connection = await self._get_connection()
+        responses = await connection.send(request_ids[0], payload, request_ids)
+        return unwrap_batch_response(requests, responses, request_ids)
+
+    async def subscribe_new_heads(
+        self,
+        send_channel: trio.abc.SendChannel[Any],
+        *,
+        task_status: TaskStatus = trio.TASK_STATUS_IGNORED,
+    ) -> None:
+        # Notifications are received over a dedicated connection so that
+        # they do not count towards the load of the pooled connections.
+        stream = await trio.open_unix_socket(str(self.ipc_path))
+        connection = _IPCConnection(stream)
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(connection.read_responses)
+
+            method, params = RPCEndpoint("eth_subscribe"), ("newHeads",)
+            request_id = next(self._request_ids)
+            payload = json.dumps(
+                {"jsonrpc": "2.0", "method": method, "params": params, "id": request_id}
+            ).encode("utf8")
+            try:
+                response = await connection.send(request_id, payload)
+                subscription_id = _unwrap_response(method, params, response)
+            except RPCError as err:
+                nursery.cancel_scope.cancel()
+                raise SubscriptionsNotSupported(str(err)) from err
+            task_status.started()
+
+            async with connection.notifications:
+                async for notification in connection.notifications:
+                    if notification["subscription"] == subscription_id:
+                        await send_channel.send(notification["result"])
+
+            raise ConnectionError("IPC connection closed")
+
+
+class HTTPError(Exception):
+    pass
+
+
+class _HTTPConnection:
+    """
+    A single persistent HTTP/1.1 connection which is re-used across requests
+    for as long as the server keeps it alive.
+    """
+
+    def __init__(self, stream: trio.abc.Stream, host: str, path: str) -> None:
+        self._stream = stream
+        self._host = host
+        self._path = path
+        self._buffer = b""
+        self.is_reusable = True
+
+    async def post(self, body: bytes) -> bytes:
+        request_head = (
+            f"POST {self._path} HTTP/1.1\r\n"
+            f"Host: {self._host}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: keep-alive\r\n"
+            f"\r\n"
+        ).encode("ascii")
+        await self._stream.send_all(request_head + body)
+
+        raw_head = await self._read_until(b"\r\n\r\n")
+        status_line, *header_lines = raw_head.decode("latin-1").split("\r\n")
+        _, status, *_ = status_line.split(" ", 2)
+        headers = {
+            name.strip().lower(): value.strip()
+            for name, _, value in (line.partition(":") for line in header_lines)
+        }
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            response_body = await self._read_chunked()
+        elif "content-length" in headers:
+            response_body = await self._read_exactly(int(headers["content-length"]))
+        else:
+            self.is_reusable = False
+            response_body = await self._read_to_eof()
+
+        if headers.get("connection", "").lower() == "close":
+            self.is_reusable = False
+
+        if status != "200":
+            raise HTTPError(f"HTTP {status}: {response_body[:200]!r}")
+
+        return response_body
+
+    async def _receive(self) -> None:
+        data = await self._stream.receive_some(65536)
+        if not data:
+            self.is_reusable = False
+            raise ConnectionError("HTTP connection closed by server")
+        self._buffer += data
+
+    async def _read_until(self, delimiter: bytes) -> bytes:
+        while delimiter not in self._buffer:
+            await self._receive()
+        value, _, self._buffer = self._buffer.partition(delimiter)
+        return value
+
+    async def _read_exactly(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            await self._receive()
+        value, self._buffer = self._buffer[:size], self._buffer[size:]
+        return value
+
+    async def _read_chunked(self) -> bytes:
+        chunks: List[bytes] = []
+        while True:
+            size_line = await self._read_until(b"\r\n")
+            size = int(size_line.split(b";")[0], 16)
+            chunk = await self._read_exactly(size + 2)
+            if size == 0:
+                return b"".join(chunks)
+            chunks.append(chunk[:size])
+
+    async def _read_to_eof(self) -> bytes:
+        try:
+            while True:
+                await self._receive()
+        except ConnectionError:
+            value, self._buffer = self._buffer, b""
+            return value
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class HTTPClient(JSONRPCClientAPI):
+    """
+    A trio native client which talks to the node over a pool of persistent
+    HTTP/1.1 keep-alive connections.
+    """
+
+    logger = logging.getLogger("cthaeh.client.HTTPClient")
+
+    def __init__(self, endpoint_uri: str, pool_size: int = 8) -> None:
+        if pool_size < 1:
+            raise ValueError(f"Pool size must be positive: {pool_size}")
+
+        parsed = urlparse(endpoint_uri)
+        if parsed.scheme not in {"http", "https"}:
+            raise ValueError(f"Unsupported endpoint: {endpoint_uri}")
+
+        self.endpoint_uri = endpoint_uri
+        self._use_ssl = parsed.scheme == "https"
+        self._hostname = parsed.hostname or "localhost"
+        self._port = parsed.port or (443 if self._use_ssl else 80)
+        self._host = parsed.netloc
+        self._path = parsed.path or "/"
+
+        self._limiter = trio.CapacityLimiter(pool_size)
+        self._idle: List[_HTTPConnection] = []
+        self._request_ids = itertools.count()
+
+    async def run(self) -> None:
+        try:
+            await self.manager.wait_finished()
+        finally:
+            for connection in self._idle:
+                with trio.CancelScope(shield=True):
+                    await connection.aclose()
+
+    async def _open_connection(self) -> _HTTPConnection:
+        stream: trio.abc.Stream
+        if self._use_ssl:
+            stream = await trio.open_ssl_over_tcp_stream(self._hostname, self._port)
+        else:
+            stream = await trio.open_tcp_stream(self._hostname, self._port)
+        return _HTTPConnection(stream, self._host, self._path)
+
+    async def _post(self, body: bytes) -> Any:
+        async with self._limiter:
+            # A pooled connection may have been closed by the server since it
+            # was last used, in which case the request is retried once on a
+            # fresh connection.
+            if self._idle:
+                connection = self._idle.pop()
+                try:
+                    raw_response = await connection.post(body)
+                except (
+                    ConnectionError,
+                    trio.BrokenResourceError,
+                    trio.ClosedResourceError,
+                ):
+                    with trio.CancelScope(shield=True):
+                        await connection.aclose()
+                except BaseException:
+                    with trio.CancelScope(shield=True):
+                        await connection.aclose()
+                    raise
+                else:
+                    return self._release(connection, raw_response)
+
+            connection = await self._open_connection()
+            try:
+                raw_response = await connection.post(body)
+            except BaseException:
+                with trio.CancelScope(shield=True):
+                    await connection.aclose()
+                raise
+            return self._release(connection, raw_response)
+
+    def _release(self, connection: _HTTPConnection, raw_response: bytes) -> Any:
+        if connection.is_reusable:
+            self._idle.append(connection)
+        return json.loads(raw_response)
+
+    async def make_request(self, method: RPCEndpoint, params: Sequence[Any]) -> Any:
+        payload = json.dumps(
+            {
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": list(params),
+                "id": next(self._request_ids),
+            }
+        ).encode("utf8")
+        response = await self._post(payload)
+        return _unwrap_response(method, params, response)
+
+    async def make_batch_request(
+        self, requests: Sequence[RPCRequestArgs]
+    ) -> Tuple[Any, ...]:
+        if not requests:
+            return ()
+
+        request_ids = tuple(next(self._request_ids) for _ in requests)
+        responses = await self._post(encode_batch_request(requests, request_ids))
+        return unwrap_batch_response(requests, responses, request_ids)
+
+
+def get_client(uri: str, pool_size: int) -> JSONRPCClientAPI:
+    """
+    Return a trio native client for the given `http://`, `https://` or IPC
+    path URI.
+    """
+    parsed = urlparse(uri)
+    if parsed.scheme in {"http", "https"}:
+        return HTTPClient(uri, pool_size=pool_size)
+    elif parsed.scheme in {"", "file", "ipc"}:
+        return IPCClient(pathlib.Path(parsed.path), pool_size=pool_size)
+    else:
+        raise ValueError(f"Unsupported provider URI: {uri}")
@@ -2,14 +2,34 @@ import argparse
 import logging
 import os
 import sys
+from typing import Optional, Tuple
 
 from async_service import background_trio_service
-from sqlalchemy import create_engine
+from eth_typing import URI, BlockNumber
+from sqlalchemy import MetaData, create_engine
 from sqlalchemy.engine import Engine
+import trio
+from web3 import Web3
+from web3.providers.auto import load_provider_from_uri
+from web3.providers.ipc import get_default_ipc_path
 
+from cthaeh import compact, flat_logs
 from cthaeh.app import Application
-from cthaeh.models import Base
+from cthaeh.cache import BlockCache, get_default_cache_path
+from cthaeh.client import JSONRPCClientAPI, Web3Client, get_client
+from cthaeh.commit import CommitPolicy
+from cthaeh.exfiltration import Exfiltrator
+from cthaeh.indexes import IndexBuilder, create_tables_without_indexes
+from cthaeh.models import Base, query_row_counts
+from cthaeh.partitions import create_partitioned_flat_logs
+from cthaeh.pool import NodePool
+from cthaeh.retention import RetentionPolicy
+from cthaeh.retry import RetryingClient
+from cthaeh.rows import LoadableBlock
 from cthaeh.session import Session
+from cthaeh.sqlite import SQLiteProfile, is_sqlite
+from cthaeh.topics import configure_topic_dictionary
+from cthaeh.writer import DatabaseWriterAPI, ThreadedWriter
 from cthaeh.xdg import get_xdg_cthaeh_root
 
 logger = logging.getLogger("cthaeh")
@@ -31,31 +51,132 @@ def _get_engine(args: argparse.Namespace) -> Engine:
     return create_engine(database_url)
 
 
+def _get_node_client(args: argparse.Namespace, provider_uri: str) -> JSONRPCClientAPI:
+    if args.native_client:
+        return get_client(provider_uri, pool_size=args.client_pool_size)
+    else:
+        return Web3Client(Web3(load_provider_from_uri(URI(provider_uri))))
+
+
+def _get_client(args: argparse.Namespace) -> JSONRPCClientAPI:
+    if args.provider_uris is None:
+        provider_uris = [get_default_ipc_path()]
+    else:
+        provider_uris = args.provider_uris
+
+    logger.info("Using providers: %s", ", ".join(provider_uris))
+
+    client: JSONRPCClientAPI
+    if len(provider_uris) == 1:
+        client = _get_node_client(args, provider_uris[0])
+    else:
+        client = NodePool(
+            tuple(
+                (provider_uri, _get_node_client(args, provider_uri))
+                for provider_uri in provider_uris
+            )
+        )
+
+    return RetryingClient(
+        client,
+        max_retries=args.request_retries,
+        backoff=args.retry_backoff,
+        timeout=args.request_timeout,
+        hedge_percentile=args.hedge_percentile,
+    )
+
+
+def _get_cache(args: argparse.Namespace, default: bool = False) -> Optional[BlockCache]:
+    if args.block_cache is None and not default:
+        return None
+    elif args.block_cache is None or args.block_cache is True:
+        cache_path = get_default_cache_path()
+    else:
+        cache_path = args.block_cache
+
+    logger.info("Using block cache: %s", cache_path)
+
+    return BlockCache(cache_path, max_size=args.block_cache_size * 1024 * 1024)
+
+
+def _create_schema(args: argparse.Namespace, engine: Engine) -> None:
+    metadata = compact.metadata if args.compact_schema else Base.metadata
+    all_metadata = (metadata, flat_logs.metadata) if args.flat_logs else (metadata,)
+    if args.log_partition_width is not None:
+        # The partitioned table is created first, so that it is not created
+        # again below without partitions.
+        try:
+            create_partitioned_flat_logs(engine, args.log_partition_width)
+        except ValueError as err:
+            logger.error("%s", err)
+            sys.exit(1)
+        all_metadata = (metadata, flat_logs.metadata)
+
+    for metadata in all_metadata:
+        if args.defer_indexes:
+            create_tables_without_indexes(engine, metadata)
+        else:
+            metadata.create_all(engine)
+
+
+def _get_metadata(engine: Engine) -> Tuple[MetaData, ...]:
+    if compact.uses_compact_schema(engine):
+        return (compact.metadata, flat_logs.metadata)
+    else:
+        return (Base.metadata, flat_logs.metadata)
+
+
 async def do_initialize_database(args: argparse.Namespace) -> None:
     # Establish database connections
     engine = _get_engine(args)
 
-    Base.metadata.create_all(engine)
+    _create_schema(args, engine)
     sys.exit(0)
 
 
+async def do_count_rows(args: argparse.Namespace) -> None:
+    engine = _get_engine(args)
+    if compact.uses_compact_schema(engine):
+        logger.error("Counting rows is not supported for the compact schema")
+        sys.exit(1)
+
+    Session.configure(bind=engine)  # type: ignore
+    session = Session()
+    row_counts = query_row_counts(session, args.start_block or 0, args.end_block)
+    for table_name, row_count in row_counts.items():
+        print(f"{table_name + ':':<18}{row_count}")
+    print(f"{'total:':<18}{sum(row_counts.values())}")
+
+
 MEMORY_DB = "sqlite:///:memory:"
 
 
 async def do_main(args: argparse.Namespace) -> None:
     # Establish database connections
     engine = _get_engine(args)
+    if is_sqlite(engine):
+        sqlite_profile: Optional[SQLiteProfile] = SQLiteProfile(
+            engine, backfill=args.sqlite_backfill
+        )
+    else:
+        sqlite_profile = None
+    configure_topic_dictionary(engine, args.max_known_topics)
     Session.configure(bind=engine)  # type: ignore
     session = Session()
 
     # Ensure database schema is present
     if args.database_url == MEMORY_DB:
-        Base.metadata.create_all(engine)
+        _create_schema(args, engine)
+        # Each thread has a database of its own when it is in memory, so
+        # writes are made on the event loop.
+        writer: Optional[DatabaseWriterAPI] = None
+    else:
+        writer = ThreadedWriter(Session)
 
     start_block = args.start_block
     end_block = args.end_block
 
-    from web3.auto.ipc import w3
+    client = _get_client(args)
 
     if args.disable_jsonrpc:
         ipc_path = None
@@ -64,15 +185,111 @@ async def do_main(args: argparse.Namespace) -> None:
     else:
         ipc_path = get_xdg_cthaeh_root() / "jsonrpc.ipc"
 
+    if args.retain_blocks is None and args.retain_age is None:
+        retention_policy: Optional[RetentionPolicy] = None
+    elif compact.uses_compact_schema(engine):
+        logger.error("Pruning is not supported for the compact schema")
+        sys.exit(1)
+    else:
+        retention_policy = RetentionPolicy(
+            max_blocks=args.retain_blocks, max_age=args.retain_age
+        )
+
+    if args.max_concurrency is not None and args.min_concurrency is None:
+        min_concurrency = 1
+    else:
+        min_concurrency = args.min_concurrency
+
     app = Application(
-        w3,
+        client,
         session,
         start_block=start_block,
         end_block=end_block,
         concurrency=args.concurrency,
         ipc_path=ipc_path,
+        batch_size=args.batch_size,
+        min_concurrency=min_concurrency,
+        max_concurrency=args.max_concurrency,
+        logs_only=args.logs_only,
+        cache=_get_cache(args),
+        window_size=args.fetch_window,
+        head_poll_interval=args.head_poll_interval,
+        extraction_workers=args.extraction_workers,
+        load_batch_size=args.load_batch_size,
+        sqlite_profile=sqlite_profile,
+        index_builder=IndexBuilder(engine, *_get_metadata(engine)),
+        writer=writer,
+        commit_policy=CommitPolicy(
+            max_blocks=args.commit_max_blocks,
+            max_rows=args.commit_max_rows,
+            max_bytes=args.commit_max_bytes,
+            max_age=args.commit_max_age,
+            target_latency=args.commit_target_latency,
+        ),
+        retention_policy=retention_policy,
+        prune_batch_size=args.prune_batch_size,
+        prune_interval=args.prune_interval,
     )
 
     logger.info("Started main process (pid=%d)", os.getpid())
     async with background_trio_service(app) as manager:
         await manager.wait_finished()
+
+
+async def do_cache_stats(args: argparse.Namespace) -> None:
+    cache = _get_cache(args, default=True)
+    assert cache is not None
+
+    stats = cache.get_stats()
+    print(f"Path:     {cache.path}")
+    print(f"Blocks:   {stats.num_blocks}")
+    if stats.num_blocks:
+        print(f"Range:    #{stats.lowest_block} - #{stats.highest_block}")
+    print(f"Segments: {stats.num_segments}")
+    print(
+        f"Size:     {stats.size / 1024 / 1024:.1f} / {stats.max_size // 1024 // 1024} MiB"
+    )
+
+
+async def do_cache_prefill(args: argparse.Namespace) -> None:
+    if args.end_block is None:
+        logger.error("Prefilling the block cache requires --end-block")
+        sys.exit(1)
+
+    cache = _get_cache(args, default=True)
+    client = _get_client(args)
+
+    start_block = BlockNumber(args.start_block or 0)
+    block_send_channel, block_receive_channel = trio.open_memory_channel[LoadableBlock](
+        128
+    )
+    exfiltrator = Exfiltrator(
+        client=client,
+        block_send_channel=block_send_channel,
+        start_at=start_block,
+        end_at=args.end_block,
+        concurrency_factor=args.concurrency,
+        batch_size=args.batch_size,
+        min_concurrency_factor=args.min_concurrency,
+        max_concurrency_factor=args.max_concurrency,
+        cache=cache,
+        window_size=args.fetch_window,
+        extraction_workers=args.extraction_workers,
+    )
+
+    async with background_trio_service(client):
+        async with background_trio_service(exfiltrator):
+            num_blocks = 0
+            async with block_receive_channel:
+                async for _ in block_receive_channel:  # noqa: F841
+                    num_blocks += 1
+                    if num_blocks % 1000 == 0:
+                        logger.info("Cached %d blocks", num_blocks)
+
+    stats = exfiltrator.get_stats()
+    logger.info(
+        "Prefilled block cache: #%d - #%d (%d already cached)",
+        start_block,
+        args.end_block - 1,
+        stats["cache_hits"],
+    )
@@ -0,0 +1,153 @@
+"""
+Decide when the loader commits.
+
+Imported batches accumulate in the open transaction until enough blocks,
+rows or bytes have been imported, or until the oldest uncommitted import
+reaches a maximum age, whichever comes first.  Larger commits amortize the
+cost of each commit, while the age limit bounds how long an imported block
+waits to become visible once the importer has caught up with the chain.
+
+The row limit adapts to how long commits take, so that a commit stays
+around a target latency as the database grows or the machine gets busier.
+"""
+import logging
+import math
+from typing import Any, Dict, Optional
+
+from cthaeh.ema import EMA
+
+DEFAULT_MAX_BLOCKS = 256
+DEFAULT_MAX_ROWS = 200_000
+DEFAULT_MIN_ROWS = 1000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_AGE = 1.0
+DEFAULT_TARGET_LATENCY = 0.5
+
+
+class CommitPolicy:
+    """
+    Track what has been imported since the last commit and decide when to
+    commit next.
+
+    - A commit is due once ``max_blocks`` blocks, ``row_limit`` rows or
+      ``max_bytes`` bytes have been imported, or ``max_age`` seconds after
+      the first uncommitted import.
+    - A commit that takes longer than ``target_latency`` halves the row
+      limit, and a commit of a full ``row_limit`` rows that takes less than
+      half of it grows the row limit by a quarter.  The row limit is kept
+      between ``min_rows`` and ``max_rows``.
+    """
+
+    logger = logging.getLogger("cthaeh.commit.CommitPolicy")
+
+    def __init__(
+        self,
+        max_blocks: int = DEFAULT_MAX_BLOCKS,
+        max_rows: int = DEFAULT_MAX_ROWS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: float = DEFAULT_MAX_AGE,
+        target_latency: float = DEFAULT_TARGET_LATENCY,
+        min_rows: int = DEFAULT_MIN_ROWS,
+    ) -> None:
+        if max_blocks < 1:
+            raise ValueError(f"Max blocks must be at least 1: {max_blocks}")
+        if not 1 <= min_rows <= max_rows:
+            raise ValueError(
+                f"Invalid row bounds: min_rows={min_rows} max_rows={max_rows}"
+            )
+        if max_bytes < 1:
+            raise ValueError(f"Max bytes must be at least 1: {max_bytes}")
+        if max_age <= 0:
+            raise ValueError(f"Max age must be positive: {max_age}")
+        if target_latency <= 0:
+            raise ValueError(f"Target latency must be positive: {target_latency}")
+
+        self.max_blocks = max_blocks
+        self.max_rows = max_rows
+        self.min_rows = min_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.target_latency = target_latency
+
+        self.row_limit = max_rows
+
+        self.pending_blocks = 0
+        self.pending_rows = 0
+        self.pending_bytes = 0
+        self._first_pending_at: Optional[float] = None
+
+        self._latency_ema: Optional[EMA] = None
+
+    @property
+    def has_pending(self) -> bool:
+        return self._first_pending_at is not None
+
+    @property
+    def deadline(self) -> float:
+        """
+        The time at which the age limit makes a commit due, or infinity if
+        nothing is waiting to be committed.
+        """
+        if self._first_pending_at is None:
+            return math.inf
+        else:
+            return self._first_pending_at + self.max_age
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self._latency_ema is None:
+            return None
+        return self._latency_ema.value
+
+    def record_import(
+        self, num_blocks: int, num_rows: int, num_bytes: int, now: float
+    ) -> None:
+        if self._first_pending_at is None:
+            self._first_pending_at = now
+        self.pending_blocks += num_blocks
+        self.pending_rows += num_rows
+        self.pending_bytes += num_bytes
+
+    def should_commit(self, now: float) -> bool:
+        if not self.has_pending:
+            return False
+        return any(
+            (
+                self.pending_blocks >= self.max_blocks,
+                self.pending_rows >= self.row_limit,
+                self.pending_bytes >= self.max_bytes,
+                now >= self.deadline,
+            )
+        )
+
+    def record_commit(self, latency: float) -> None:
+        if self._latency_ema is None:
+            self._latency_ema = EMA(latency, 0.2)
+        else:
+            self._latency_ema.update(latency)
+
+        # Any slow commit shrinks the limit, but only a fast commit that was
+        # cut short by the row limit shows that the limit could be higher.
+        if latency > self.target_latency:
+            self._set_row_limit(self.row_limit // 2)
+        elif latency < self.target_latency / 2 and self.pending_rows >= self.row_limit:
+            self._set_row_limit(self.row_limit + self.row_limit // 4)
+
+        self.pending_blocks = 0
+        self.pending_rows = 0
+        self.pending_bytes = 0
+        self._first_pending_at = None
+
+    def _set_row_limit(self, value: int) -> None:
+        previous = self.row_limit
+        self.row_limit = min(self.max_rows, max(self.min_rows, value))
+
+        if self.row_limit != previous:
+            self.logger.debug("Commit row limit: %d -> %d", previous, self.row_limit)
+
+    def get_stats(self) -> Dict[str, Any]:
+        latency = self.latency
+        return {
+            "commit_rows": self.row_limit,
+            "commit_ms": "-" if latency is None else int(latency * 1000),
+        }
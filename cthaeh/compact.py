@@ -0,0 +1,292 @@
+"""
+A compact variant of the database schema.
+
+The schema in `cthaeh.models` relates every table through 32 byte hashes,
+which are repeated in the primary key of each table, in every foreign key
+that refers to it, and in the indexes on both.  In the compact schema
+headers, transactions (and with them receipts) and logs are instead given
+integer keys as they are imported, and relate to each other through those.
+Their hashes are kept once, in a unique column, to look them up by.
+
+The columns of each table otherwise match those of the ORM models, so that
+queries which only touch those columns work with either schema.  Whether a
+database uses the compact schema is detected from its `header` table.
+
+Keys are allocated by the importer, one past the highest key in use, which
+relies on there being a single importer for a database.
+"""
+from typing import Any, Dict, Sequence
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    MetaData,
+    Table,
+    UniqueConstraint,
+    func,
+    inspect,
+    orm,
+    select,
+)
+from sqlalchemy.engine import Engine
+
+from cthaeh.rows import BatchRows, Mapping
+from cthaeh.topics import get_topic_dictionary, insert_topics
+
+metadata = MetaData()
+
+# On SQLite only an `INTEGER PRIMARY KEY` is stored as the row id itself.
+KeyType = BigInteger().with_variant(Integer(), "sqlite")
+
+header = Table(
+    "header",
+    metadata,
+    Column("id", KeyType, primary_key=True, autoincrement=False),
+    Column("hash", LargeBinary(32), nullable=False, unique=True),
+    Column("is_canonical", Boolean, nullable=False),
+    Column("_parent_hash", LargeBinary(32), nullable=True, index=True),
+    Column("uncles_hash", LargeBinary(32), nullable=False),
+    Column("coinbase", LargeBinary(20), nullable=False),
+    Column("state_root", LargeBinary(32), nullable=False),
+    Column("transaction_root", LargeBinary(32), nullable=False),
+    Column("receipt_root", LargeBinary(32), nullable=False),
+    Column("_bloom", LargeBinary(1024), nullable=False),
+    Column("difficulty", LargeBinary(32), nullable=False),
+    Column("block_number", BigInteger, index=True, nullable=False),
+    Column("gas_limit", BigInteger, nullable=False),
+    Column("gas_used", BigInteger, nullable=False),
+    Column("timestamp", Integer, nullable=False),
+    Column("extra_data", LargeBinary, nullable=False),
+    Column("nonce", LargeBinary(8), nullable=False),
+)
+
+block = Table(
+    "block",
+    metadata,
+    Column("header_id", KeyType, ForeignKey("header.id"), primary_key=True),
+)
+
+blockuncle = Table(
+    "blockuncle",
+    metadata,
+    Column("block_header_id", KeyType, ForeignKey("block.header_id"), primary_key=True),
+    Column("idx", Integer, primary_key=True),
+    Column("uncle_id", KeyType, ForeignKey("header.id"), nullable=False),
+    UniqueConstraint("block_header_id", "uncle_id"),
+)
+
+transaction = Table(
+    "transaction",
+    metadata,
+    Column("id", KeyType, primary_key=True, autoincrement=False),
+    Column("hash", LargeBinary(32), nullable=False, unique=True),
+    Column(
+        "block_header_id",
+        KeyType,
+        ForeignKey("block.header_id"),
+        nullable=True,
+        index=True,
+    ),
+    Column("nonce", BigInteger, nullable=False),
+    Column("gas_price", BigInteger, nullable=False),
+    Column("gas", BigInteger, nullable=False),
+    Column("to", LargeBinary(20), nullable=True),
+    Column("value", LargeBinary(32), nullable=False),
+    Column("data", LargeBinary, nullable=False),
+    Column("v", LargeBinary(32), nullable=False),
+    Column("r", LargeBinary(32), nullable=False),
+    Column("s", LargeBinary(32), nullable=False),
+    Column("sender", LargeBinary(20), nullable=False),
+)
+
+blocktransaction = Table(
+    "blocktransaction",
+    metadata,
+    Column("block_header_id", KeyType, ForeignKey("block.header_id"), primary_key=True),
+    Column("idx", Integer, primary_key=True),
+    Column("transaction_id", KeyType, ForeignKey("transaction.id"), nullable=False),
+    Index("ix_blocktransaction_transaction_id", "transaction_id"),
+)
+
+receipt = Table(
+    "receipt",
+    metadata,
+    Column("transaction_id", KeyType, ForeignKey("transaction.id"), primary_key=True),
+    Column("state_root", LargeBinary(32), nullable=False),
+    Column("gas_used", BigInteger, nullable=False),
+    Column("_bloom", LargeBinary(1024), nullable=False),
+)
+
+log = Table(
+    "log",
+    metadata,
+    Column("id", KeyType, primary_key=True, autoincrement=False),
+    Column(
+        "receipt_transaction_id",
+        KeyType,
+        ForeignKey("receipt.transaction_id"),
+        nullable=False,
+    ),
+    Column("idx", Integer, nullable=False),
+    Column("address", LargeBinary(20), index=True, nullable=False),
+    Column("data", LargeBinary, nullable=False),
+    UniqueConstraint("receipt_transaction_id", "idx"),
+)
+
+topic = Table("topic", metadata, Column("topic", LargeBinary(32), primary_key=True))
+
+logtopic = Table(
+    "logtopic",
+    metadata,
+    Column("id", KeyType, primary_key=True),
+    Column("idx", Integer, nullable=False),
+    Column(
+        "topic_topic",
+        LargeBinary(32),
+        ForeignKey("topic.topic"),
+        index=True,
+        nullable=False,
+    ),
+    Column("log_id", KeyType, ForeignKey("log.id"), index=True, nullable=False),
+    UniqueConstraint("idx", "log_id", name="ix_idx_log_id"),
+    Index("ix_idx_topic_topic_log_id", "idx", "topic_topic", "log_id"),
+)
+
+
+def uses_compact_schema(engine: Engine) -> bool:
+    inspector = inspect(engine)
+    if "header" not in inspector.get_table_names():
+        return False
+    return any(column["name"] == "id" for column in inspector.get_columns("header"))
+
+
+def _allocate_keys(connection: Any, table: Table, count: int) -> range:
+    last_key = connection.execute(select([func.max(table.c.id)])).scalar() or 0
+    return range(last_key + 1, last_key + 1 + count)
+
+
+def _executemany(connection: Any, table: Table, mappings: Sequence[Mapping]) -> None:
+    if mappings:
+        connection.execute(table.insert(), mappings)
+
+
+def import_batch_rows_compact(session: orm.Session, rows: BatchRows) -> None:
+    connection = session.connection()
+
+    header_ids = _allocate_keys(connection, header, len(rows.headers))
+    header_id_by_hash: Dict[object, int] = {
+        mapping["hash"]: header_id
+        for mapping, header_id in zip(rows.headers, header_ids)
+    }
+    transaction_ids = _allocate_keys(connection, transaction, len(rows.transactions))
+    transaction_id_by_hash: Dict[object, int] = {
+        mapping["hash"]: transaction_id
+        for mapping, transaction_id in zip(rows.transactions, transaction_ids)
+    }
+    log_ids = _allocate_keys(connection, log, len(rows.logs))
+
+    _executemany(
+        connection,
+        header,
+        tuple(
+            dict(mapping, id=header_id)
+            for mapping, header_id in zip(rows.headers, header_ids)
+        ),
+    )
+    _executemany(
+        connection,
+        block,
+        tuple(
+            {"header_id": header_id_by_hash[mapping["header_hash"]]}
+            for mapping in rows.blocks
+        ),
+    )
+    _executemany(
+        connection,
+        transaction,
+        tuple(
+            dict(
+                {
+                    key: value
+                    for key, value in mapping.items()
+                    if key != "block_header_hash"
+                },
+                id=transaction_id,
+                block_header_id=header_id_by_hash[mapping["block_header_hash"]],
+            )
+            for mapping, transaction_id in zip(rows.transactions, transaction_ids)
+        ),
+    )
+    _executemany(
+        connection,
+        receipt,
+        tuple(
+            {
+                "transaction_id": transaction_id_by_hash[mapping["transaction_hash"]],
+                "state_root": mapping["state_root"],
+                "gas_used": mapping["gas_used"],
+                "_bloom": mapping["_bloom"],
+            }
+            for mapping in rows.receipts
+        ),
+    )
+    _executemany(
+        connection,
+        blockuncle,
+        tuple(
+            {
+                "block_header_id": header_id_by_hash[mapping["block_header_hash"]],
+                "idx": mapping["idx"],
+                "uncle_id": header_id_by_hash[mapping["uncle_hash"]],
+            }
+            for mapping in rows.block_uncles
+        ),
+    )
+    _executemany(
+        connection,
+        blocktransaction,
+        tuple(
+            {
+                "block_header_id": header_id_by_hash[mapping["block_header_hash"]],
+                "idx": mapping["idx"],
+                "transaction_id": transaction_id_by_hash[mapping["transaction_hash"]],
+            }
+            for mapping in rows.block_transactions
+        ),
+    )
+
+    insert_topics(
+        session,
+        get_topic_dictionary(session).stage(
+            session, (topic_value for _, _, topic_value in rows.log_topics)
+        ),
+    )
+    _executemany(
+        connection,
+        log,
+        tuple(
+            {
+                "id": log_id,
+                "receipt_transaction_id": transaction_id_by_hash[
+                    mapping["receipt_hash"]
+                ],
+                "idx": mapping["idx"],
+                "address": mapping["address"],
+                "data": mapping["data"],
+            }
+            for mapping, log_id in zip(rows.logs, log_ids)
+        ),
+    )
+    _executemany(
+        connection,
+        logtopic,
+        tuple(
+            {"idx": idx, "topic_topic": topic_value, "log_id": log_ids[log_offset]}
+            for log_offset, idx, topic_value in rows.log_topics
+        ),
+    )
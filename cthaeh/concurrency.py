@@ -0,0 +1,118 @@
+import logging
+from typing import Optional
+
+import trio
+
+from cthaeh.ema import EMA
+
+
+class ConcurrencyController:
+    """
+    Tune the number of in-flight block fetches using additive-increase /
+    multiplicative-decrease (AIMD) control.
+
+    - Every successful fetch grows the target by ``1 / target`` so that the
+      target grows by roughly one per round of fetches.
+    - A failed fetch, or smoothed latency rising above ``latency_tolerance``
+      times the best latency seen, shrinks the target by ``backoff``.  At most
+      one decrease is applied per round of fetches.
+    - While the reorder window holds more blocks than the target, fetches
+      are completing out of order faster than they can be relayed and the
+      target is held where it is.
+
+    The target is always kept between ``minimum`` and ``maximum``.  When they
+    are equal the concurrency is fixed.
+    """
+
+    logger = logging.getLogger("cthaeh.concurrency.ConcurrencyController")
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        latency_tolerance: float = 2.0,
+        backoff: float = 0.75,
+        smoothing_factor: float = 0.1,
+    ) -> None:
+        if not 1 <= minimum <= initial <= maximum:
+            raise ValueError(
+                f"Invalid concurrency bounds: minimum={minimum} initial={initial} "
+                f"maximum={maximum}"
+            )
+        if not 0 < backoff < 1:
+            raise ValueError(f"Backoff must be between 0 and 1: {backoff}")
+        if latency_tolerance <= 1:
+            raise ValueError(
+                f"Latency tolerance must be greater than 1: {latency_tolerance}"
+            )
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self._latency_tolerance = latency_tolerance
+        self._backoff = backoff
+        self._smoothing_factor = smoothing_factor
+
+        self._target = float(initial)
+        self.limiter = trio.CapacityLimiter(initial)
+
+        self._latency_ema: Optional[EMA] = None
+        self._baseline_latency: Optional[float] = None
+        self._completions_since_decrease = 0
+
+    @property
+    def target(self) -> int:
+        return self.limiter.total_tokens  # type: ignore
+
+    @property
+    def is_fixed(self) -> bool:
+        return self.minimum == self.maximum
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self._latency_ema is None:
+            return None
+        return self._latency_ema.value
+
+    def record_success(self, latency: float, buffer_depth: int = 0) -> None:
+        self._completions_since_decrease += 1
+
+        if self._latency_ema is None:
+            self._latency_ema = EMA(latency, self._smoothing_factor)
+        else:
+            self._latency_ema.update(latency)
+        smoothed_latency = self._latency_ema.value
+
+        # Let the baseline drift upwards slowly so that a permanent change in
+        # the node's latency does not pin the target at the minimum forever.
+        if self._baseline_latency is None:
+            self._baseline_latency = smoothed_latency
+        else:
+            self._baseline_latency = min(
+                smoothed_latency, self._baseline_latency * 1.001
+            )
+
+        if smoothed_latency > self._baseline_latency * self._latency_tolerance:
+            self._decrease()
+        elif buffer_depth > self.target:
+            pass
+        else:
+            self._set_target(self._target + 1 / self._target)
+
+    def record_error(self) -> None:
+        self._completions_since_decrease += 1
+        self._decrease()
+
+    def _decrease(self) -> None:
+        if self._completions_since_decrease < self.target:
+            return
+        self._completions_since_decrease = 0
+        self._set_target(self._target * self._backoff)
+
+    def _set_target(self, value: float) -> None:
+        previous = self.target
+        self._target = min(self.maximum, max(self.minimum, value))
+        self.limiter.total_tokens = int(self._target)
+
+        if self.target != previous:
+            self.logger.debug("Concurrency target: %d -> %d", previous, self.target)
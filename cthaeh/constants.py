@@ -1,7 +1,9 @@
-from eth_typing import Hash32
+from eth_typing import Address, Hash32
 
 ZERO_HASH32 = Hash32(32 * b"\x00")
 
+ZERO_ADDRESS = Address(20 * b"\x00")
+
 GENESIS_PARENT_HASH = ZERO_HASH32
 
 EMPTY_SHA3 = Hash32(
@@ -10,3 +12,6 @@ EMPTY_SHA3 = Hash32(
 BLANK_ROOT_HASH = Hash32(
     b"V\xe8\x1f\x17\x1b\xccU\xa6\xff\x83E\xe6\x92\xc0\xf8n\x5bH\xe0\x1b\x99l\xad\xc0\x01b/\xb5\xe3c\xb4!"  # noqa: E501
 )
+
+# An uncle is at most this many blocks older than the block including it.
+MAX_UNCLE_DEPTH = 6
@@ -1,19 +1,44 @@
-import bisect
-import collections
 import itertools
 import logging
-import math
-from typing import Deque, Iterator, Optional, Sequence, cast
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple, Union, cast
 
 from async_service import Service
 from eth_typing import BlockNumber, Hash32
-from eth_utils import to_bytes, to_canonical_address, to_hex, to_int, to_tuple
+from eth_utils import (
+    ValidationError,
+    to_bytes,
+    to_canonical_address,
+    to_hex,
+    to_int,
+    to_tuple,
+)
 import trio
 from web3 import Web3
-from web3.types import BlockData, LogReceipt, TxData, TxReceipt, Uncle
+from web3._utils.method_formatters import get_result_formatters
+from web3._utils.rpc_abi import RPC
+from web3.types import BlockData, LogReceipt, RPCEndpoint, TxData, TxReceipt, Uncle
 
 from cthaeh._utils import gather
+from cthaeh.batch import BatchRequestError, RPCRequestArgs, chunk_requests
+from cthaeh.block_batch import BlockBatch
+from cthaeh.cache import BlockCache
+from cthaeh.client import HTTPError, JSONRPCClientAPI, RPCError, Web3Client
+from cthaeh.concurrency import ConcurrencyController
+from cthaeh.extraction import (
+    RawBlockData,
+    decode_hash32,
+    decode_hex,
+    extract_raw_block_data,
+)
+from cthaeh.head import DEFAULT_POLL_INTERVAL, HeadTracker
 from cthaeh.ir import Block, Header, Log, Receipt, Transaction
+from cthaeh.reorder import ReorderWindow
+from cthaeh.rows import BatchRows, LoadableBlock
+from cthaeh.workers import ExtractionPool
+
+
+class BlockNotFound(Exception):
+    pass
 
 
 def iter_block_numbers(
@@ -25,22 +50,126 @@ def iter_block_numbers(
         return (BlockNumber(value) for value in range(start_at, end_at))
 
 
+# The default size of the reorder window, as a multiple of the highest
+# concurrency.
+DEFAULT_WINDOW_FACTOR = 4
+
+# How long to wait, and how many times, before giving up on a block at the
+# head which the node does not have yet.
+NOT_FOUND_RETRY_DELAY = 0.25
+MAX_NOT_FOUND_RETRIES = 20
+
+
 class Exfiltrator(Service):
     logger = logging.getLogger("cthaeh.exfiltration")
 
     def __init__(
         self,
-        w3: Web3,
-        block_send_channel: trio.abc.SendChannel[Block],
+        client: JSONRPCClientAPI,
+        block_send_channel: trio.abc.SendChannel[LoadableBlock],
         start_at: BlockNumber,
         end_at: Optional[BlockNumber],
         concurrency_factor: int,
+        batch_size: Optional[int] = None,
+        min_concurrency_factor: Optional[int] = None,
+        max_concurrency_factor: Optional[int] = None,
+        cache: Optional[BlockCache] = None,
+        window_size: Optional[int] = None,
+        head_poll_interval: float = DEFAULT_POLL_INTERVAL,
+        extraction_workers: Optional[int] = None,
+        load_batch_size: Optional[int] = None,
     ) -> None:
-        self.w3 = w3
+        if load_batch_size is not None and load_batch_size < 1:
+            raise ValueError(f"Load batch size must be positive: {load_batch_size}")
+
+        self.client = client
+        self.cache = cache
         self.start_at = start_at
         self.end_at = end_at
-        self._concurrency_factor = concurrency_factor
+        # Without an end block fetching follows the head of the chain.
+        self._head: Optional[HeadTracker]
+        if end_at is None:
+            self._head = HeadTracker(client, poll_interval=head_poll_interval)
+        else:
+            self._head = None
+        # Blocks are extracted in worker processes, and handed on as
+        # columnar batches with their rows prepared, when there are
+        # extraction workers.
+        self._extraction_pool: Optional[ExtractionPool]
+        if extraction_workers is None:
+            self._extraction_pool = None
+        else:
+            self._extraction_pool = ExtractionPool(extraction_workers)
+        self._concurrency = ConcurrencyController(
+            initial=concurrency_factor,
+            minimum=(
+                concurrency_factor
+                if min_concurrency_factor is None
+                else min_concurrency_factor
+            ),
+            maximum=(
+                concurrency_factor
+                if max_concurrency_factor is None
+                else max_concurrency_factor
+            ),
+        )
+        if window_size is None:
+            window_size = DEFAULT_WINDOW_FACTOR * self._concurrency.maximum
+        self._window: ReorderWindow[LoadableBlock] = ReorderWindow(
+            start_at, window_size
+        )
+        self._batch_size = batch_size
+        self._load_batch_size = load_batch_size
         self._block_send_channel = block_send_channel
+        self._receipts_method: Optional[RPCEndpoint] = None
+        # Set once fetching has had to wait for the head of the chain.
+        self.caught_up = trio.Event()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            "concurrency": self._concurrency.target,
+            "window": f"{self._window.depth}/{self._window.capacity}",
+        }
+        if self.cache is not None:
+            stats["cache_hits"] = self._cache_hits
+            stats["cache_misses"] = self._cache_misses
+        if self._head is not None:
+            stats["head"] = self._head.head
+        return stats
+
+    async def _fetch_block(self, block_number: int) -> LoadableBlock:
+        if self.cache is None and self._extraction_pool is None:
+            return await fetch_block(
+                self.client, block_number, self._batch_size, self._receipts_method
+            )
+
+        raw_block = await self._fetch_raw_block(block_number)
+        if self._extraction_pool is None:
+            return extract_raw_block_data(raw_block)
+        else:
+            return await self._extraction_pool.prepare(raw_block)
+
+    async def _fetch_raw_block(self, block_number: int) -> RawBlockData:
+        if self.cache is None:
+            return await fetch_raw_block(
+                self.client, block_number, self._batch_size, self._receipts_method
+            )
+
+        # The cache holds whichever version of a block was fetched first, so
+        # it is only suited to re-importing history that will not reorg.
+        raw_block = await trio.to_thread.run_sync(self.cache.get, block_number)
+        if raw_block is None:
+            self._cache_misses += 1
+            raw_block = await fetch_raw_block(
+                self.client, block_number, self._batch_size, self._receipts_method
+            )
+            await trio.to_thread.run_sync(self.cache.put, raw_block)
+        else:
+            self._cache_hits += 1
+
+        return raw_block
 
     async def run(self) -> None:
         self.logger.info(
@@ -48,118 +177,185 @@ class Exfiltrator(Service):
             self.start_at,
             "HEAD" if self.end_at is None else self.end_at,
         )
-        semaphor = trio.Semaphore(
-            self._concurrency_factor, max_value=self._concurrency_factor
-        )
 
-        (relay_send_channel, relay_receive_channel) = trio.open_memory_channel[Block](
-            self._concurrency_factor - 1
-        )
+        self._receipts_method = await probe_block_receipts_method(self.client)
+        if self._receipts_method is None:
+            self.logger.info("Node does not support whole-block receipt retrieval")
+        else:
+            self.logger.info(
+                "Using %s for whole-block receipt retrieval", self._receipts_method
+            )
+
+        if self._head is not None:
+            self.manager.run_daemon_child_service(self._head)
+        if self._extraction_pool is not None:
+            self.manager.run_daemon_child_service(self._extraction_pool)
 
-        self.manager.run_daemon_task(self._collate_and_relay, relay_receive_channel)
+        limiter = self._concurrency.limiter
+        window = self._window
 
         async def _fetch(block_number: int) -> None:
-            # TODO: handle web3 failures
             self.logger.debug("Retrieving block #%d", block_number)
-            block = await retrieve_block(self.w3, block_number)
+            started_at = trio.current_time()
+            attempt = 0
+            while True:
+                try:
+                    block = await self._fetch_block(block_number)
+                except BlockNotFound:
+                    # At the head a node may be announcing blocks that the
+                    # node serving the request does not have yet.
+                    if self._head is None or attempt >= MAX_NOT_FOUND_RETRIES:
+                        self._concurrency.record_error()
+                        raise
+                    attempt += 1
+                    await trio.sleep(NOT_FOUND_RETRY_DELAY)
+                except Exception:
+                    self._concurrency.record_error()
+                    raise
+                else:
+                    break
+            self._concurrency.record_success(
+                trio.current_time() - started_at, window.depth
+            )
             self.logger.debug("Retrieved block #%d", block_number)
-            semaphor.release()
-            await relay_send_channel.send(block)
-
+            limiter.release_on_behalf_of(block_number)
+            window.put(block_number, block)
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self._relay)
+            for block_number in iter_block_numbers(self.start_at, self.end_at):
+                # Blocks are only fetched once the head has reached them.
+                if self._head is not None:
+                    if self._head.head is not None and block_number > self._head.head:
+                        self.caught_up.set()
+                    await self._head.wait_for_block(block_number)
+                # Blocks beyond the reorder window wait for earlier blocks to
+                # be relayed, which holds fetching back when the consumer or a
+                # single slow fetch falls behind.
+                await window.reserve(block_number)
+                await limiter.acquire_on_behalf_of(block_number)
+                nursery.start_soon(_fetch, block_number)
+
+    async def _relay(self) -> None:
+        window = self._window
         async with self._block_send_channel:
-            async with relay_send_channel:
-                async with trio.open_nursery() as nursery:
-                    while self.manager.is_running:
-                        for block_number in iter_block_numbers(
-                            self.start_at, self.end_at
-                        ):
-                            await semaphor.acquire()
-                            nursery.start_soon(_fetch, block_number)
-
-    async def _collate_and_relay(
-        self, receive_channel: trio.abc.ReceiveChannel[Block]
-    ) -> None:
-        buffer: Deque[Block] = collections.deque()
-
-        concurrency_factor = self._concurrency_factor
-
-        warning_threshold = concurrency_factor + max(
-            1, int(math.ceil(math.sqrt(concurrency_factor)))
-        )
-        error_threshold = warning_threshold * 2
-        exception_threshold = error_threshold * 2
-
-        next_block_number = self.start_at
-        async with receive_channel:
-            async for block in receive_channel:
-                self.logger.debug(
-                    "Waiting for #%d, Got block #%d",
-                    next_block_number,
-                    block.header.block_number,
-                )
-                if block.header.block_number == next_block_number:
+            while self.end_at is None or window.next_key < self.end_at:
+                block = await window.get()
+                if self._load_batch_size is None:
+                    self.logger.debug("Relaying block #%d", window.next_key - 1)
                     await self._block_send_channel.send(block)
-                    next_block_number += 1  # type: ignore
-                elif block.header.block_number > next_block_number:
-                    bisect.insort_left(buffer, block)
-
-                    if len(buffer) > exception_threshold:
-                        raise Exception(
-                            f"Collation buffer exceeded reasonable limits: "
-                            f"concurrency={concurrency_factor} "
-                            f"waiting_for={next_block_number} "
-                            f"buffer={tuple(blk.header.block_number for blk in buffer)}"
-                        )
-                    elif len(buffer) > error_threshold:
-                        self.logger.error(
-                            "Collation buffer exceeded error threshold:"
-                            "threshold=%d "
-                            "concurrency=%d "
-                            "waiting_for=%d "
-                            "buffer=%s ",
-                            error_threshold,
-                            concurrency_factor,
-                            next_block_number,
-                            tuple(blk.header.block_number for blk in buffer),
-                        )
-                    elif len(buffer) > warning_threshold:
-                        self.logger.warning(
-                            "Collation buffer exceeded warning threshold:"
-                            "threshold=%d "
-                            "concurrency=%d "
-                            "waiting_for=%d "
-                            "buffer=%s ",
-                            error_threshold,
-                            concurrency_factor,
-                            next_block_number,
-                            tuple(blk.header.block_number for blk in buffer),
-                        )
-
                     continue
+
+                # Whichever of the following blocks have already arrived are
+                # relayed along with it as a single batch, so batches grow
+                # while the loader is falling behind.
+                blocks = [block]
+                while len(blocks) < self._load_batch_size:
+                    try:
+                        blocks.append(window.get_nowait())
+                    except trio.WouldBlock:
+                        break
+
+                batch: Union[BlockBatch, BatchRows]
+                if all(isinstance(item, BatchRows) for item in blocks):
+                    batch = BatchRows.concat(blocks)  # type: ignore
                 else:
-                    raise Exception(
-                        "Expected next block number {next_block_number}.  Got: {block}"
+                    batch = BlockBatch.concat(
+                        item
+                        if isinstance(item, BlockBatch)
+                        else BlockBatch.from_blocks((item,))  # type: ignore
+                        for item in blocks
                     )
+                self.logger.debug("Relaying %s", batch)
+                await self._block_send_channel.send(batch)
+
+
+# Methods which return every receipt in a block with a single request, in
+# order of preference.
+BLOCK_RECEIPTS_METHODS = (
+    RPCEndpoint("eth_getBlockReceipts"),
+    RPCEndpoint("parity_getBlockReceipts"),
+)
+
+
+async def probe_block_receipts_method(
+    client: JSONRPCClientAPI,
+) -> Optional[RPCEndpoint]:
+    """
+    Return the first of `BLOCK_RECEIPTS_METHODS` that the node supports or
+    `None` if it supports none of them.  Nodes and the gateways in front of
+    them reject unknown methods in different ways, so any of those rejections
+    counts as the method being unsupported.
+    """
+    for method in BLOCK_RECEIPTS_METHODS:
+        try:
+            result = await client.make_request(method, ["latest"])
+        except (RPCError, HTTPError, BatchRequestError, ValueError):
+            continue
+        if isinstance(result, list):
+            return method
+    return None
+
+
+async def retrieve_block_receipts(
+    client: JSONRPCClientAPI,
+    block_number: int,
+    transaction_hashes: Sequence[Hash32],
+    receipts_method: RPCEndpoint,
+) -> Tuple[Any, ...]:
+    """
+    Retrieve all of the raw receipts for a block with a single request using
+    one of the `BLOCK_RECEIPTS_METHODS`.
+    """
+    raw_receipts = await client.make_request(receipts_method, [hex(block_number)])
+
+    # Guard against the chain having re-organized between fetching the block
+    # and fetching its receipts.
+    receipt_transaction_hashes = tuple(
+        decode_hex(raw_receipt["transactionHash"]) for raw_receipt in raw_receipts
+    )
+    if receipt_transaction_hashes != tuple(transaction_hashes):
+        raise ValidationError(
+            f"Receipts returned by {receipts_method} for block #{block_number} "
+            f"do not match the block's transactions"
+        )
 
-                while buffer:
-                    if buffer[0].header.block_number == next_block_number:
-                        await self._block_send_channel.send(buffer.popleft())
-                        next_block_number += 1  # type: ignore
-                        continue
-                    break
+    return tuple(raw_receipts)
 
 
-async def retrieve_block(w3: Web3, block_number: int) -> Block:
+async def retrieve_block(
+    w3: Web3, block_number: int, receipts_method: Optional[RPCEndpoint] = None
+) -> Block:
     block_data = await trio.to_thread.run_sync(w3.eth.getBlock, block_number, True)
     transactions_data = cast(Sequence[TxData], block_data["transactions"])
 
-    transaction_hashes = tuple(to_hex(tx_data["hash"]) for tx_data in transactions_data)
-    receipts_data = await gather(
-        *(
-            (trio.to_thread.run_sync, w3.eth.getTransactionReceipt, transaction_hash)
-            for transaction_hash in transaction_hashes
+    receipts_data: Sequence[TxReceipt]
+    if receipts_method is None:
+        transaction_hashes = tuple(
+            to_hex(tx_data["hash"]) for tx_data in transactions_data
+        )
+        receipts_data = await gather(
+            *(
+                (
+                    trio.to_thread.run_sync,
+                    w3.eth.getTransactionReceipt,
+                    transaction_hash,
+                )
+                for transaction_hash in transaction_hashes
+            )
+        )
+    else:
+        raw_receipts = await retrieve_block_receipts(
+            Web3Client(w3),
+            block_number,
+            tuple(Hash32(bytes(tx_data["hash"])) for tx_data in transactions_data),
+            receipts_method,
+        )
+        receipt_formatter = get_result_formatters(RPC.eth_getTransactionReceipt)
+        receipts_data = tuple(
+            receipt_formatter(raw_receipt)  # type: ignore
+            for raw_receipt in raw_receipts
         )
-    )
 
     uncles_data = await gather(
         *(
@@ -181,6 +377,123 @@ async def retrieve_block(w3: Web3, block_number: int) -> Block:
     )
 
 
+async def retrieve_block_batched(
+    w3: Web3,
+    block_number: int,
+    max_batch_size: int,
+    receipts_method: Optional[RPCEndpoint] = None,
+) -> Block:
+    """
+    Retrieve a block the same way as `retrieve_block`, but fetch the receipts
+    and uncles using JSON-RPC batch requests of at most `max_batch_size`
+    requests each.  All of the batches for a block are in flight concurrently.
+    """
+    return await fetch_block(
+        Web3Client(w3), block_number, max_batch_size, receipts_method
+    )
+
+
+async def make_requests(
+    client: JSONRPCClientAPI,
+    requests: Sequence[RPCRequestArgs],
+    max_batch_size: Optional[int],
+) -> Tuple[Any, ...]:
+    """
+    Make the requests, as JSON-RPC batches of at most `max_batch_size`
+    requests each if it is set, and return the raw results in the same order
+    as the requests.
+    """
+    if max_batch_size is None:
+        return await gather(
+            *((client.make_request, method, params) for method, params in requests)
+        )
+    else:
+        chunk_results = await gather(
+            *(
+                (client.make_batch_request, chunk)
+                for chunk in chunk_requests(requests, max_batch_size)
+            )
+        )
+        return tuple(itertools.chain(*chunk_results))
+
+
+async def fetch_block(
+    client: JSONRPCClientAPI,
+    block_number: int,
+    max_batch_size: Optional[int] = None,
+    receipts_method: Optional[RPCEndpoint] = None,
+) -> Block:
+    """
+    Retrieve a block through a JSON-RPC client, extracting it directly from
+    the raw results.
+
+    If `max_batch_size` is set the receipts and uncles are fetched using
+    JSON-RPC batch requests of at most that many requests each, otherwise
+    each is fetched with its own request.  If `receipts_method` is set it is
+    used to fetch all of the receipts for the block with one request.
+    """
+    raw_block = await fetch_raw_block(
+        client, block_number, max_batch_size, receipts_method
+    )
+    return extract_raw_block_data(raw_block)
+
+
+async def fetch_raw_block(
+    client: JSONRPCClientAPI,
+    block_number: int,
+    max_batch_size: Optional[int] = None,
+    receipts_method: Optional[RPCEndpoint] = None,
+) -> RawBlockData:
+    """
+    Retrieve the raw JSON-RPC results which make up a block.  The arguments
+    are the same as for `fetch_block`.
+    """
+    block_data = await client.make_request(
+        RPC.eth_getBlockByNumber, (hex(block_number), True)
+    )
+    if block_data is None:
+        raise BlockNotFound(f"Block #{block_number} is not available")
+    transactions_data = block_data["transactions"]
+
+    if receipts_method is None:
+        receipt_requests = tuple(
+            (RPC.eth_getTransactionReceipt, (tx_data["hash"],))
+            for tx_data in transactions_data
+        )
+    else:
+        receipt_requests = ()
+
+    uncle_requests = tuple(
+        (RPC.eth_getUncleByBlockHashAndIndex, (block_data["hash"], hex(idx)))
+        for idx in range(len(block_data["uncles"]))
+    )
+    requests = receipt_requests + uncle_requests
+
+    if receipts_method is None:
+        num_receipts = len(receipt_requests)
+        results = await make_requests(client, requests, max_batch_size)
+        receipts_data = results[:num_receipts]
+        uncles_data = results[num_receipts:]
+    else:
+        transaction_hashes = tuple(
+            decode_hash32(tx_data["hash"]) for tx_data in transactions_data
+        )
+        uncles_data, receipts_data = await gather(
+            (make_requests, client, requests, max_batch_size),
+            (
+                retrieve_block_receipts,
+                client,
+                block_number,
+                transaction_hashes,
+                receipts_method,
+            ),
+        )
+
+    return RawBlockData(
+        block=block_data, uncles=tuple(uncles_data), receipts=tuple(receipts_data)
+    )
+
+
 def extract_block(
     block_data: BlockData,
     transactions_data: Sequence[TxData],
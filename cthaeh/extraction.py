@@ -0,0 +1,163 @@
+"""
+Extract `cthaeh.ir` objects directly from the raw JSON-RPC results returned
+by the node, without passing them through web3's result formatters.
+"""
+from typing import Any, Mapping, NamedTuple, Sequence, Tuple
+
+from eth_typing import Address, Hash32
+
+from cthaeh.ir import Block, Header, Log, Receipt, Transaction
+
+RawData = Mapping[str, Any]
+
+
+class RawBlockData(NamedTuple):
+    """
+    The raw JSON-RPC results which make up a block: the block with its full
+    transactions, its uncles and the receipts for its transactions.
+    """
+
+    block: RawData
+    uncles: Tuple[RawData, ...]
+    receipts: Tuple[RawData, ...]
+
+
+def decode_hex(value: str) -> bytes:
+    """
+    Decode a 0x-prefixed hex string, tolerating the odd lengths that nodes
+    return for quantities such as the `r` and `s` signature values.
+    """
+    digits = value[2:]
+    if len(digits) % 2:
+        return bytes.fromhex("0" + digits)
+    else:
+        return bytes.fromhex(digits)
+
+
+def decode_quantity(value: str) -> int:
+    return int(value, 16)
+
+
+def decode_quantity_bytes(value: str) -> bytes:
+    """
+    Decode a hex quantity to its minimal big-endian byte representation.
+    """
+    quantity = int(value, 16)
+    return quantity.to_bytes((quantity.bit_length() + 7) // 8 or 1, "big")
+
+
+def decode_hash32(value: str) -> Hash32:
+    decoded = decode_hex(value)
+    if len(decoded) != 32:
+        raise ValueError(f"Expected a 32 byte hash: {value!r}")
+    return Hash32(decoded)
+
+
+def decode_address(value: str) -> Address:
+    decoded = decode_hex(value)
+    if len(decoded) != 20:
+        raise ValueError(f"Expected a 20 byte address: {value!r}")
+    return Address(decoded)
+
+
+def _get_any(data: RawData, *keys: str) -> Any:
+    for key in keys:
+        if key in data:
+            return data[key]
+    raise KeyError(f"Cannot find any of {keys}: {data!r}")
+
+
+def extract_raw_block(
+    block_data: RawData,
+    transactions_data: Sequence[RawData],
+    uncles_data: Sequence[RawData],
+    receipts_data: Sequence[RawData],
+) -> Block:
+    return Block(
+        header=extract_raw_header(block_data),
+        transactions=tuple(
+            extract_raw_transaction(transaction_data)
+            for transaction_data in transactions_data
+        ),
+        uncles=tuple(
+            extract_raw_header(uncle_data, is_canonical=False)
+            for uncle_data in uncles_data
+        ),
+        receipts=tuple(
+            extract_raw_receipt(receipt_data) for receipt_data in receipts_data
+        ),
+    )
+
+
+def extract_raw_block_data(raw_block: RawBlockData) -> Block:
+    return extract_raw_block(
+        raw_block.block,
+        transactions_data=raw_block.block["transactions"],
+        uncles_data=raw_block.uncles,
+        receipts_data=raw_block.receipts,
+    )
+
+
+def extract_raw_header(block_data: RawData, is_canonical: bool = True) -> Header:
+    return Header(
+        hash=decode_hash32(block_data["hash"]),
+        difficulty=decode_quantity_bytes(block_data["difficulty"]),
+        block_number=decode_quantity(block_data["number"]),
+        gas_limit=decode_quantity(block_data["gasLimit"]),
+        timestamp=decode_quantity(block_data["timestamp"]),
+        coinbase=decode_address(block_data["miner"]),
+        parent_hash=decode_hash32(block_data["parentHash"]),
+        uncles_hash=decode_hash32(block_data["sha3Uncles"]),
+        state_root=decode_hash32(block_data["stateRoot"]),
+        transaction_root=decode_hash32(block_data["transactionsRoot"]),
+        receipt_root=decode_hash32(
+            _get_any(block_data, "receiptsRoot", "receiptRoot", "receipts_root")
+        ),
+        bloom=decode_hex(_get_any(block_data, "logsBloom", "logs_bloom")),
+        gas_used=decode_quantity(block_data["gasUsed"]),
+        extra_data=decode_hex(block_data["extraData"]),
+        nonce=decode_hex(block_data["nonce"]),
+        is_canonical=is_canonical,
+    )
+
+
+def extract_raw_transaction(transaction_data: RawData) -> Transaction:
+    if transaction_data["to"] is None:
+        to_address = None
+    else:
+        to_address = decode_address(transaction_data["to"])
+
+    return Transaction(
+        hash=decode_hash32(transaction_data["hash"]),
+        nonce=decode_quantity(transaction_data["nonce"]),
+        gas_price=decode_quantity(transaction_data["gasPrice"]),
+        gas=decode_quantity(transaction_data["gas"]),
+        to=to_address,
+        value=decode_quantity_bytes(transaction_data["value"]),
+        data=decode_hex(transaction_data["input"]),
+        v=decode_quantity_bytes(transaction_data["v"]),
+        r=decode_hex(transaction_data["r"]),
+        s=decode_hex(transaction_data["s"]),
+        sender=decode_address(transaction_data["from"]),
+    )
+
+
+def extract_raw_receipt(receipt_data: RawData) -> Receipt:
+    return Receipt(
+        state_root=Hash32(decode_hex(receipt_data["root"])),
+        gas_used=decode_quantity(receipt_data["gasUsed"]),
+        bloom=decode_hex(receipt_data["logsBloom"]),
+        logs=extract_raw_logs(receipt_data["logs"]),
+    )
+
+
+def extract_raw_logs(logs_data: Sequence[RawData]) -> Tuple[Log, ...]:
+    return tuple(extract_raw_log(log_data) for log_data in logs_data)
+
+
+def extract_raw_log(log_data: RawData) -> Log:
+    return Log(
+        address=decode_address(log_data["address"]),
+        topics=tuple(decode_hash32(topic) for topic in log_data["topics"]),
+        data=decode_hex(log_data["data"]),
+    )
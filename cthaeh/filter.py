@@ -1,12 +1,23 @@
 import logging
-from typing import Iterator, NamedTuple, Optional, Tuple, Union
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from eth_typing import Address, BlockNumber, Hash32
 from eth_utils import to_tuple
-from sqlalchemy import and_, or_, orm
+from sqlalchemy import and_, or_, orm, select
 from sqlalchemy.orm import aliased
 from sqlalchemy.sql import ClauseElement
 
+from cthaeh import compact, flat_logs
 from cthaeh.models import Block, Header, Log, LogTopic, Receipt, Transaction
 
 BlockIdentifier = BlockNumber
@@ -38,32 +49,42 @@ LOG_TOPIC_ALIASES = (logtopic_0, logtopic_1, logtopic_2, logtopic_3)
 
 
 @to_tuple
-def _construct_filters(params: FilterParams) -> Iterator[ClauseElement]:
+def _construct_filters(
+    params: FilterParams,
+    address_column: Any = Log.address,
+    block_number_column: Any = Header.block_number,
+    log_topics: Sequence[Any] = LOG_TOPIC_ALIASES,
+    topic_columns: Optional[Sequence[Any]] = None,
+) -> Iterator[ClauseElement]:
     if isinstance(params.address, tuple):
         # TODO: or
-        yield or_(*tuple(Log.address == address for address in params.address))
+        yield or_(*tuple(address_column == address for address in params.address))
     elif isinstance(params.address, bytes):
-        yield (Log.address == params.address)
+        yield (address_column == params.address)
     elif params.address is None:
         pass
     else:
         raise TypeError(f"Invalid address parameter: {params.address!r}")
 
     if isinstance(params.from_block, int):
-        yield (Header.block_number >= params.from_block)
+        yield (block_number_column >= params.from_block)
     elif params.from_block is None:
         pass
     else:
         raise TypeError(f"Invalid from_block parameter: {params.from_block!r}")
 
     if isinstance(params.to_block, int):
-        yield (Header.block_number <= params.to_block)
+        yield (block_number_column <= params.to_block)
     elif params.to_block is None:
         pass
     else:
         raise TypeError(f"Invalid to_block parameter: {params.to_block!r}")
 
-    for idx, (topic, alias) in enumerate(zip(params.topics, LOG_TOPIC_ALIASES)):
+    if topic_columns is not None:
+        yield from _construct_topic_column_filters(params, topic_columns)
+        return
+
+    for idx, (topic, alias) in enumerate(zip(params.topics, log_topics)):
         if isinstance(topic, bytes):
             yield and_(alias.idx == idx, alias.topic_topic == topic)
         elif isinstance(topic, tuple):
@@ -79,6 +100,20 @@ def _construct_filters(params: FilterParams) -> Iterator[ClauseElement]:
             raise TypeError(f"Unsupported topic at index {idx}: {topic!r}")
 
 
+def _construct_topic_column_filters(
+    params: FilterParams, topic_columns: Sequence[Any]
+) -> Iterator[ClauseElement]:
+    for idx, (topic, column) in enumerate(zip(params.topics, topic_columns)):
+        if isinstance(topic, bytes):
+            yield (column == topic)
+        elif isinstance(topic, tuple):
+            yield column.in_(topic)
+        elif topic is None:
+            pass
+        else:
+            raise TypeError(f"Unsupported topic at index {idx}: {topic!r}")
+
+
 def filter_logs(session: orm.Session, params: FilterParams) -> Tuple[Log, ...]:
     orm_filters = _construct_filters(params)
 
@@ -98,3 +133,130 @@ def filter_logs(session: orm.Session, params: FilterParams) -> Tuple[Log, ...]:
     logger.debug("PARAMS: %s  QUERY: %s", params, query)
 
     return tuple(query.all())
+
+
+class LogRecord(NamedTuple):
+    idx: int
+    transaction_index: int
+    transaction_hash: Hash32
+    block_hash: Hash32
+    block_number: BlockNumber
+    address: Address
+    data: bytes
+    topics: Tuple[Hash32, ...]
+
+
+def filter_logs_compact(
+    session: orm.Session, params: FilterParams
+) -> Tuple[LogRecord, ...]:
+    """
+    Filter the logs of a database with the compact schema, in the order
+    they appear in the chain.
+    """
+    log, transaction, header = compact.log, compact.transaction, compact.header
+    blocktransaction = compact.blocktransaction
+
+    # Each topic position is joined on its index, so that a log appears at
+    # most once, and only the positions being filtered on are joined.
+    log_topics = tuple(compact.logtopic.alias() for _ in params.topics)
+    joined = (
+        log.join(transaction, log.c.receipt_transaction_id == transaction.c.id)
+        .join(header, transaction.c.block_header_id == header.c.id)
+        .join(
+            blocktransaction,
+            and_(
+                blocktransaction.c.block_header_id == transaction.c.block_header_id,
+                blocktransaction.c.transaction_id == transaction.c.id,
+            ),
+        )
+    )
+    for idx, log_topic in enumerate(log_topics):
+        joined = joined.outerjoin(
+            log_topic, and_(log.c.id == log_topic.c.log_id, log_topic.c.idx == idx)
+        )
+
+    filters = _construct_filters(
+        params,
+        address_column=log.c.address,
+        block_number_column=header.c.block_number,
+        log_topics=tuple(log_topic.c for log_topic in log_topics),
+    )
+    query = (
+        select(
+            [
+                log.c.id,
+                log.c.idx,
+                blocktransaction.c.idx,
+                transaction.c.hash,
+                header.c.hash,
+                header.c.block_number,
+                log.c.address,
+                log.c.data,
+            ]
+        )
+        .select_from(joined)
+        .where(and_(*filters))
+        .order_by(header.c.block_number, blocktransaction.c.idx, log.c.idx)
+    )
+
+    logger.debug("PARAMS: %s  QUERY: %s", params, query)
+
+    results = session.execute(query).fetchall()
+    topics: Dict[int, List[Hash32]] = {row[0]: [] for row in results}
+    if topics:
+        topic_query = (
+            select([compact.logtopic.c.log_id, compact.logtopic.c.topic_topic])
+            .where(compact.logtopic.c.log_id.in_(tuple(topics)))
+            .order_by(compact.logtopic.c.log_id, compact.logtopic.c.idx)
+        )
+        for log_id, topic in session.execute(topic_query):
+            topics[log_id].append(Hash32(topic))
+
+    return tuple(
+        LogRecord(*row[1:], topics=tuple(topics[row[0]]))  # type: ignore
+        for row in results
+    )
+
+
+def filter_logs_flat(
+    session: orm.Session, params: FilterParams
+) -> Tuple[LogRecord, ...]:
+    """
+    Filter the logs of a database with a `flatlog` table, in the order they
+    appear in the chain.
+    """
+    flatlog = flat_logs.flatlog
+    filters = _construct_filters(
+        params,
+        address_column=flatlog.c.address,
+        block_number_column=flatlog.c.block_number,
+        topic_columns=flat_logs.TOPIC_COLUMNS,
+    )
+    query = (
+        select(
+            [
+                flatlog.c.log_index,
+                flatlog.c.transaction_index,
+                flatlog.c.transaction_hash,
+                flatlog.c.block_hash,
+                flatlog.c.block_number,
+                flatlog.c.address,
+                flatlog.c.data,
+                *flat_logs.TOPIC_COLUMNS,
+            ]
+        )
+        .where(and_(*filters))
+        .order_by(
+            flatlog.c.block_number, flatlog.c.transaction_index, flatlog.c.log_index
+        )
+    )
+
+    logger.debug("PARAMS: %s  QUERY: %s", params, query)
+
+    return tuple(
+        LogRecord(  # type: ignore
+            *row[:-4],
+            topics=tuple(Hash32(topic) for topic in row[-4:] if topic is not None),
+        )
+        for row in session.execute(query)
+    )
@@ -0,0 +1,106 @@
+"""
+A denormalized copy of the logs, to serve `eth_getLogs` without joins.
+
+Filtering logs with either schema joins each log to its receipt,
+transaction, block and header, and to one row of `logtopic` for each topic
+being filtered on.  A database may additionally have a `flatlog` table, in
+which each log is a single row carrying the block number and hash, the
+transaction hash and index, and its own index, address, data and topics.
+Its primary key puts the rows in the order they appear in the chain, and
+each of its other indexes ends in the block number, so that each filter is
+a range scan over a single index.
+
+The table is optional.  It is created alongside either schema, and once it
+exists the loader fills it in the same transaction as the rest of a batch.
+"""
+from typing import Dict, Iterator, Tuple
+
+from eth_utils import to_tuple
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Index,
+    Integer,
+    LargeBinary,
+    MetaData,
+    Table,
+    inspect,
+    orm,
+)
+from sqlalchemy.engine import Engine
+
+from cthaeh.rows import BatchRows, Mapping
+
+NUM_TOPIC_COLUMNS = 4
+
+metadata = MetaData()
+
+flatlog = Table(
+    "flatlog",
+    metadata,
+    Column("block_number", BigInteger, primary_key=True, autoincrement=False),
+    Column("transaction_index", Integer, primary_key=True, autoincrement=False),
+    Column("log_index", Integer, primary_key=True, autoincrement=False),
+    Column("block_hash", LargeBinary(32), primary_key=True),
+    Column("transaction_hash", LargeBinary(32), nullable=False),
+    Column("address", LargeBinary(20), nullable=False),
+    Column("topic0", LargeBinary(32), nullable=True),
+    Column("topic1", LargeBinary(32), nullable=True),
+    Column("topic2", LargeBinary(32), nullable=True),
+    Column("topic3", LargeBinary(32), nullable=True),
+    Column("data", LargeBinary, nullable=False),
+    Index("ix_flatlog_address_block_number", "address", "block_number"),
+    Index("ix_flatlog_topic0_block_number", "topic0", "block_number"),
+    Index("ix_flatlog_topic1_block_number", "topic1", "block_number"),
+    Index("ix_flatlog_topic2_block_number", "topic2", "block_number"),
+    Index("ix_flatlog_topic3_block_number", "topic3", "block_number"),
+)
+
+TOPIC_COLUMNS = tuple(flatlog.c[f"topic{idx}"] for idx in range(NUM_TOPIC_COLUMNS))
+
+
+def uses_flat_logs(engine: Engine) -> bool:
+    return "flatlog" in inspect(engine).get_table_names()
+
+
+@to_tuple
+def flat_log_mappings(rows: BatchRows) -> Iterator[Mapping]:
+    """
+    One row of the `flatlog` table for each log of the batch.
+    """
+    block_number_by_hash: Dict[object, object] = {
+        mapping["hash"]: mapping["block_number"] for mapping in rows.headers
+    }
+    location_by_transaction_hash: Dict[object, Tuple[object, object]] = {
+        mapping["transaction_hash"]: (mapping["block_header_hash"], mapping["idx"])
+        for mapping in rows.block_transactions
+    }
+    topics_by_log_offset: Dict[int, Dict[str, object]] = {}
+    for log_offset, idx, topic in rows.log_topics:
+        if idx < NUM_TOPIC_COLUMNS:
+            topics_by_log_offset.setdefault(log_offset, {})[f"topic{idx}"] = topic
+
+    for log_offset, mapping in enumerate(rows.logs):
+        block_hash, transaction_index = location_by_transaction_hash[
+            mapping["receipt_hash"]
+        ]
+        topics = topics_by_log_offset.get(log_offset, {})
+        yield {
+            "block_number": block_number_by_hash[block_hash],
+            "block_hash": block_hash,
+            "transaction_index": transaction_index,
+            "log_index": mapping["idx"],
+            "transaction_hash": mapping["receipt_hash"],
+            "address": mapping["address"],
+            "topic0": topics.get("topic0"),
+            "topic1": topics.get("topic1"),
+            "topic2": topics.get("topic2"),
+            "topic3": topics.get("topic3"),
+            "data": mapping["data"],
+        }
+
+
+def import_flat_logs(session: orm.Session, rows: BatchRows) -> None:
+    mappings = flat_log_mappings(rows)
+    if mappings:
+        session.connection().execute(flatlog.insert(), mappings)
@@ -0,0 +1,116 @@
+import logging
+from typing import Any, Dict, Optional
+
+from async_service import Service
+from eth_typing import BlockNumber
+import trio
+from web3._utils.rpc_abi import RPC
+
+from cthaeh._utils import TaskStatus, every
+from cthaeh.client import JSONRPCClientAPI, RPCError, SubscriptionsNotSupported
+from cthaeh.extraction import decode_quantity
+
+# The number of seconds between polls for the head when it cannot be pushed
+# by the node.
+DEFAULT_POLL_INTERVAL = 1.0
+
+# The number of seconds spent polling after a subscription is lost before
+# subscribing again.
+DEFAULT_RESUBSCRIBE_INTERVAL = 30.0
+
+
+class HeadTracker(Service):
+    """
+    Follow the head of the chain.
+
+    New heads are pushed by the node through an `eth_subscribe` subscription
+    to `newHeads` where the client supports it, so that they are known the
+    moment they arrive.  Otherwise, or while a lost subscription is being
+    re-established, the head is polled with `eth_blockNumber` every
+    `poll_interval` seconds.
+    """
+
+    logger = logging.getLogger("cthaeh.head.HeadTracker")
+
+    head: Optional[BlockNumber] = None
+
+    def __init__(
+        self,
+        client: JSONRPCClientAPI,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        resubscribe_interval: float = DEFAULT_RESUBSCRIBE_INTERVAL,
+    ) -> None:
+        self.client = client
+        self._poll_interval = poll_interval
+        self._resubscribe_interval = resubscribe_interval
+        self._changed = trio.Event()
+        self.is_subscribed = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"head": self.head, "subscribed": self.is_subscribed}
+
+    async def wait_for_block(self, block_number: int) -> BlockNumber:
+        """
+        Wait until the head has reached `block_number`, returning the head.
+        """
+        while self.head is None or self.head < block_number:
+            await self._changed.wait()
+        return self.head
+
+    def _update(self, block_number: int) -> None:
+        # Heads are only ever moved forward.  A re-organization to a shorter
+        # chain leaves the head where it was until the chain grows past it.
+        if self.head is None or block_number > self.head:
+            self.head = BlockNumber(block_number)
+            self._changed.set()
+            self._changed = trio.Event()
+
+    async def run(self) -> None:
+        while self.manager.is_running:
+            try:
+                await self._follow_subscription()
+            except SubscriptionsNotSupported as err:
+                self.logger.info("Polling for new heads: %s", err)
+                await self._poll_for(None)
+            except (OSError, RPCError, trio.BrokenResourceError) as err:
+                self.logger.warning("Lost new heads subscription: %r", err)
+                await self._poll_for(self._resubscribe_interval)
+
+    async def _follow_subscription(self) -> None:
+        send_channel, receive_channel = trio.open_memory_channel[Any](16)
+
+        async def _subscribe(
+            task_status: TaskStatus = trio.TASK_STATUS_IGNORED
+        ) -> None:
+            async with send_channel:
+                await self.client.subscribe_new_heads(
+                    send_channel, task_status=task_status
+                )
+
+        try:
+            async with trio.open_nursery() as nursery:
+                await nursery.start(_subscribe)
+                self.logger.info("Following new heads by subscription")
+                self.is_subscribed = True
+                # Catch any head which arrived before the subscription did.
+                await self._poll()
+
+                async with receive_channel:
+                    async for header in receive_channel:
+                        self._update(decode_quantity(header["number"]))
+        finally:
+            self.is_subscribed = False
+
+        raise ConnectionError("New heads subscription ended")
+
+    async def _poll(self) -> None:
+        self._update(
+            decode_quantity(await self.client.make_request(RPC.eth_blockNumber, []))
+        )
+
+    async def _poll_for(self, duration: Optional[float]) -> None:
+        with trio.move_on_after(float("inf") if duration is None else duration):
+            async for _ in every(
+                self._poll_interval, self._poll_interval
+            ):  # noqa: F841
+                await self._poll()
@@ -0,0 +1,138 @@
+"""
+Build secondary indexes after a bulk load rather than during it.
+
+Every insert has to update each index on its table, which dominates the
+cost of loading a large range of blocks.  A database can instead be created
+with only its tables, primary keys and unique constraints, and have the
+rest of its indexes built in a single pass once the range has been loaded.
+
+PostgreSQL builds each index with `CREATE INDEX CONCURRENTLY` on a
+connection of its own, so that loading carries on while it does.  Other
+databases build them through the loader's writer, which holds up loading
+until the build is done.
+"""
+import logging
+import time
+from typing import Any, Tuple
+
+from sqlalchemy import MetaData, inspect, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex, CreateTable, Index
+import trio
+
+from cthaeh.writer import DatabaseWriterAPI
+
+
+def get_deferrable_indexes(metadata: MetaData) -> Tuple[Index, ...]:
+    """
+    The indexes which may be built after loading.  Unique indexes enforce
+    constraints that loading relies on, so they are always kept.
+    """
+    return tuple(
+        index
+        for table in metadata.sorted_tables
+        for index in sorted(table.indexes, key=lambda index: index.name)
+        if not index.unique
+    )
+
+
+def create_tables_without_indexes(engine: Engine, metadata: MetaData) -> None:
+    existing_tables = set(inspect(engine).get_table_names())
+    deferrable_indexes = set(get_deferrable_indexes(metadata))
+    for table in metadata.sorted_tables:
+        if table.name in existing_tables:
+            continue
+        engine.execute(CreateTable(table))
+        for index in table.indexes:
+            if index not in deferrable_indexes:
+                engine.execute(CreateIndex(index))  # type: ignore
+
+
+class IndexBuilder:
+    """
+    Build the indexes of each `metadata` which are missing from the
+    database.  `ready` is set once none are missing.
+    """
+
+    logger = logging.getLogger("cthaeh.indexes.IndexBuilder")
+
+    def __init__(self, engine: Engine, *metadata: MetaData) -> None:
+        self._engine = engine
+        self._metadata = metadata
+        self.ready = trio.Event()
+        if not self.get_missing_indexes():
+            self.ready.set()
+
+    @property
+    def builds_concurrently(self) -> bool:
+        return bool(self._engine.dialect.name == "postgresql")
+
+    def get_missing_indexes(self) -> Tuple[Index, ...]:
+        inspector = inspect(self._engine)
+        existing_tables = set(inspector.get_table_names())
+        existing_indexes = {
+            index["name"]
+            for table_name in existing_tables
+            for index in inspector.get_indexes(table_name)
+        }
+        return tuple(
+            index
+            for metadata in self._metadata
+            for index in get_deferrable_indexes(metadata)
+            if index.table.name in existing_tables  # type: ignore
+            if index.name not in existing_indexes
+        )
+
+    def _get_ddl(self, index: Index) -> str:
+        create_index = CreateIndex(index)  # type: ignore
+        ddl = str(create_index.compile(dialect=self._engine.dialect))
+        if self.builds_concurrently:
+            return ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+        else:
+            return ddl
+
+    def _build(self, connection: Any) -> None:
+        missing_indexes = self.get_missing_indexes()
+        self.logger.info("Building %d indexes", len(missing_indexes))
+        build_started_at = time.monotonic()
+
+        for number, index in enumerate(missing_indexes, 1):
+            self.logger.info(
+                "Building index %d/%d: %s", number, len(missing_indexes), index.name
+            )
+            started_at = time.monotonic()
+            connection.execute(self._get_ddl(index))
+            self.logger.info(
+                "Built index %s in %.1f seconds",
+                index.name,
+                time.monotonic() - started_at,
+            )
+
+        self.logger.info(
+            "Built %d indexes in %.1f seconds",
+            len(missing_indexes),
+            time.monotonic() - build_started_at,
+        )
+
+    def _build_concurrently(self) -> None:
+        # Concurrent index builds cannot run inside a transaction.
+        with self._engine.connect() as connection:
+            self._build(connection.execution_options(isolation_level="AUTOCOMMIT"))
+
+    def _build_in_session(self, session: orm.Session) -> None:
+        # Whatever the session has pending is committed first, so that the
+        # indexes are built over it too.
+        session.commit()  # type: ignore
+        self._build(session)
+        session.commit()  # type: ignore
+
+    async def build(self, writer: DatabaseWriterAPI) -> None:
+        if self.ready.is_set():
+            return
+
+        if self.builds_concurrently:
+            await trio.to_thread.run_sync(self._build_concurrently)
+        else:
+            await writer.write(self._build_in_session)
+
+        self.ready.set()
@@ -1,19 +1,22 @@
-import functools
-import itertools
+import collections
 import logging
 import time
-from typing import Dict, Iterator, Optional, Sequence
+from typing import Any, Callable, Counter, Dict, Iterator, Mapping, Optional, Sequence
 
 from async_service import Service
 from eth_typing import Hash32
 from eth_utils import humanize_hash, to_tuple
 from sqlalchemy import orm
-from sqlalchemy.orm.exc import NoResultFound
 import trio
 
 from cthaeh._utils import every
+from cthaeh.block_batch import BlockBatch
+from cthaeh.commit import CommitPolicy
+from cthaeh.compact import import_batch_rows_compact, uses_compact_schema
 from cthaeh.ema import EMA
+from cthaeh.flat_logs import import_flat_logs, uses_flat_logs
 from cthaeh.ir import Block as BlockIR
+from cthaeh.ir import Header as HeaderIR
 from cthaeh.models import (
     Block,
     BlockTransaction,
@@ -24,156 +27,279 @@ from cthaeh.models import (
     Receipt,
     Topic,
     Transaction,
-    query_row_count,
 )
-
-
-@functools.lru_cache(maxsize=2 ** 10 * 2 ** 10)
-def query_topic(topic: Hash32, session: orm.Session) -> Topic:
-    return session.query(Topic).filter(Topic.topic == topic).one()  # type: ignore
+from cthaeh.partitions import LogPartitioner, get_log_partitioner
+from cthaeh.postgres import import_batch_rows_copy, supports_copy
+from cthaeh.rows import BatchRows, LoadableBlock, prepare_batch_rows
+from cthaeh.sqlite import import_batch_rows_core, is_sqlite
+from cthaeh.topics import get_topic_dictionary, insert_topics
+from cthaeh.writer import DatabaseWriterAPI, InlineWriter
 
 
 @to_tuple
 def get_or_create_topics(
     session: orm.Session, topics: Sequence[Hash32]
 ) -> Iterator[Topic]:
-    cache: Dict[Hash32, Topic] = {}
-
-    for topic in topics:
-        if topic not in cache:
-            try:
-                cache[topic] = query_topic(topic, session)
-            except NoResultFound:
-                cache[topic] = Topic(topic=topic)
-                yield cache[topic]
+    """
+    Yield a new `Topic` for each distinct topic that is not in the database.
+    """
+    known = {
+        topic.topic
+        for topic in session.query(Topic).filter(  # type: ignore
+            Topic.topic.in_(set(topics))
+        )
+    }
+    for topic in dict.fromkeys(topics):
+        if topic not in known:
+            yield Topic(topic=topic)
 
 
 def import_block(session: orm.Session, block_ir: BlockIR) -> None:
-    header = Header.from_ir(block_ir.header)
-    transactions = tuple(
-        Transaction.from_ir(transaction_ir, block_header_hash=Hash32(header.hash))
-        for transaction_ir in block_ir.transactions
-    )
-    uncles = tuple(Header.from_ir(uncle_ir) for uncle_ir in block_ir.uncles)
-    receipts = tuple(
-        Receipt.from_ir(receipt_ir, Hash32(transaction.hash))
-        for transaction, receipt_ir in zip(transactions, block_ir.receipts)
+    import_block_batch(session, BlockBatch.from_blocks((block_ir,)))
+
+
+def import_block_batch(session: orm.Session, batch: BlockBatch) -> None:
+    import_batch_rows(session, prepare_batch_rows(batch))
+
+
+def import_batch_rows(session: orm.Session, rows: BatchRows) -> None:
+    topics = get_topic_dictionary(session).stage(
+        session, (topic for _, _, topic in rows.log_topics)
     )
-    log_bundles = tuple(
+
+    session.bulk_insert_mappings(Header, rows.headers)
+    session.bulk_insert_mappings(Block, rows.blocks)
+    session.bulk_insert_mappings(Transaction, rows.transactions)
+    session.bulk_insert_mappings(Receipt, rows.receipts)
+    session.bulk_insert_mappings(BlockUncle, rows.block_uncles)
+    session.bulk_insert_mappings(BlockTransaction, rows.block_transactions)
+    insert_topics(session, topics)
+
+    # The logs are inserted with their primary keys returned so that the
+    # `LogTopic` rows can refer to them.
+    session.bulk_insert_mappings(Log, rows.logs, return_defaults=True)
+    session.bulk_insert_mappings(
+        LogTopic,
         tuple(
-            Log.from_ir(log_ir, idx, Hash32(receipt.transaction_hash))
-            for idx, log_ir in enumerate(receipt_ir.logs)
-        )
-        for receipt, receipt_ir in zip(receipts, block_ir.receipts)
-    )
-    logs = tuple(itertools.chain(*log_bundles))
-    block = Block(header_hash=header.hash)
-    block_uncles = tuple(
-        BlockUncle(idx=idx, block_header_hash=block.header_hash, uncle_hash=uncle.hash)
-        for idx, uncle in enumerate(uncles)
-    )
-    block_transactions = tuple(
-        BlockTransaction(
-            idx=idx,
-            block_header_hash=block.header_hash,
-            transaction_hash=transaction.hash,
-        )
-        for idx, transaction in enumerate(transactions)
-    )
-    # These need to be lazily created.
-    topic_values = tuple(
-        topic
-        for receipt_ir in block_ir.receipts
-        for log_ir in receipt_ir.logs
-        for topic in log_ir.topics
-    )
-    topics = get_or_create_topics(session, topic_values)
-    logtopics = tuple(
-        LogTopic(idx=idx, topic_topic=topic, log=log)
-        for bundle, receipt_ir in zip(log_bundles, block_ir.receipts)
-        for log, log_ir in zip(bundle, receipt_ir.logs)
-        for idx, topic in enumerate(log_ir.topics)
+            {"idx": idx, "topic_topic": topic, "log_id": rows.logs[log_offset]["id"]}
+            for log_offset, idx, topic in rows.log_topics
+        ),
     )
 
-    objects_to_save = tuple(
-        itertools.chain(
-            (header, block),
-            uncles,
-            transactions,
-            receipts,
-            logs,
-            block_uncles,
-            block_transactions,
-            topics,
-            logtopics,
-        )
-    )
-    session.bulk_save_objects(objects_to_save)
+
+BatchRowsImporter = Callable[[orm.Session, BatchRows], None]
+
+
+def get_batch_rows_importer(session: orm.Session) -> BatchRowsImporter:
+    """
+    Pick how batches are imported for the database the session is bound to.
+    Databases with the compact schema are loaded with Core inserts of their
+    own, PostgreSQL with binary `COPY`, SQLite with `executemany` on Core
+    inserts, and anything else with ORM bulk inserts.  Databases with a
+    `flatlog` table have it filled in alongside.
+    """
+    importer = _get_schema_importer(session)
+    if uses_flat_logs(session.get_bind()):
+        return _with_flat_logs(importer)
+    else:
+        return importer
+
+
+def _get_schema_importer(session: orm.Session) -> BatchRowsImporter:
+    if uses_compact_schema(session.get_bind()):
+        return import_batch_rows_compact
+    elif supports_copy(session):
+        return import_batch_rows_copy
+    elif is_sqlite(session.get_bind()):
+        return import_batch_rows_core
+    else:
+        return import_batch_rows
+
+
+def _with_flat_logs(importer: BatchRowsImporter) -> BatchRowsImporter:
+    def import_batch_rows_with_flat_logs(session: orm.Session, rows: BatchRows) -> None:
+        importer(session, rows)
+        import_flat_logs(session, rows)
+
+    return import_batch_rows_with_flat_logs
+
+
+def _warm_topic_dictionary(session: orm.Session) -> None:
+    get_topic_dictionary(session).warm(session)
+
+
+def _timed_commit(session: orm.Session) -> float:
+    started_at = time.perf_counter()
+    session.commit()  # type: ignore
+    return time.perf_counter() - started_at
 
 
 class BlockLoader(Service):
     logger = logging.getLogger("cthaeh.import.BlockLoader")
-    _last_loaded_block: Optional[BlockIR] = None
+    _last_loaded_header: Optional[HeaderIR] = None
 
     def __init__(
         self,
         session: orm.Session,
-        block_receive_channel: trio.abc.ReceiveChannel[BlockIR],
+        block_receive_channel: trio.abc.ReceiveChannel[LoadableBlock],
+        report_stats: Optional[Callable[[], Mapping[str, Any]]] = None,
+        commit_policy: Optional[CommitPolicy] = None,
+        writer: Optional[DatabaseWriterAPI] = None,
     ) -> None:
         self._block_receive_channel = block_receive_channel
-        self._commit_lock = trio.Lock()
-        self._session = session
+        self._report_stats = report_stats
+        self._import_batch_rows = get_batch_rows_importer(session)
+        self._partitioner = get_log_partitioner(session.get_bind())
+        # Without a writer of its own, which its owner runs, the loader
+        # writes through `session` on the event loop.
+        if writer is None:
+            self.writer: DatabaseWriterAPI = InlineWriter(session)
+        else:
+            self.writer = writer
+        # Rows are counted for each table as they are loaded rather than
+        # queried, which would be slower the faster blocks are loaded.
+        self._row_counts: Counter[str] = collections.Counter()
+        # Set once every block sent to the loader has been committed.
+        self.loaded = trio.Event()
+        if commit_policy is None:
+            self.commit_policy = CommitPolicy()
+        else:
+            self.commit_policy = commit_policy
 
     async def run(self) -> None:
         self.logger.info("Started BlockLoader")
 
-        self.manager.run_daemon_task(self._commit_on_interval)
+        await self.writer.write(_warm_topic_dictionary)
+
         self.manager.run_daemon_task(self._periodically_report_import)
 
-        async with self._block_receive_channel:
+        # The rows of the next batch are prepared in a worker thread while
+        # the previous batch is imported and committed, with at most one
+        # prepared batch waiting to be imported.
+        rows_send_channel, rows_receive_channel = trio.open_memory_channel[BatchRows](0)
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self._prepare_batches, rows_send_channel)
+            await self._import_batches(rows_receive_channel)
+
+    async def _prepare_batches(
+        self, rows_send_channel: trio.abc.SendChannel[BatchRows]
+    ) -> None:
+        async with self._block_receive_channel, rows_send_channel:
+            async for block in self._block_receive_channel:
+                # Blocks from extraction workers arrive with their rows
+                # already prepared.
+                if isinstance(block, BatchRows):
+                    await rows_send_channel.send(block)
+                    continue
+                elif isinstance(block, BlockBatch):
+                    batch = block
+                else:
+                    batch = BlockBatch.from_blocks((block,))
+
+                rows = await trio.to_thread.run_sync(prepare_batch_rows, batch)
+                await rows_send_channel.send(rows)
+
+    async def _import_batches(
+        self, rows_receive_channel: trio.abc.ReceiveChannel[BatchRows]
+    ) -> None:
+        async with rows_receive_channel:
             try:
-                async for block_ir in self._block_receive_channel:
-                    self.logger.debug(
-                        "Importing block #%d", block_ir.header.block_number
-                    )
-                    async with self._commit_lock:
-                        import_block(self._session, block_ir)
-                        self._last_loaded_block = block_ir
-
-                    self.logger.debug(
-                        "Imported block #%d", block_ir.header.block_number
-                    )
+                while True:
+                    # Wait for the next batch no longer than the age limit of
+                    # whatever has not been committed yet.
+                    with trio.move_on_at(self.commit_policy.deadline) as scope:
+                        rows = await rows_receive_channel.receive()
+                    if not scope.cancelled_caught:
+                        await self._import(rows)
+
+                    if self.commit_policy.should_commit(trio.current_time()):
+                        await self.commit()
+            except trio.EndOfChannel:
+                pass
             finally:
-                self._session.commit()  # type: ignore
+                # Whatever has been imported is committed even when loading
+                # is cancelled.
+                with trio.CancelScope(shield=True):
+                    await self.commit()
+        self.loaded.set()
+
+    async def _import(self, rows: BatchRows) -> None:
+        batch = rows.batch
+        if self._partitioner is not None:
+            await self._create_partitions(self._partitioner, batch)
+
+        self.logger.debug("Importing %s", batch)
+        await self.writer.write(self._import_batch_rows, rows)
+        self._last_loaded_header = batch.headers[len(batch) - 1]
+        self._row_counts.update(rows.row_counts)
+        self.commit_policy.record_import(
+            len(batch), rows.num_rows, batch.nbytes, trio.current_time()
+        )
+        self.logger.debug("Imported %s", batch)
+
+    async def _create_partitions(
+        self, partitioner: LogPartitioner, batch: BlockBatch
+    ) -> None:
+        block_numbers = batch.headers.block_number
+        starts = partitioner.get_missing_partitions(
+            min(block_numbers), max(block_numbers)
+        )
+        if starts:
+            # Whatever has been imported is committed first, so that the
+            # partitions are created in a transaction which holds no other
+            # locks and commits straight away.
+            await self.commit()
+            await self.writer.write(partitioner.create_partitions, starts)
+
+    async def commit(self) -> None:
+        """
+        Commit through the loader's writer, accounting for whatever the
+        loader has imported as committed.  Anything else which writes through
+        the same writer commits with this, so that the commit policy knows
+        about every commit.
+        """
+        latency = await self.writer.write(_timed_commit)
+        if self.commit_policy.has_pending:
+            self.commit_policy.record_commit(latency)
+
+    @property
+    def num_rows_loaded(self) -> int:
+        return sum(self._row_counts.values())
+
+    def get_row_counts(self) -> Dict[str, int]:
+        """
+        The number of rows loaded into each table since the loader started.
+        """
+        return dict(self._row_counts)
 
     async def _periodically_report_import(self) -> None:
         last_reported_height = None
         last_reported_at = None
+        last_reported_rows = 0
 
         import_rate_ema = None
 
         while self.manager.is_running:
             async for _ in every(5, initial_delay=2):  # noqa: F841
-                if self._last_loaded_block is None:
+                if self._last_loaded_header is None:
                     self.logger.info("Waiting for first block to load...")
                     continue
 
-                last_loaded_block = self._last_loaded_block
-                last_loaded_height = last_loaded_block.header.block_number
+                last_loaded_header = self._last_loaded_header
+                last_loaded_height = last_loaded_header.block_number
 
                 # If this is our *first* report
                 if last_reported_height is None or last_reported_at is None:
                     last_reported_height = last_loaded_height
                     last_reported_at = time.monotonic()
+                    last_reported_rows = self.num_rows_loaded
                     continue
 
                 if last_loaded_height < last_reported_height:
                     raise Exception("Invariant")
 
                 num_imported = last_loaded_height - last_reported_height
-                total_rows = query_row_count(
-                    self._session, last_reported_height, last_loaded_height
-                )
+                total_rows = self.num_rows_loaded - last_reported_rows
                 duration = time.monotonic() - last_reported_at
                 blocks_per_second = num_imported / duration
                 items_per_second = total_rows / duration
@@ -185,10 +311,15 @@ class BlockLoader(Service):
                     import_rate_ema.update(blocks_per_second)
                     items_rate_ema.update(items_per_second)
 
+                stats = dict(self.commit_policy.get_stats())
+                if self._report_stats is not None:
+                    stats.update(self._report_stats())
+                extra_stats = " ".join(f"{key}={value}" for key, value in stats.items())
+
                 self.logger.info(
-                    "head=%d (%s) blocks=%d rows=%d bps=%s bps_ema=%s ips=%s, ips_ema=%s",
+                    "head=%d (%s) blocks=%d rows=%d bps=%s bps_ema=%s ips=%s, ips_ema=%s %s",
                     last_loaded_height,
-                    humanize_hash(last_loaded_block.header.hash),
+                    humanize_hash(last_loaded_header.hash),
                     num_imported,
                     total_rows,
                     (
@@ -211,12 +342,9 @@ class BlockLoader(Service):
                         if items_rate_ema.value > 2
                         else f"{items_rate_ema.value:.2f}"
                     ),
+                    extra_stats,
                 )
 
                 last_reported_height = last_loaded_height
                 last_reported_at = time.monotonic()
-
-    async def _commit_on_interval(self) -> None:
-        async for _ in every(1):  # noqa: F841
-            async with self._commit_lock:
-                self._session.commit()  # type: ignore
+                last_reported_rows = self.num_rows_loaded
@@ -0,0 +1,281 @@
+import logging
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+from async_service import Service
+from eth_typing import BlockNumber, Hash32
+from eth_utils import ValidationError, to_tuple
+from eth_utils.toolz import groupby
+import trio
+from web3._utils.rpc_abi import RPC
+
+from cthaeh.client import JSONRPCClientAPI, RPCError
+from cthaeh.constants import ZERO_ADDRESS, ZERO_HASH32
+from cthaeh.exfiltration import BlockNotFound, make_requests
+from cthaeh.extraction import (
+    RawData,
+    decode_hash32,
+    decode_quantity,
+    extract_raw_header,
+    extract_raw_log,
+)
+from cthaeh.head import DEFAULT_POLL_INTERVAL, HeadTracker
+from cthaeh.ir import Block, Log, Receipt, Transaction
+
+
+class TooManyResults(Exception):
+    """
+    Raised when the node refuses an `eth_getLogs` query because the block
+    range holds too many logs.
+    """
+
+    pass
+
+
+# Fragments of the error messages that nodes and hosted providers use when
+# refusing an `eth_getLogs` query for spanning too many blocks or logs.
+TOO_MANY_RESULTS_MESSAGES = (
+    "query returned more than",
+    "response size exceeded",
+    "response size should not",
+    "exceed maximum block range",
+    "block range is too wide",
+    "too many results",
+)
+
+LIMIT_EXCEEDED_ERROR_CODE = -32005
+
+
+def is_too_many_results_error(error: Any) -> bool:
+    if not isinstance(error, dict):
+        return False
+    elif error.get("code") == LIMIT_EXCEEDED_ERROR_CODE:
+        return True
+    message = str(error.get("message", "")).lower()
+    return any(fragment in message for fragment in TOO_MANY_RESULTS_MESSAGES)
+
+
+DEFAULT_INITIAL_WINDOW_SIZE = 16
+DEFAULT_MAX_WINDOW_SIZE = 1024
+DEFAULT_TARGET_LOGS_PER_WINDOW = 2000
+
+
+class LogExfiltrator(Service):
+    """
+    Pull only the data needed to serve `eth_getLogs`, fetching the logs for
+    windows of blocks with `eth_getLogs` and the headers with
+    `eth_getBlockByNumber` without full transactions.
+
+    The window halves whenever the node refuses a query for returning too
+    many results, or the results exceed `target_logs_per_window`, and
+    doubles whenever a window returns fewer than half that many logs.
+    """
+
+    logger = logging.getLogger("cthaeh.log_exfiltration")
+
+    def __init__(
+        self,
+        client: JSONRPCClientAPI,
+        block_send_channel: trio.abc.SendChannel[Block],
+        start_at: BlockNumber,
+        end_at: Optional[BlockNumber],
+        batch_size: Optional[int] = None,
+        initial_window_size: int = DEFAULT_INITIAL_WINDOW_SIZE,
+        max_window_size: int = DEFAULT_MAX_WINDOW_SIZE,
+        target_logs_per_window: int = DEFAULT_TARGET_LOGS_PER_WINDOW,
+        head_poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        if not 1 <= initial_window_size <= max_window_size:
+            raise ValueError(
+                f"Invalid window size bounds: initial={initial_window_size} "
+                f"maximum={max_window_size}"
+            )
+        self.client = client
+        self.start_at = start_at
+        self.end_at = end_at
+        self._batch_size = batch_size
+        self._block_send_channel = block_send_channel
+        self._window_size = initial_window_size
+        self._max_window_size = max_window_size
+        self._target_logs_per_window = target_logs_per_window
+        self._head = HeadTracker(client, poll_interval=head_poll_interval)
+        # Set once fetching has had to wait for the head of the chain.
+        self.caught_up = trio.Event()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"window": self._window_size}
+
+    async def run(self) -> None:
+        self.logger.info(
+            "Started LogExfiltrator: %s..%s",
+            self.start_at,
+            "HEAD" if self.end_at is None else self.end_at,
+        )
+
+        self.manager.run_daemon_child_service(self._head)
+
+        from_block = self.start_at
+
+        async with self._block_send_channel:
+            while self.end_at is None or from_block < self.end_at:
+                last_block = await self._get_last_block(from_block)
+                to_block = BlockNumber(
+                    min(last_block, from_block + self._window_size - 1)
+                )
+                self.logger.debug("Retrieving logs for #%d-%d", from_block, to_block)
+
+                try:
+                    logs_data = await retrieve_logs(self.client, from_block, to_block)
+                except TooManyResults:
+                    if to_block == from_block:
+                        raise
+                    self._set_window_size((to_block - from_block + 1) // 2)
+                    continue
+
+                headers_data = await retrieve_headers(
+                    self.client, from_block, to_block, self._batch_size
+                )
+                logs_by_block = groupby(
+                    lambda log: decode_quantity(log["blockNumber"]), logs_data
+                )
+                for block_number, block_data in enumerate(headers_data, from_block):
+                    block = extract_logs_only_block(
+                        block_data, logs_by_block.get(block_number, ())
+                    )
+                    await self._block_send_channel.send(block)
+
+                if len(logs_data) > self._target_logs_per_window:
+                    self._set_window_size(self._window_size // 2)
+                elif len(logs_data) * 2 < self._target_logs_per_window:
+                    self._set_window_size(self._window_size * 2)
+
+                from_block = BlockNumber(to_block + 1)
+
+    async def _get_last_block(self, from_block: BlockNumber) -> BlockNumber:
+        if self._head.head is not None and from_block > self._head.head:
+            self.caught_up.set()
+        head = await self._head.wait_for_block(from_block)
+        if self.end_at is None:
+            return head
+        else:
+            return BlockNumber(min(head, self.end_at - 1))
+
+    def _set_window_size(self, value: int) -> None:
+        previous = self._window_size
+        self._window_size = min(self._max_window_size, max(1, value))
+
+        if self._window_size != previous:
+            self.logger.debug("Log window size: %d -> %d", previous, self._window_size)
+
+
+async def retrieve_logs(
+    client: JSONRPCClientAPI, from_block: int, to_block: int
+) -> Tuple[RawData, ...]:
+    """
+    Retrieve the raw form of every log emitted within the inclusive range of blocks, raising
+    `TooManyResults` if the node refuses the query as too large.
+    """
+    filter_params = {"fromBlock": hex(from_block), "toBlock": hex(to_block)}
+    try:
+        raw_logs = await client.make_request(RPC.eth_getLogs, (filter_params,))
+    except RPCError as err:
+        if is_too_many_results_error(err.error):
+            raise TooManyResults(
+                f"Too many logs in blocks #{from_block}-{to_block}: {err.error}"
+            ) from err
+        raise
+
+    return tuple(raw_log for raw_log in raw_logs if not raw_log.get("removed"))
+
+
+async def retrieve_headers(
+    client: JSONRPCClientAPI,
+    from_block: int,
+    to_block: int,
+    max_batch_size: Optional[int] = None,
+) -> Tuple[RawData, ...]:
+    """
+    Retrieve the raw headers for the inclusive range of blocks along with the
+    hashes of their transactions.
+    """
+    requests = tuple(
+        (RPC.eth_getBlockByNumber, (hex(block_number), False))
+        for block_number in range(from_block, to_block + 1)
+    )
+    headers_data = await make_requests(client, requests, max_batch_size)
+    for block_number, block_data in zip(range(from_block, to_block + 1), headers_data):
+        if block_data is None:
+            raise BlockNotFound(f"Block #{block_number} is not available")
+    return headers_data
+
+
+def extract_logs_only_block(block_data: RawData, logs_data: Sequence[RawData]) -> Block:
+    """
+    Build a block containing only what is needed to serve `eth_getLogs`.
+
+    Every transaction in the block is included so that transaction indices
+    are preserved, but only their hashes are known.  The remaining
+    transaction and receipt fields are filled with empty values.
+    """
+    header = extract_raw_header(block_data)
+    transaction_hashes = tuple(
+        decode_hash32(transaction_hash)
+        for transaction_hash in block_data["transactions"]
+    )
+
+    # Guard against the chain having re-organized between fetching the logs
+    # and fetching the header.
+    for log_data in logs_data:
+        if decode_hash32(log_data["blockHash"]) != header.hash:
+            raise ValidationError(
+                f"Log for block #{header.block_number} does not match the "
+                f"block's hash"
+            )
+        transaction_hash = transaction_hashes[
+            decode_quantity(log_data["transactionIndex"])
+        ]
+        if decode_hash32(log_data["transactionHash"]) != transaction_hash:
+            raise ValidationError(
+                f"Log for block #{header.block_number} does not match the "
+                f"block's transactions"
+            )
+
+    logs_by_transaction = groupby(
+        lambda log: decode_quantity(log["transactionIndex"]), logs_data
+    )
+    receipts = tuple(
+        Receipt(
+            state_root=ZERO_HASH32,
+            gas_used=0,
+            bloom=b"",
+            logs=_extract_sorted_logs(logs_by_transaction.get(idx, ())),
+        )
+        for idx in range(len(transaction_hashes))
+    )
+    transactions = tuple(
+        _placeholder_transaction(transaction_hash)
+        for transaction_hash in transaction_hashes
+    )
+
+    return Block(header=header, transactions=transactions, uncles=(), receipts=receipts)
+
+
+@to_tuple
+def _extract_sorted_logs(logs_data: Sequence[RawData]) -> Iterator[Log]:
+    for log_data in sorted(logs_data, key=lambda log: decode_quantity(log["logIndex"])):
+        yield extract_raw_log(log_data)
+
+
+def _placeholder_transaction(transaction_hash: Hash32) -> Transaction:
+    return Transaction(
+        hash=transaction_hash,
+        nonce=0,
+        gas_price=0,
+        gas=0,
+        to=None,
+        value=b"",
+        data=b"",
+        v=b"",
+        r=b"",
+        s=b"",
+        sender=ZERO_ADDRESS,
+    )
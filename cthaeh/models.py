@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from eth_typing import Hash32
 from eth_utils import big_endian_to_int, humanize_hash, int_to_big_endian
@@ -11,6 +11,7 @@ from sqlalchemy import (
     Integer,
     LargeBinary,
     UniqueConstraint,
+    or_,
     orm,
 )
 from sqlalchemy.ext.declarative import declarative_base
@@ -356,55 +357,55 @@ class Topic(Base):
         return f"Topic[{humanize_hash(self.topic)}]"  # type: ignore
 
 
-def query_row_count(session: orm.Session, start_at: int, end_at: int) -> int:
-    num_headers = Header.query.filter(
-        Header.block_number > start_at,
-        Header.block_number <= end_at,
-        Header.is_canonical.is_(True),  # type: ignore
-    ).count()
-
-    num_uncles = (
-        BlockUncle.query.join(Block, BlockUncle.block_header_hash == Block.header_hash)
+def query_row_counts(
+    session: orm.Session, start_at: int, end_at: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    Count the rows of each table which belong to the blocks numbered from
+    `start_at` to `end_at`, matching the counts kept by the loader.  This
+    joins most of the database together, and is only meant for verifying
+    those counts.
+    """
+    block_filters = [Header.block_number >= start_at]
+    if end_at is not None:
+        block_filters.append(Header.block_number <= end_at)
+
+    block_hashes = (
+        session.query(Block.header_hash)  # type: ignore
         .join(Header, Block.header_hash == Header.hash)
-        .filter(Header.block_number > start_at, Header.block_number <= end_at)
-        .count()
+        .filter(*block_filters)
     )
-
-    num_transactions = (
-        Transaction.query.join(
-            Block, Transaction.block_header_hash == Block.header_hash
-        )
-        .join(Header, Block.header_hash == Header.hash)
-        .filter(Header.block_number > start_at, Header.block_number <= end_at)
-        .count()
+    uncle_hashes = session.query(BlockUncle.uncle_hash).filter(  # type: ignore
+        BlockUncle.block_header_hash.in_(block_hashes.subquery())
     )
-
-    num_logs = (
-        Log.query.join(Receipt, Log.receipt_hash == Receipt.transaction_hash)
-        .join(Transaction, Receipt.transaction_hash == Transaction.hash)
-        .join(Block, Transaction.block_header_hash == Block.header_hash)
-        .join(Header, Block.header_hash == Header.hash)
-        .filter(Header.block_number > start_at, Header.block_number <= end_at)
-        .count()
+    transaction_hashes = session.query(Transaction.hash).filter(  # type: ignore
+        Transaction.block_header_hash.in_(block_hashes.subquery())
     )
-
-    num_topics = (
-        LogTopic.query.join(Log, LogTopic.log_id == Log.id)
-        .join(Receipt, Log.receipt_hash == Receipt.transaction_hash)
-        .join(Transaction, Receipt.transaction_hash == Transaction.hash)
-        .join(Block, Transaction.block_header_hash == Block.header_hash)
-        .join(Header, Block.header_hash == Header.hash)
-        .filter(Header.block_number > start_at, Header.block_number <= end_at)
-        .count()
+    log_ids = session.query(Log.id).filter(  # type: ignore
+        Log.receipt_hash.in_(transaction_hashes.subquery())
     )
 
-    total_item_count = sum(
-        (
-            num_headers * 2,  # double to account for blocks
-            num_uncles * 2,  # double to account for join table
-            num_transactions * 3,  # double to account for join table and receipts
-            num_logs * 2,  # double to account for join table
-            num_topics,  # ignore the topics themselves and only count the join rows
-        )
-    )
-    return total_item_count
+    def count(model: Any, *filters: Any) -> int:
+        return int(session.query(model).filter(*filters).count())  # type: ignore
+
+    return {
+        "header": count(
+            Header,
+            or_(
+                Header.hash.in_(block_hashes.subquery()),
+                Header.hash.in_(uncle_hashes.subquery()),
+            ),
+        ),
+        "block": block_hashes.count(),
+        "transaction": transaction_hashes.count(),
+        "receipt": count(
+            Receipt, Receipt.transaction_hash.in_(transaction_hashes.subquery())
+        ),
+        "blockuncle": uncle_hashes.count(),
+        "blocktransaction": count(
+            BlockTransaction,
+            BlockTransaction.block_header_hash.in_(block_hashes.subquery()),
+        ),
+        "log": log_ids.count(),
+        "logtopic": count(LogTopic, LogTopic.log_id.in_(log_ids.subquery())),
+    }
@@ -0,0 +1,149 @@
+"""
+Partition the denormalized logs by block number on PostgreSQL.
+
+A single table holding every log grows without bound, and vacuuming it,
+maintaining its indexes and pruning it get slower as it does.  The
+`flatlog` table may instead be created partitioned into ranges of a fixed
+number of blocks.  Each range is a table of its own, with indexes of its
+own, and queries which filter on the block number only touch the
+partitions their range overlaps.
+
+The width of the partitions of a table is recorded in the `partitioning`
+table when it is created.  Partitions are created by the loader before the
+blocks which fall in them are imported, a few ahead of the highest block it
+has seen, so that new ones are rarely created.  Creating a partition locks
+the whole of `flatlog` until its transaction ends, so partitions are
+created in a short transaction of their own rather than alongside the rows
+being imported.  Like topics, they only become known once that transaction
+commits.
+"""
+import logging
+from typing import Iterable, Optional, Set, Tuple
+
+from sqlalchemy import BigInteger, Column, MetaData, String, Table, inspect, orm, select
+from sqlalchemy.engine import Dialect, Engine
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from cthaeh.flat_logs import flatlog
+from cthaeh.session import stage_until_commit
+
+DEFAULT_PARTITION_WIDTH = 1_000_000
+
+# The number of partitions beyond the one holding the highest imported block
+# which are created ahead of time.
+PARTITIONS_AHEAD = 2
+
+PARTITION_KEY = "block_number"
+
+metadata = MetaData()
+
+partitioning = Table(
+    "partitioning",
+    metadata,
+    Column("table_name", String(64), primary_key=True),
+    Column("width", BigInteger, nullable=False),
+)
+
+
+def get_partition_name(table_name: str, start: int) -> str:
+    return f"{table_name}_{start}"
+
+
+def get_partition_starts(width: int, low: int, high: int) -> range:
+    """
+    The first block number of each partition that blocks from `low` to
+    `high` fall in.
+    """
+    return range(low - low % width, high + 1, width)
+
+
+def get_create_partitioned_table_ddl(table: Table, dialect: Dialect) -> str:
+    create_table = str(CreateTable(table).compile(dialect=dialect)).rstrip()
+    return f"{create_table} PARTITION BY RANGE ({PARTITION_KEY})"
+
+
+def get_create_partition_ddl(table_name: str, start: int, width: int) -> str:
+    return (
+        f'CREATE TABLE IF NOT EXISTS "{get_partition_name(table_name, start)}" '
+        f'PARTITION OF "{table_name}" FOR VALUES FROM ({start}) TO ({start + width})'
+    )
+
+
+def create_partitioned_flat_logs(engine: Engine, width: int) -> None:
+    """
+    Create the `flatlog` table partitioned into ranges of `width` blocks,
+    along with its indexes.  Indexes of a partitioned table cannot be built
+    concurrently, so they are not deferred.
+    """
+    if engine.dialect.name != "postgresql":
+        raise ValueError("Partitioned tables are only supported on PostgreSQL")
+    elif width < 1:
+        raise ValueError(f"The partition width must be positive: {width}")
+
+    if flatlog.name in inspect(engine).get_table_names():
+        return
+
+    with engine.begin() as connection:
+        metadata.create_all(connection)
+        connection.execute(get_create_partitioned_table_ddl(flatlog, engine.dialect))
+        for index in sorted(flatlog.indexes, key=lambda index: index.name):
+            connection.execute(CreateIndex(index))  # type: ignore
+        connection.execute(
+            partitioning.insert(), {"table_name": flatlog.name, "width": width}
+        )
+
+
+class LogPartitioner:
+    """
+    Create the partitions of the `flatlog` table which blocks are about to
+    be imported into.
+    """
+
+    logger = logging.getLogger("cthaeh.partitions.LogPartitioner")
+
+    def __init__(self, width: int, partitions_ahead: int = PARTITIONS_AHEAD) -> None:
+        self.width = width
+        self._partitions_ahead = partitions_ahead
+        self._created: Set[int] = set()
+
+    def get_missing_partitions(self, low: int, high: int) -> Tuple[int, ...]:
+        """
+        The first block number of each partition that blocks from `low` to
+        `high`, or the few after them, fall in and which has not been
+        created yet.
+        """
+        starts = get_partition_starts(
+            self.width, low, high + self._partitions_ahead * self.width
+        )
+        return tuple(start for start in starts if start not in self._created)
+
+    def create_partitions(self, session: orm.Session, starts: Iterable[int]) -> None:
+        """
+        Create the partitions and commit.  The session must not have written
+        anything else in its transaction, which would otherwise be committed
+        along with them.
+        """
+        pending = stage_until_commit(session, self)
+        for start in starts:
+            session.execute(get_create_partition_ddl(flatlog.name, start, self.width))
+            pending.add(start)
+            self.logger.debug(
+                "Created partition %s", get_partition_name(flatlog.name, start)
+            )
+        session.commit()  # type: ignore
+
+    def remember(self, starts: Set[int]) -> None:
+        self._created.update(starts)
+
+
+def get_log_partitioner(engine: Engine) -> Optional[LogPartitioner]:
+    if partitioning.name not in inspect(engine).get_table_names():
+        return None
+
+    width = engine.execute(
+        select([partitioning.c.width]).where(partitioning.c.table_name == flatlog.name)
+    ).scalar()
+    if width is None:
+        return None
+    else:
+        return LogPartitioner(width)
@@ -0,0 +1,328 @@
+import collections
+import logging
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Counter,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import trio
+from web3._utils.rpc_abi import RPC
+from web3.types import RPCEndpoint
+
+from cthaeh._utils import TaskStatus, every
+from cthaeh.batch import RPCRequestArgs
+from cthaeh.client import BlockHashMismatch, JSONRPCClientAPI, SubscriptionsNotSupported
+from cthaeh.ema import EMA
+from cthaeh.extraction import decode_quantity
+from cthaeh.retry import is_retryable_error
+
+
+class _Endpoint:
+    """
+    The health of a single node within a `NodePool`.
+    """
+
+    def __init__(self, name: str, client: JSONRPCClientAPI) -> None:
+        self.name = name
+        self.client = client
+        self.latency: Optional[EMA] = None
+        self.error_rate = EMA(0, 0.1)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.num_ejections = 0
+        self.ejected_until: Optional[float] = None
+        self.head: Optional[int] = None
+
+    def is_ejected(self, now: float) -> bool:
+        return self.ejected_until is not None and now < self.ejected_until
+
+    @property
+    def cost(self) -> float:
+        """
+        The expected cost of sending another request to this node.  Nodes
+        which have not answered a request yet are free, so that every node
+        is tried.
+        """
+        latency = 0.0 if self.latency is None else self.latency.value
+        return (self.in_flight + 1) * latency / max(0.05, 1 - self.error_rate.value)
+
+
+class NodePool(JSONRPCClientAPI):
+    """
+    Spread requests across several nodes.
+
+    - Each request is routed to the node with the lowest expected cost, based
+      on its smoothed latency, error rate and the number of requests already
+      in flight to it.
+    - A node failing `eject_after` requests in a row is ejected for
+      `eject_duration` seconds, doubling with each ejection in a row.  Once
+      the time has passed the node is routed requests again and a single
+      failure ejects it again.
+    - Every node is polled for its head every `poll_interval` seconds.
+    - Blocks fetched with `eth_getBlockByNumber` within `head_check_depth` of
+      the head are cross-checked by hash against the other nodes.  If the
+      node answering the request is not in the majority
+      `BlockHashMismatch` is raised.
+    """
+
+    logger = logging.getLogger("cthaeh.pool.NodePool")
+
+    def __init__(
+        self,
+        clients: Sequence[Tuple[str, JSONRPCClientAPI]],
+        eject_after: int = 3,
+        eject_duration: float = 5.0,
+        max_eject_duration: float = 300.0,
+        poll_interval: float = 5.0,
+        head_check_depth: int = 8,
+    ) -> None:
+        if not clients:
+            raise ValueError("A node pool requires at least one client")
+
+        self._endpoints = tuple(_Endpoint(name, client) for name, client in clients)
+        self._eject_after = eject_after
+        self._eject_duration = eject_duration
+        self._max_eject_duration = max_eject_duration
+        self._poll_interval = poll_interval
+        self._head_check_depth = head_check_depth
+        self._stats: Counter[str] = collections.Counter()
+        self._ready = trio.Event()
+
+    @property
+    def head(self) -> Optional[int]:
+        heads = tuple(
+            endpoint.head for endpoint in self._endpoints if endpoint.head is not None
+        )
+        if heads:
+            return max(heads)
+        else:
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = trio.current_time()
+        num_healthy = sum(not endpoint.is_ejected(now) for endpoint in self._endpoints)
+        return {
+            "nodes": f"{num_healthy}/{len(self._endpoints)}",
+            "ejections": self._stats["ejections"],
+            "hash_mismatches": self._stats["hash_mismatches"],
+        }
+
+    async def run(self) -> None:
+        for endpoint in self._endpoints:
+            self.manager.run_daemon_child_service(endpoint.client)
+
+        self.manager.run_daemon_task(self._poll_heads)
+        await self.manager.wait_finished()
+
+    async def _poll_heads(self) -> None:
+        async for _ in every(self._poll_interval):  # noqa: F841
+            async with trio.open_nursery() as nursery:
+                for endpoint in self._endpoints:
+                    nursery.start_soon(self._poll_head, endpoint)
+            self._ready.set()
+
+    async def _poll_head(self, endpoint: _Endpoint) -> None:
+        # Ejected nodes are left alone until their time is up.
+        if endpoint.is_ejected(trio.current_time()):
+            return
+
+        try:
+            raw_head = await self._send(
+                endpoint, endpoint.client.make_request, RPC.eth_blockNumber, []
+            )
+        except Exception as err:
+            self.logger.debug("Failed to poll head of %s: %r", endpoint.name, err)
+        else:
+            endpoint.head = decode_quantity(raw_head)
+
+    #
+    # Routing and health
+    #
+    def _select(self) -> _Endpoint:
+        now = trio.current_time()
+        available = tuple(
+            endpoint for endpoint in self._endpoints if not endpoint.is_ejected(now)
+        )
+        if available:
+            return min(available, key=lambda endpoint: endpoint.cost)
+        else:
+            # With every node ejected, use the one due back the soonest.
+            return min(
+                self._endpoints, key=lambda endpoint: endpoint.ejected_until or now
+            )
+
+    async def _send(
+        self, endpoint: _Endpoint, request_fn: Callable[..., Awaitable[Any]], *args: Any
+    ) -> Any:
+        started_at = trio.current_time()
+        endpoint.in_flight += 1
+        try:
+            result = await request_fn(*args)
+        except Exception as err:
+            # Errors which would be the same from any node do not count
+            # against the health of the node.
+            if is_retryable_error(err):
+                self._record_failure(endpoint)
+            raise
+        finally:
+            endpoint.in_flight -= 1
+
+        self._record_success(endpoint, trio.current_time() - started_at)
+        return result
+
+    def _record_success(self, endpoint: _Endpoint, latency: float) -> None:
+        if endpoint.latency is None:
+            endpoint.latency = EMA(latency, 0.2)
+        else:
+            endpoint.latency.update(latency)
+        endpoint.error_rate.update(0)
+        endpoint.consecutive_failures = 0
+        endpoint.num_ejections = 0
+
+    def _record_failure(self, endpoint: _Endpoint) -> None:
+        endpoint.error_rate.update(1)
+        endpoint.consecutive_failures += 1
+
+        now = trio.current_time()
+        if endpoint.is_ejected(now):
+            return
+        elif endpoint.consecutive_failures >= self._eject_after:
+            duration = min(
+                self._max_eject_duration,
+                self._eject_duration * 2 ** endpoint.num_ejections,
+            )
+            endpoint.ejected_until = now + duration
+            endpoint.num_ejections += 1
+            # Once reinstated, a single failure ejects the node again.
+            endpoint.consecutive_failures = self._eject_after - 1
+            self._stats["ejections"] += 1
+            self.logger.info(
+                "Ejected node %s for %.1fs after %d failures",
+                endpoint.name,
+                duration,
+                self._eject_after,
+            )
+
+    #
+    # Head cross-checking
+    #
+    def _needs_head_check(self, method: RPCEndpoint, result: Any) -> bool:
+        if method != RPC.eth_getBlockByNumber or not isinstance(result, dict):
+            return False
+        elif len(self._endpoints) == 1:
+            return False
+
+        head = self.head
+        if head is None:
+            return True
+        return decode_quantity(result["number"]) >= head - self._head_check_depth
+
+    async def _check_block_hash(self, endpoint: _Endpoint, block_data: Any) -> None:
+        block_number = block_data["number"]
+        others = tuple(
+            other
+            for other in self._endpoints
+            if other is not endpoint and not other.is_ejected(trio.current_time())
+        )
+        hashes: Dict[int, Optional[str]] = {}
+
+        async def _get_hash(index: int, other: _Endpoint) -> None:
+            try:
+                other_data = await self._send(
+                    other,
+                    other.client.make_request,
+                    RPC.eth_getBlockByNumber,
+                    (block_number, False),
+                )
+            except Exception:
+                return
+            # Nodes which do not have the block yet have no say.
+            if other_data is not None:
+                hashes[index] = other_data["hash"]
+
+        async with trio.open_nursery() as nursery:
+            for index, other in enumerate(others):
+                nursery.start_soon(_get_hash, index, other)
+
+        votes = collections.Counter(hashes.values())
+        votes[block_data["hash"]] += 1
+        if len(votes) == 1:
+            return
+
+        self._stats["hash_mismatches"] += 1
+        (majority_hash, majority_votes), *rest = votes.most_common()
+        is_tied = bool(rest) and rest[0][1] == majority_votes
+        self.logger.warning(
+            "Nodes disagree about block #%d: %s",
+            decode_quantity(block_number),
+            dict(votes),
+        )
+
+        if is_tied or block_data["hash"] != majority_hash:
+            self._record_failure(endpoint)
+            raise BlockHashMismatch(
+                f"Node {endpoint.name} returned block {block_data['hash']} for "
+                f"#{decode_quantity(block_number)} which other nodes disagree with"
+            )
+
+        for index, other_hash in hashes.items():
+            if other_hash != majority_hash:
+                self._record_failure(others[index])
+
+    #
+    # Requests
+    #
+    async def make_request(self, method: RPCEndpoint, params: Sequence[Any]) -> Any:
+        await self._ready.wait()
+
+        endpoint = self._select()
+        result = await self._send(
+            endpoint, endpoint.client.make_request, method, params
+        )
+        if self._needs_head_check(method, result):
+            await self._check_block_hash(endpoint, result)
+        return result
+
+    async def make_batch_request(
+        self, requests: Sequence[RPCRequestArgs]
+    ) -> Tuple[Any, ...]:
+        await self._ready.wait()
+
+        endpoint = self._select()
+        results = await self._send(
+            endpoint, endpoint.client.make_batch_request, requests
+        )
+        to_check: List[Any] = [
+            result
+            for (method, _), result in zip(requests, results)
+            if self._needs_head_check(method, result)
+        ]
+        for block_data in to_check:
+            await self._check_block_hash(endpoint, block_data)
+        return tuple(results)
+
+    async def subscribe_new_heads(
+        self,
+        send_channel: trio.abc.SendChannel[Any],
+        *,
+        task_status: TaskStatus = trio.TASK_STATUS_IGNORED,
+    ) -> None:
+        # Heads are taken from the first node able to push them, leaving the
+        # cross-checking to the block requests which follow.
+        for endpoint in self._endpoints:
+            try:
+                await endpoint.client.subscribe_new_heads(
+                    send_channel, task_status=task_status
+                )
+            except SubscriptionsNotSupported:
+                continue
+            else:
+                return
+        raise SubscriptionsNotSupported("No node in the pool supports subscriptions")
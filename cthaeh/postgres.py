@@ -0,0 +1,202 @@
+"""
+Load blocks into PostgreSQL with binary `COPY ... FROM STDIN`.
+
+Each table of a `BlockBatch` is streamed in a single `COPY`, which is far
+cheaper than even a multi-row `INSERT` for this shape of data.  Rows are
+encoded in the binary `COPY` format, with the type of each field taken from
+the column of the model it is loaded into.
+
+Topics which are not in the topic dictionary may still be in the database,
+so they are copied into a temporary staging table and only the new ones are
+inserted from there.  The primary keys of
+logs are drawn from their sequence ahead of time so that the log topics can
+refer to them.
+
+This relies on the `copy_expert` method of psycopg2 connections.
+"""
+import io
+import struct
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from eth_typing import Hash32
+from sqlalchemy import BigInteger, Boolean, Integer, LargeBinary, orm
+
+from cthaeh.models import (
+    Block,
+    BlockTransaction,
+    BlockUncle,
+    Header,
+    Log,
+    LogTopic,
+    Receipt,
+    Topic,
+    Transaction,
+)
+from cthaeh.rows import BatchRows, Mapping
+from cthaeh.topics import get_topic_dictionary
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+# The signature is followed by the flags field and the length of the header
+# extension area, both of which are zero.
+COPY_HEADER = COPY_SIGNATURE + struct.pack("!ii", 0, 0)
+COPY_TRAILER = struct.pack("!h", -1)
+
+NULL_FIELD = struct.pack("!i", -1)
+_FIELD_COUNT = struct.Struct("!h")
+_FIELD_LENGTH = struct.Struct("!i")
+_INT8_FIELD = struct.Struct("!iq")
+_INT4_FIELD = struct.Struct("!ii")
+_BOOL_FIELD = struct.Struct("!i?")
+
+TOPIC_STAGING_TABLE = "topic_staging"
+
+FieldEncoder = Callable[[Any], bytes]
+CopyPayload = Tuple[str, Tuple[str, ...], bytes]
+
+
+def _encode_bytea(value: bytes) -> bytes:
+    return _FIELD_LENGTH.pack(len(value)) + value
+
+
+def _encode_int8(value: int) -> bytes:
+    return _INT8_FIELD.pack(8, value)
+
+
+def _encode_int4(value: int) -> bytes:
+    return _INT4_FIELD.pack(4, value)
+
+
+def _encode_bool(value: bool) -> bytes:
+    return _BOOL_FIELD.pack(1, value)
+
+
+def _get_field_encoder(column_type: Any) -> FieldEncoder:
+    # `BigInteger` subclasses `Integer` so it is checked first.
+    if isinstance(column_type, BigInteger):
+        return _encode_int8
+    elif isinstance(column_type, Integer):
+        return _encode_int4
+    elif isinstance(column_type, Boolean):
+        return _encode_bool
+    elif isinstance(column_type, LargeBinary):
+        return _encode_bytea
+    else:
+        raise TypeError(f"No binary COPY encoding for column type: {column_type!r}")
+
+
+def encode_copy_rows(
+    encoders: Sequence[FieldEncoder], rows: Iterable[Sequence[Any]]
+) -> bytes:
+    """
+    Encode rows in the binary `COPY` format, with `None` encoded as NULL.
+    """
+    buffer = io.BytesIO()
+    buffer.write(COPY_HEADER)
+    field_count = _FIELD_COUNT.pack(len(encoders))
+    for row in rows:
+        buffer.write(field_count)
+        for encoder, value in zip(encoders, row):
+            buffer.write(NULL_FIELD if value is None else encoder(value))
+    buffer.write(COPY_TRAILER)
+    return buffer.getvalue()
+
+
+def _copy_payload(
+    model: Any, mappings: Sequence[Mapping], table: str = None
+) -> CopyPayload:
+    columns = model.__table__.columns
+    names = tuple(mappings[0]) if mappings else ()
+    encoders = tuple(_get_field_encoder(columns[name].type) for name in names)
+    payload = encode_copy_rows(
+        encoders, (tuple(mapping[name] for name in names) for mapping in mappings)
+    )
+    return (model.__tablename__ if table is None else table, names, payload)
+
+
+def prepare_copy_payloads(
+    rows: BatchRows, log_ids: Sequence[int], topics: Optional[Sequence[Hash32]] = None
+) -> Tuple[CopyPayload, ...]:
+    """
+    Encode the rows of a batch as binary `COPY` payloads, in the order they
+    must be copied in.  The logs of the batch are given the primary keys in
+    `log_ids`, and `topics`, or every topic of the batch if it is not
+    given, are copied into the staging table.
+    """
+    if topics is None:
+        topics = tuple(dict.fromkeys(topic for _, _, topic in rows.log_topics))
+
+    if len(rows.logs) != len(log_ids):
+        raise ValueError(f"Expected {len(rows.logs)} log ids, got {len(log_ids)}")
+
+    logs_with_ids: List[Dict[str, object]] = [
+        dict(mapping, id=log_id) for mapping, log_id in zip(rows.logs, log_ids)
+    ]
+
+    return (
+        _copy_payload(Header, rows.headers),
+        _copy_payload(Block, rows.blocks),
+        _copy_payload(Transaction, rows.transactions),
+        _copy_payload(Receipt, rows.receipts),
+        _copy_payload(BlockUncle, rows.block_uncles),
+        _copy_payload(BlockTransaction, rows.block_transactions),
+        _copy_payload(
+            Topic,
+            tuple({"topic": topic} for topic in topics),
+            table=TOPIC_STAGING_TABLE,
+        ),
+        _copy_payload(Log, logs_with_ids),
+        _copy_payload(
+            LogTopic,
+            tuple(
+                {"idx": idx, "topic_topic": topic, "log_id": log_ids[log_offset]}
+                for log_offset, idx, topic in rows.log_topics
+            ),
+        ),
+    )
+
+
+def _reserve_log_ids(cursor: Any, count: int) -> Tuple[int, ...]:
+    if not count:
+        return ()
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence('log', 'id')) "
+        "FROM generate_series(1, %s)",
+        (count,),
+    )
+    return tuple(log_id for (log_id,) in cursor.fetchall())
+
+
+def import_batch_rows_copy(session: orm.Session, rows: BatchRows) -> None:
+    # The raw connection is the one the session is using, so the copied rows
+    # are committed along with the session.
+    connection = session.connection().connection
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS {TOPIC_STAGING_TABLE} "
+            "(topic bytea NOT NULL)"
+        )
+        log_ids = _reserve_log_ids(cursor, len(rows.logs))
+        topics = get_topic_dictionary(session).stage(
+            session, (topic for _, _, topic in rows.log_topics)
+        )
+
+        for table, columns, payload in prepare_copy_payloads(rows, log_ids, topics):
+            if not columns:
+                continue
+            # Columns such as `to` are reserved words, so every name is quoted.
+            quoted_columns = ", ".join(f'"{column}"' for column in columns)
+            cursor.copy_expert(
+                f'COPY "{table}" ({quoted_columns}) FROM STDIN WITH (FORMAT binary)',
+                io.BytesIO(payload),
+            )
+            if table == TOPIC_STAGING_TABLE:
+                cursor.execute(
+                    f"INSERT INTO topic (topic) SELECT topic FROM {TOPIC_STAGING_TABLE} "
+                    "ON CONFLICT DO NOTHING"
+                )
+                cursor.execute(f"TRUNCATE {TOPIC_STAGING_TABLE}")
+
+
+def supports_copy(session: orm.Session) -> bool:
+    dialect = session.get_bind().dialect
+    return bool(dialect.name == "postgresql" and dialect.driver == "psycopg2")
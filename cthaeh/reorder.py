@@ -0,0 +1,103 @@
+from typing import Generic, List, Optional, TypeVar
+
+import trio
+
+TItem = TypeVar("TItem")
+
+
+class ReorderWindow(Generic[TItem]):
+    """
+    A fixed capacity window which accepts items out of order and releases
+    them in order.
+
+    Items are keyed by consecutive integers starting at `start_at`.  The
+    window covers the `capacity` keys starting from the next key to be
+    released, and items are stored in a ring buffer indexed by their offset
+    from it, so that inserting and releasing items is O(1).
+
+    Callers wait in `reserve` until a key is within the window before
+    producing the item for it, which bounds the number of items held at
+    once no matter how far ahead producers get.
+    """
+
+    def __init__(self, start_at: int, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError(f"Capacity must be positive: {capacity}")
+
+        self.capacity = capacity
+        self._next = start_at
+        self._slots: List[Optional[TItem]] = [None] * capacity
+        self._depth = 0
+        self._changed = trio.Event()
+
+    @property
+    def next_key(self) -> int:
+        """
+        The key of the next item to be released.
+        """
+        return self._next
+
+    @property
+    def depth(self) -> int:
+        """
+        The number of items held in the window.
+        """
+        return self._depth
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = trio.Event()
+
+    def _offset(self, key: int) -> int:
+        offset = key - self._next
+        if offset < 0:
+            raise ValueError(f"Key {key} has already been released")
+        elif offset >= self.capacity:
+            raise ValueError(
+                f"Key {key} is beyond the window: {self._next}..{self._next + self.capacity}"
+            )
+        return offset
+
+    async def reserve(self, key: int) -> None:
+        """
+        Wait until `key` is within the window.
+        """
+        while key >= self._next + self.capacity:
+            await self._changed.wait()
+
+    def put(self, key: int, item: TItem) -> None:
+        self._offset(key)
+        index = key % self.capacity
+        if self._slots[index] is not None:
+            raise ValueError(f"Key {key} has already been filled")
+
+        self._slots[index] = item
+        self._depth += 1
+        if key == self._next:
+            self._notify()
+
+    def get_nowait(self) -> TItem:
+        """
+        Release the next item in order if it has arrived, or raise
+        `trio.WouldBlock` if it has not.
+        """
+        index = self._next % self.capacity
+        item = self._slots[index]
+        if item is None:
+            raise trio.WouldBlock
+
+        self._slots[index] = None
+        self._depth -= 1
+        self._next += 1
+        self._notify()
+        return item
+
+    async def get(self) -> TItem:
+        """
+        Wait for the next item in order and release it, moving the window on
+        by one.
+        """
+        while self._slots[self._next % self.capacity] is None:
+            await self._changed.wait()
+
+        return self.get_nowait()
@@ -0,0 +1,329 @@
+"""
+Prune the blocks which have fallen out of a retention window.
+
+A `RetentionPolicy` keeps the most recent blocks, by count, by age or by
+both, measured back from the head of what has been loaded.  The `Pruner`
+deletes the blocks older than that, along with their transactions,
+receipts, logs and uncles, a bounded range of blocks at a time with a
+commit after each range.  Each delete is then small, and the locks it takes
+are held only briefly.  When the denormalized logs are partitioned, the
+partitions which have fallen out of the window entirely are dropped instead
+of deleting their rows, and only the rows of a partition which still holds
+retained blocks are deleted.
+
+The first block which has not been pruned is recorded in the `pruning`
+table, so that requests for logs from before it can be refused rather than
+answered with nothing.
+"""
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from async_service import Service
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Integer,
+    MetaData,
+    Table,
+    and_,
+    func,
+    inspect,
+    orm,
+    select,
+)
+from sqlalchemy.engine import Engine
+
+from cthaeh._utils import every
+from cthaeh.compact import uses_compact_schema
+from cthaeh.constants import MAX_UNCLE_DEPTH
+from cthaeh.flat_logs import flatlog, uses_flat_logs
+from cthaeh.models import (
+    Block,
+    BlockTransaction,
+    BlockUncle,
+    Header,
+    Log,
+    LogTopic,
+    Receipt,
+    Transaction,
+)
+from cthaeh.partitions import LogPartitioner, get_log_partitioner, get_partition_name
+from cthaeh.writer import DatabaseWriterAPI
+
+DEFAULT_PRUNE_BATCH_SIZE = 1000
+DEFAULT_PRUNE_INTERVAL = 60.0
+
+metadata = MetaData()
+
+pruning = Table(
+    "pruning",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("pruned_below", BigInteger, nullable=False),
+)
+
+_PRUNING_ID = 1
+
+
+def uses_pruning(engine: Engine) -> bool:
+    return pruning.name in inspect(engine).get_table_names()
+
+
+def get_pruned_below(session: orm.Session) -> Optional[int]:
+    """
+    The lowest block number which has not been pruned, or `None` if
+    nothing has been.
+    """
+    return session.execute(  # type: ignore
+        select([pruning.c.pruned_below]).where(pruning.c.id == _PRUNING_ID)
+    ).scalar()
+
+
+def _set_pruned_below(session: orm.Session, block_number: int) -> None:
+    pruned_below = get_pruned_below(session)
+    if pruned_below is None:
+        session.execute(
+            pruning.insert(), {"id": _PRUNING_ID, "pruned_below": block_number}
+        )
+    elif block_number > pruned_below:
+        session.execute(
+            pruning.update()
+            .where(pruning.c.id == _PRUNING_ID)
+            .values(pruned_below=block_number)
+        )
+
+
+class RetentionPolicy:
+    """
+    Keep the `max_blocks` most recent blocks, and the blocks whose
+    timestamp is within `max_age` seconds of that of the most recent one.
+    Blocks outside of either limit are pruned.
+    """
+
+    def __init__(
+        self, max_blocks: Optional[int] = None, max_age: Optional[float] = None
+    ) -> None:
+        if max_blocks is None and max_age is None:
+            raise ValueError("A retention policy needs a block count or an age")
+        elif max_blocks is not None and max_blocks < 1:
+            raise ValueError(f"max_blocks must be positive: {max_blocks}")
+        elif max_age is not None and max_age <= 0:
+            raise ValueError(f"max_age must be positive: {max_age}")
+
+        self.max_blocks = max_blocks
+        self.max_age = max_age
+
+    def get_retained_from(self, session: orm.Session) -> Optional[int]:
+        """
+        The lowest block number to retain, or `None` if nothing has been
+        loaded yet.
+        """
+        head = (
+            session.query(Header.block_number, Header.timestamp)  # type: ignore
+            .filter(Header.is_canonical.is_(True))  # type: ignore
+            .order_by(Header.block_number.desc())
+            .first()
+        )
+        if head is None:
+            return None
+
+        head_number, head_timestamp = head
+        retained_from = 0
+        if self.max_blocks is not None:
+            retained_from = max(retained_from, head_number - self.max_blocks + 1)
+        if self.max_age is not None:
+            oldest_retained = (
+                session.query(func.min(Header.block_number))  # type: ignore
+                .filter(
+                    Header.is_canonical.is_(True),  # type: ignore
+                    Header.timestamp >= head_timestamp - self.max_age,
+                )
+                .scalar()
+            )
+            retained_from = max(retained_from, oldest_retained)
+        return int(retained_from)
+
+
+def _get_lowest_block_number(session: orm.Session) -> Optional[int]:
+    lowest_block_number: Optional[int] = (
+        session.query(func.min(Header.block_number))  # type: ignore
+        .join(Block, Block.header_hash == Header.hash)
+        .scalar()
+    )
+    return lowest_block_number
+
+
+def _delete(session: orm.Session, table: Table, *filters: Any) -> int:
+    return int(session.execute(table.delete().where(and_(*filters))).rowcount)
+
+
+def prune_blocks(session: orm.Session, start_at: int, end_at: int) -> int:
+    """
+    Delete the blocks numbered from `start_at` up to but not including
+    `end_at`, along with everything which belongs to them, and return the
+    number of rows deleted.  Topics are shared between blocks and kept.
+    """
+    header = Header.__table__
+    block_hashes = (
+        select([Block.header_hash])
+        .select_from(Block.__table__.join(header, Block.header_hash == Header.hash))
+        .where(and_(Header.block_number >= start_at, Header.block_number < end_at))
+    )
+    transaction_hashes = select([Transaction.hash]).where(
+        Transaction.block_header_hash.in_(block_hashes)
+    )
+    log_ids = select([Log.id]).where(Log.receipt_hash.in_(transaction_hashes))
+
+    num_deleted = sum(
+        (
+            _delete(session, LogTopic.__table__, LogTopic.log_id.in_(log_ids)),
+            _delete(session, Log.__table__, Log.receipt_hash.in_(transaction_hashes)),
+            _delete(
+                session,
+                Receipt.__table__,
+                Receipt.transaction_hash.in_(transaction_hashes),
+            ),
+            _delete(
+                session,
+                BlockTransaction.__table__,
+                BlockTransaction.block_header_hash.in_(block_hashes),
+            ),
+            _delete(
+                session,
+                Transaction.__table__,
+                Transaction.block_header_hash.in_(block_hashes),
+            ),
+            _delete(
+                session,
+                BlockUncle.__table__,
+                BlockUncle.block_header_hash.in_(block_hashes),
+            ),
+            _delete(session, Block.__table__, Block.header_hash.in_(block_hashes)),
+        )
+    )
+
+    # Headers go once they are neither a block nor an uncle of a block that
+    # is kept, which includes the uncles of the blocks deleted above.
+    orphaned_headers = header.alias()
+    orphaned_header_hashes = select([orphaned_headers.c.hash]).where(
+        and_(
+            orphaned_headers.c.block_number >= start_at - MAX_UNCLE_DEPTH,
+            orphaned_headers.c.block_number < end_at,
+            ~orphaned_headers.c.hash.in_(select([Block.header_hash])),
+            ~orphaned_headers.c.hash.in_(select([BlockUncle.uncle_hash])),
+        )
+    )
+    # The oldest headers that are kept lose their parent.
+    session.execute(
+        header.update()
+        .where(Header._parent_hash.in_(orphaned_header_hashes))
+        .values(_parent_hash=None)
+    )
+    num_deleted += _delete(session, header, Header.hash.in_(orphaned_header_hashes))
+    return num_deleted
+
+
+def _prune_flat_logs(
+    session: orm.Session,
+    partitioner: Optional[LogPartitioner],
+    start_at: int,
+    end_at: int,
+) -> int:
+    if partitioner is None:
+        return _delete(
+            session,
+            flatlog,
+            flatlog.c.block_number >= start_at,
+            flatlog.c.block_number < end_at,
+        )
+
+    # Partitions are dropped once every block in them has been pruned, while
+    # the rows of the pruned blocks in the partition holding `end_at` are
+    # deleted.
+    width = partitioner.width
+    dropped_below = end_at - end_at % width
+    for start in range(start_at - start_at % width, dropped_below, width):
+        session.execute(
+            f'DROP TABLE IF EXISTS "{get_partition_name(flatlog.name, start)}"'
+        )
+
+    if dropped_below < end_at:
+        return _delete(
+            session,
+            flatlog,
+            flatlog.c.block_number >= max(start_at, dropped_below),
+            flatlog.c.block_number < end_at,
+        )
+    else:
+        return 0
+
+
+class Pruner(Service):
+    logger = logging.getLogger("cthaeh.retention.Pruner")
+
+    def __init__(
+        self,
+        engine: Engine,
+        writer: DatabaseWriterAPI,
+        policy: RetentionPolicy,
+        batch_size: int = DEFAULT_PRUNE_BATCH_SIZE,
+        interval: float = DEFAULT_PRUNE_INTERVAL,
+        commit: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> None:
+        if uses_compact_schema(engine):
+            raise ValueError("Pruning is not supported for the compact schema")
+        elif batch_size < 1:
+            raise ValueError(f"The prune batch size must be positive: {batch_size}")
+
+        self._writer = writer
+        # Pruning commits through whatever else writes through the writer,
+        # like the loader, so that it can account for the commit.
+        self._commit = commit
+        self._policy = policy
+        self._batch_size = batch_size
+        self._interval = interval
+        self._has_flat_logs = uses_flat_logs(engine)
+        self._partitioner = get_log_partitioner(engine)
+
+    async def run(self) -> None:
+        async for _ in every(self._interval):  # noqa: F841
+            await self.prune()
+
+    async def prune(self) -> None:
+        """
+        Prune every block which has fallen out of the retention window, one
+        batch of blocks at a time.
+        """
+        retained_from = await self._writer.write(self._policy.get_retained_from)
+        if retained_from is None:
+            return
+
+        start_at = await self._writer.write(_get_lowest_block_number)
+        if start_at is None or start_at >= retained_from:
+            return
+
+        self.logger.info("Pruning blocks #%d - #%d", start_at, retained_from - 1)
+        while start_at < retained_from:
+            end_at = min(start_at + self._batch_size, retained_from)
+            num_deleted = await self._writer.write(self._prune_batch, start_at, end_at)
+            if self._commit is None:
+                await self._writer.write(_commit_session)
+            else:
+                await self._commit()
+            self.logger.debug(
+                "Pruned blocks #%d - #%d: rows=%d", start_at, end_at - 1, num_deleted
+            )
+            start_at = end_at
+
+    def _prune_batch(self, session: orm.Session, start_at: int, end_at: int) -> int:
+        num_deleted = prune_blocks(session, start_at, end_at)
+        if self._has_flat_logs:
+            num_deleted += _prune_flat_logs(
+                session, self._partitioner, start_at, end_at
+            )
+        _set_pruned_below(session, end_at)
+        return num_deleted
+
+
+def _commit_session(session: orm.Session) -> None:
+    session.commit()  # type: ignore
@@ -0,0 +1,219 @@
+import collections
+import logging
+import math
+import random
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import trio
+from web3._utils.threads import Timeout
+from web3.types import RPCEndpoint
+
+from cthaeh._utils import TaskStatus
+from cthaeh.batch import BatchRequestError, RPCRequestArgs
+from cthaeh.client import BlockHashMismatch, HTTPError, JSONRPCClientAPI, RPCError
+
+# JSON-RPC error codes which will not go away by asking again.  Nodes also
+# use -32005 for exceeding log query limits which callers handle themselves.
+NON_RETRYABLE_ERROR_CODES = frozenset((-32700, -32600, -32601, -32602, -32005))
+
+RETRYABLE_EXCEPTIONS = (
+    OSError,
+    trio.BrokenResourceError,
+    trio.TooSlowError,
+    Timeout,
+    HTTPError,
+    BlockHashMismatch,
+)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    if isinstance(error, (RPCError, BatchRequestError)):
+        if isinstance(error.error, dict):
+            return error.error.get("code") not in NON_RETRYABLE_ERROR_CODES
+        return True
+    return isinstance(error, RETRYABLE_EXCEPTIONS)
+
+
+# The number of recent latencies per method used to pick the hedging delay,
+# and the number needed before any requests are hedged.
+LATENCY_WINDOW = 256
+MIN_HEDGE_SAMPLES = 32
+
+BATCH_KEY = "batch"
+
+
+class RetryingClient(JSONRPCClientAPI):
+    """
+    Wrap another client, making each request fault tolerant.
+
+    - Requests failing with a transient error are retried up to
+      `max_retries` times, waiting a random delay of up to
+      ``backoff * 2 ** attempt`` seconds (capped at `max_backoff`) between
+      attempts.
+    - Each attempt is abandoned, and retried, if it takes longer than
+      `timeout` seconds.
+    - If `hedge_percentile` is set, an attempt which has not completed after
+      that percentile of the recent latencies for the same method is
+      duplicated and whichever answer comes back first wins.
+    """
+
+    logger = logging.getLogger("cthaeh.retry.RetryingClient")
+
+    def __init__(
+        self,
+        client: JSONRPCClientAPI,
+        max_retries: int = 3,
+        backoff: float = 0.1,
+        max_backoff: float = 10.0,
+        timeout: Optional[float] = None,
+        hedge_percentile: Optional[float] = None,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        if max_retries < 0:
+            raise ValueError(f"Retries cannot be negative: {max_retries}")
+        if hedge_percentile is not None and not 0 < hedge_percentile < 100:
+            raise ValueError(
+                f"Hedge percentile must be between 0 and 100: {hedge_percentile}"
+            )
+
+        self.client = client
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._timeout = math.inf if timeout is None else timeout
+        self._hedge_percentile = hedge_percentile
+        self._rng = random.Random() if rng is None else rng
+
+        self._latencies: Dict[str, Deque[float]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=LATENCY_WINDOW)
+        )
+        self._stats: Dict[str, int] = collections.Counter()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "retries": self._stats["retries"],
+            "timeouts": self._stats["timeouts"],
+            "hedges": self._stats["hedges"],
+            "hedge_wins": self._stats["hedge_wins"],
+        }
+
+    async def run(self) -> None:
+        self.manager.run_daemon_child_service(self.client)
+        await self.manager.wait_finished()
+
+    async def make_request(self, method: RPCEndpoint, params: Sequence[Any]) -> Any:
+        return await self._call(method, self.client.make_request, method, params)
+
+    async def make_batch_request(
+        self, requests: Sequence[RPCRequestArgs]
+    ) -> Tuple[Any, ...]:
+        return tuple(
+            await self._call(BATCH_KEY, self.client.make_batch_request, requests)
+        )
+
+    async def subscribe_new_heads(
+        self,
+        send_channel: trio.abc.SendChannel[Any],
+        *,
+        task_status: TaskStatus = trio.TASK_STATUS_IGNORED,
+    ) -> None:
+        # A lost subscription is left to the subscriber to re-establish.
+        await self.client.subscribe_new_heads(send_channel, task_status=task_status)
+
+    async def _call(
+        self, key: str, request_fn: Callable[..., Awaitable[Any]], *args: Any
+    ) -> Any:
+        attempt = 0
+        while True:
+            try:
+                with trio.fail_after(self._timeout):
+                    return await self._hedged_call(key, request_fn, *args)
+            except Exception as err:
+                if isinstance(err, trio.TooSlowError):
+                    self._stats["timeouts"] += 1
+                if attempt >= self._max_retries or not is_retryable_error(err):
+                    raise
+
+                delay = self._rng.uniform(
+                    0, min(self._max_backoff, self._backoff * 2 ** attempt)
+                )
+                self._stats["retries"] += 1
+                self.logger.debug(
+                    "Retrying %s in %.3fs after attempt #%d failed: %r",
+                    key,
+                    delay,
+                    attempt + 1,
+                    err,
+                )
+                await trio.sleep(delay)
+                attempt += 1
+
+    def _get_hedge_delay(self, key: str) -> Optional[float]:
+        if self._hedge_percentile is None:
+            return None
+
+        latencies = self._latencies[key]
+        if len(latencies) < MIN_HEDGE_SAMPLES:
+            return None
+
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self._hedge_percentile / 100))
+        return ordered[index]
+
+    async def _hedged_call(
+        self, key: str, request_fn: Callable[..., Awaitable[Any]], *args: Any
+    ) -> Any:
+        hedge_delay = self._get_hedge_delay(key)
+        results: List[Tuple[bool, Any]] = []
+        errors: List[Exception] = []
+        in_flight = 0
+
+        async def _attempt(is_hedge: bool) -> None:
+            nonlocal in_flight
+
+            started_at = trio.current_time()
+            in_flight += 1
+            try:
+                result = await request_fn(*args)
+            except Exception as err:
+                errors.append(err)
+                # Only give up once there is no other attempt which might
+                # still succeed.
+                if in_flight == 1:
+                    nursery.cancel_scope.cancel()
+                return
+            finally:
+                in_flight -= 1
+
+            self._latencies[key].append(trio.current_time() - started_at)
+            results.append((is_hedge, result))
+            nursery.cancel_scope.cancel()
+
+        async def _hedge(delay: float) -> None:
+            await trio.sleep(delay)
+            self._stats["hedges"] += 1
+            self.logger.debug("Hedging %s after %.3fs", key, delay)
+            await _attempt(True)
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(_attempt, False)
+            if hedge_delay is not None:
+                nursery.start_soon(_hedge, hedge_delay)
+
+        if results:
+            is_hedge, result = results[0]
+            if is_hedge:
+                self._stats["hedge_wins"] += 1
+            return result
+        else:
+            raise errors[-1]
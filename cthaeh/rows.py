@@ -0,0 +1,232 @@
+"""
+Prepare the database rows for a batch of blocks ahead of loading them.
+
+Rows are built as mappings of column values, one table at a time, by
+walking the columns of a `BlockBatch`, so that every table of a batch is
+loaded with a single bulk insert.  Preparing every row of a batch is pure
+Python work that needs no database, so it can be done ahead of time, off
+the thread that talks to the database, or in an extraction worker process.
+"""
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+from eth_typing import Hash32
+from eth_utils import to_tuple
+
+from cthaeh.block_batch import BlockBatch, HeaderColumns
+from cthaeh.ir import Block
+
+Mapping = Dict[str, object]
+# Log topics refer to their log by its position within the batch, as the
+# primary key of the log is only known once it has been inserted.
+LogTopicRow = Tuple[int, int, Hash32]
+
+
+def _iter_header_mappings(headers: HeaderColumns) -> Iterator[Mapping]:
+    for index in range(len(headers)):
+        block_number = headers.block_number[index]
+        yield {
+            "hash": headers.hash[index],
+            "is_canonical": bool(headers.is_canonical[index]),
+            "_parent_hash": None if block_number == 0 else headers.parent_hash[index],
+            "uncles_hash": headers.uncles_hash[index],
+            "coinbase": headers.coinbase[index],
+            "state_root": headers.state_root[index],
+            "transaction_root": headers.transaction_root[index],
+            "receipt_root": headers.receipt_root[index],
+            "_bloom": headers.bloom[index],
+            "difficulty": headers.difficulty[index],
+            "block_number": block_number,
+            "gas_limit": headers.gas_limit[index],
+            "gas_used": headers.gas_used[index],
+            "timestamp": headers.timestamp[index],
+            "extra_data": headers.extra_data[index],
+            "nonce": headers.nonce[index],
+        }
+
+
+@to_tuple
+def header_mappings(batch: BlockBatch) -> Iterator[Mapping]:
+    """
+    The canonical headers of a batch followed by its uncles.
+    """
+    yield from _iter_header_mappings(batch.headers)
+    yield from _iter_header_mappings(batch.uncles)
+
+
+@to_tuple
+def block_mappings(batch: BlockBatch) -> Iterator[Mapping]:
+    for header_hash in batch.headers.hash:
+        yield {"header_hash": header_hash}
+
+
+@to_tuple
+def block_uncle_mappings(batch: BlockBatch) -> Iterator[Mapping]:
+    for index, header_hash in enumerate(batch.headers.hash):
+        for idx, uncle_index in enumerate(batch.get_uncle_range(index)):
+            yield {
+                "idx": idx,
+                "block_header_hash": header_hash,
+                "uncle_hash": batch.uncles.hash[uncle_index],
+            }
+
+
+@to_tuple
+def transaction_mappings(batch: BlockBatch) -> Iterator[Mapping]:
+    transactions = batch.transactions
+    for index, header_hash in enumerate(batch.headers.hash):
+        for transaction_index in batch.get_transaction_range(index):
+            to = transactions.to[transaction_index]
+            yield {
+                "hash": transactions.hash[transaction_index],
+                "block_header_hash": header_hash,
+                "nonce": transactions.nonce[transaction_index],
+                "gas_price": transactions.gas_price[transaction_index],
+                "gas": transactions.gas[transaction_index],
+                "to": to if to else None,
+                "value": transactions.value[transaction_index],
+                "data": transactions.data[transaction_index],
+                "v": transactions.v[transaction_index],
+                "r": transactions.r[transaction_index],
+                "s": transactions.s[transaction_index],
+                "sender": transactions.sender[transaction_index],
+            }
+
+
+@to_tuple
+def block_transaction_mappings(batch: BlockBatch) -> Iterator[Mapping]:
+    for index, header_hash in enumerate(batch.headers.hash):
+        for idx, transaction_index in enumerate(batch.get_transaction_range(index)):
+            yield {
+                "idx": idx,
+                "block_header_hash": header_hash,
+                "transaction_hash": batch.transactions.hash[transaction_index],
+            }
+
+
+@to_tuple
+def receipt_mappings(batch: BlockBatch) -> Iterator[Mapping]:
+    receipts = batch.receipts
+    for index, transaction_hash in enumerate(batch.transactions.hash):
+        yield {
+            "transaction_hash": transaction_hash,
+            "state_root": receipts.state_root[index],
+            "gas_used": receipts.gas_used[index],
+            "_bloom": receipts.bloom[index],
+        }
+
+
+@to_tuple
+def log_mappings(batch: BlockBatch) -> Iterator[Mapping]:
+    """
+    The logs of a batch, in the order that `log_topic_rows` refers to them.
+    """
+    receipts = batch.receipts
+    for index, transaction_hash in enumerate(batch.transactions.hash):
+        for idx, log_index in enumerate(receipts.get_log_range(index)):
+            yield {
+                "idx": idx,
+                "receipt_hash": transaction_hash,
+                "address": receipts.log_address[log_index],
+                "data": receipts.log_data[log_index],
+            }
+
+
+def log_topic_rows(batch: BlockBatch) -> Tuple[LogTopicRow, ...]:
+    receipts = batch.receipts
+    rows: List[LogTopicRow] = []
+    for log_index in range(len(receipts.log_address)):
+        for idx, topic_index in enumerate(receipts.get_topic_range(log_index)):
+            rows.append((log_index, idx, Hash32(receipts.topics[topic_index])))
+    return tuple(rows)
+
+
+class BatchRows(NamedTuple):
+    """
+    Every row of a batch of blocks, ready to be inserted.
+    """
+
+    batch: BlockBatch
+    headers: Tuple[Mapping, ...]
+    blocks: Tuple[Mapping, ...]
+    transactions: Tuple[Mapping, ...]
+    receipts: Tuple[Mapping, ...]
+    block_uncles: Tuple[Mapping, ...]
+    block_transactions: Tuple[Mapping, ...]
+    logs: Tuple[Mapping, ...]
+    log_topics: Tuple[LogTopicRow, ...]
+
+    @classmethod
+    def concat(cls, batch_rows: Iterable["BatchRows"]) -> "BatchRows":
+        """
+        Join the rows of consecutive batches as the rows of a single batch.
+        """
+        batch_rows = tuple(batch_rows)
+        log_topics: List[LogTopicRow] = []
+        num_logs = 0
+        for rows in batch_rows:
+            log_topics.extend(
+                (num_logs + log_offset, idx, topic)
+                for log_offset, idx, topic in rows.log_topics
+            )
+            num_logs += len(rows.logs)
+
+        return cls(
+            batch=BlockBatch.concat(rows.batch for rows in batch_rows),
+            headers=_concat_tables(rows.headers for rows in batch_rows),
+            blocks=_concat_tables(rows.blocks for rows in batch_rows),
+            transactions=_concat_tables(rows.transactions for rows in batch_rows),
+            receipts=_concat_tables(rows.receipts for rows in batch_rows),
+            block_uncles=_concat_tables(rows.block_uncles for rows in batch_rows),
+            block_transactions=_concat_tables(
+                rows.block_transactions for rows in batch_rows
+            ),
+            logs=_concat_tables(rows.logs for rows in batch_rows),
+            log_topics=tuple(log_topics),
+        )
+
+    def __repr__(self) -> str:
+        return f"BatchRows({self.batch!r})"
+
+    @property
+    def row_counts(self) -> Dict[str, int]:
+        """
+        The number of rows of the batch for each table they are inserted
+        into, not counting topics, which are only inserted once.
+        """
+        return {
+            "header": len(self.headers),
+            "block": len(self.blocks),
+            "transaction": len(self.transactions),
+            "receipt": len(self.receipts),
+            "blockuncle": len(self.block_uncles),
+            "blocktransaction": len(self.block_transactions),
+            "log": len(self.logs),
+            "logtopic": len(self.log_topics),
+        }
+
+    @property
+    def num_rows(self) -> int:
+        return sum(self.row_counts.values())
+
+
+def _concat_tables(tables: Iterable[Tuple[Mapping, ...]]) -> Tuple[Mapping, ...]:
+    return tuple(mapping for table in tables for mapping in table)
+
+
+# The loader accepts blocks one at a time as `ir` objects, many at a time as
+# batches, or as batches with their rows already prepared.
+LoadableBlock = Union[Block, BlockBatch, BatchRows]
+
+
+def prepare_batch_rows(batch: BlockBatch) -> BatchRows:
+    return BatchRows(
+        batch=batch,
+        headers=header_mappings(batch),
+        blocks=block_mappings(batch),
+        transactions=transaction_mappings(batch),
+        receipts=receipt_mappings(batch),
+        block_uncles=block_uncle_mappings(batch),
+        block_transactions=block_transaction_mappings(batch),
+        logs=log_mappings(batch),
+        log_topics=log_topic_rows(batch),
+    )
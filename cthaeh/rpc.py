@@ -22,8 +22,17 @@ from mypy_extensions import TypedDict
 from sqlalchemy import orm
 import trio
 
-from cthaeh.filter import FilterParams, filter_logs
+from cthaeh.compact import uses_compact_schema
+from cthaeh.filter import (
+    FilterParams,
+    LogRecord,
+    filter_logs,
+    filter_logs_compact,
+    filter_logs_flat,
+)
+from cthaeh.flat_logs import uses_flat_logs
 from cthaeh.models import BlockTransaction, Log
+from cthaeh.retention import get_pruned_below, uses_pruning
 
 NEW_LINE = "\n"
 
@@ -93,9 +102,24 @@ def generate_response(request: RPCRequest, result: Any, error: Optional[str]) ->
 class RPCServer(Service):
     logger = logging.getLogger("cthaeh.rpc.RPCServer")
 
-    def __init__(self, ipc_path: pathlib.Path, session: orm.Session) -> None:
+    def __init__(
+        self,
+        ipc_path: pathlib.Path,
+        session: orm.Session,
+        indexes_ready: Optional[trio.Event] = None,
+        end_transactions: bool = False,
+    ) -> None:
         self.ipc_path = ipc_path
         self.session = session
+        # When the session is only read from, its transaction is ended after
+        # each request so that the next one sees what has been committed by
+        # other connections since.
+        self._end_transactions = end_transactions
+        # Queries are refused until the indexes of the database are built.
+        self._indexes_ready = indexes_ready
+        self._is_compact = uses_compact_schema(session.get_bind())
+        self._has_flat_logs = uses_flat_logs(session.get_bind())
+        self._has_pruning = uses_pruning(session.get_bind())
         self._serving = trio.Event()
 
     async def wait_serving(self) -> None:
@@ -121,6 +145,10 @@ class RPCServer(Service):
             )
 
         if method == "getLogs":
+            if self._indexes_ready is not None and not self._indexes_ready.is_set():
+                return generate_response(
+                    request, None, "Unavailable until database indexes are built"
+                )
             return await self._handle_getLogs(request, *params)
         elif method == "getFilterChanges":
             raise NotImplementedError()
@@ -229,8 +257,38 @@ class RPCServer(Service):
         self, request: RPCRequest, raw_params: RawFilterParams
     ) -> str:
         params = _rpc_request_to_filter_params(raw_params)
-        logs = filter_logs(self.session, params)
-        results = tuple(_log_to_rpc_response(log) for log in logs)
+        try:
+            # Logs from blocks which have been pruned are not there to be
+            # returned, so requests which reach back to them are refused.
+            pruned_below = get_pruned_below(self.session) if self._has_pruning else None
+            if pruned_below is not None and (
+                params.from_block is None or params.from_block < pruned_below
+            ):
+                return generate_response(
+                    request,
+                    None,
+                    f"Blocks before #{pruned_below} have been pruned, "
+                    f"fromBlock must be at least {hex(pruned_below)}",
+                )
+
+            if self._has_flat_logs:
+                results = tuple(
+                    _log_record_to_rpc_response(log)
+                    for log in filter_logs_flat(self.session, params)
+                )
+            elif self._is_compact:
+                results = tuple(
+                    _log_record_to_rpc_response(log)
+                    for log in filter_logs_compact(self.session, params)
+                )
+            else:
+                results = tuple(
+                    _log_to_rpc_response(log)
+                    for log in filter_logs(self.session, params)
+                )
+        finally:
+            if self._end_transactions:
+                self.session.rollback()  # type: ignore
         return generate_response(request, results, None)
 
 
@@ -327,3 +385,16 @@ def _log_to_rpc_response(log: Log) -> RPCLog:
         data=encode_hex(log.data),
         topics=[encode_hex(topic.topic) for topic in log.topics],  # type: ignore
     )
+
+
+def _log_record_to_rpc_response(log: LogRecord) -> RPCLog:
+    return RPCLog(
+        logIndex=to_hex(log.idx),
+        transactionIndex=to_hex(log.transaction_index),
+        transactionHash=encode_hex(log.transaction_hash),
+        blockHash=encode_hex(log.block_hash),
+        blockNumber=to_hex(log.block_number),
+        address=to_checksum_address(log.address),
+        data=encode_hex(log.data),
+        topics=[encode_hex(topic) for topic in log.topics],
+    )
@@ -1,3 +1,40 @@
+from typing import Any, Dict, Set
+
+from sqlalchemy import event, orm
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 Session = scoped_session(sessionmaker())
+
+_PENDING_KEY = "cthaeh.session.pending"
+
+
+def stage_until_commit(session: orm.Session, cache: Any) -> Set[Any]:
+    """
+    The set of things the session's transaction is adding to `cache`, which
+    are passed to ``cache.remember`` once the outermost transaction commits
+    and forgotten if it rolls back, so that the cache never holds something
+    whose write did not last.
+    """
+    pending: Dict[Any, Set[Any]] = session.info.setdefault(_PENDING_KEY, {})
+    return pending.setdefault(cache, set())
+
+
+def _remember_committed(session: orm.Session) -> None:
+    # Committing a savepoint does not make what it wrote last.
+    if session.transaction is not None and session.transaction.parent is not None:
+        return
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending is not None:
+        for cache, items in pending.items():
+            cache.remember(items)
+
+
+def _forget_pending(session: orm.Session, _: Any) -> None:
+    # Rolling back a savepoint forgets everything pending in the session, as
+    # which of it the savepoint wrote is not tracked.  Whatever was in fact
+    # kept is simply written again later, and skipped by the database.
+    session.info.pop(_PENDING_KEY, None)
+
+
+event.listen(orm.Session, "after_commit", _remember_committed)  # type: ignore
+event.listen(orm.Session, "after_soft_rollback", _forget_pending)  # type: ignore
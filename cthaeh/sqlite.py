@@ -0,0 +1,154 @@
+"""
+Tune SQLite for loading blocks.
+
+SQLite is used with write-ahead logging, a large page cache and memory
+mapped reads.  Commits are fully durable unless the backfill profile is
+opted into, in which case `synchronous` is turned off while backfilling
+history so that commits do not wait for an fsync.  A crash of the process
+loses nothing that was committed, but losing power or the operating
+system may lose the most recent commits, or corrupt the database.  Once
+the importer reaches the head of the chain, or stops loading, the
+connections are switched back to fully durable commits.
+
+The rows of each batch are loaded with `executemany` on Core inserts whose
+compiled form is cached, rather than through the ORM.
+"""
+import functools
+import logging
+from typing import Any, Dict, Sequence
+
+from sqlalchemy import event, func, orm, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.dml import Insert
+from sqlalchemy.sql.schema import Table
+
+from cthaeh.models import (
+    Block,
+    BlockTransaction,
+    BlockUncle,
+    Header,
+    Log,
+    LogTopic,
+    Receipt,
+    Topic,
+    Transaction,
+)
+from cthaeh.rows import BatchRows, Mapping
+from cthaeh.topics import get_topic_dictionary
+
+# Negative cache sizes are in KiB.
+CACHE_SIZE = -256 * 1024
+MMAP_SIZE = 1024 * 1024 * 1024
+
+BACKFILL_SYNCHRONOUS = "OFF"
+DURABLE_SYNCHRONOUS = "FULL"
+
+
+def is_sqlite(engine: Engine) -> bool:
+    return bool(engine.dialect.name == "sqlite")
+
+
+class SQLiteProfile:
+    """
+    Apply the pragmas for loading blocks to every connection of a SQLite
+    engine, starting out in the backfill profile if `backfill` is set.
+    """
+
+    logger = logging.getLogger("cthaeh.sqlite.SQLiteProfile")
+
+    def __init__(self, engine: Engine, backfill: bool = False) -> None:
+        self.is_backfilling = backfill
+        event.listen(engine, "connect", self._configure_connection)  # type: ignore
+
+    @property
+    def synchronous(self) -> str:
+        if self.is_backfilling:
+            return BACKFILL_SYNCHRONOUS
+        else:
+            return DURABLE_SYNCHRONOUS
+
+    def _configure_connection(self, dbapi_connection: Any, _: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA cache_size={CACHE_SIZE}")
+            cursor.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            cursor.execute(f"PRAGMA synchronous={self.synchronous}")
+        finally:
+            cursor.close()
+
+    def make_durable(self, session: orm.Session) -> None:
+        """
+        Switch from the backfill profile to durable commits, committing
+        whatever the session has pending first, and checkpoint the
+        write-ahead log so that everything committed so far is on disk.
+        """
+        if not self.is_backfilling:
+            return
+
+        self.logger.info("Switching to durable commits")
+        self.is_backfilling = False
+        session.commit()  # type: ignore
+        # New connections pick up the durable profile as they are made, and
+        # any connection being reused is switched over here.
+        session.execute(f"PRAGMA synchronous={self.synchronous}")
+        session.execute("PRAGMA wal_checkpoint(FULL)")
+
+
+# The compiled form of each statement is cached against the statement
+# itself, so every batch uses the same insert statement for each table.
+_compiled_cache: Dict[Any, Any] = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _get_insert(table: Table) -> Insert:
+    if table is Topic.__table__:
+        return table.insert().prefix_with("OR IGNORE")
+    else:
+        return table.insert()
+
+
+def _executemany(connection: Any, table: Table, mappings: Sequence[Mapping]) -> None:
+    if mappings:
+        connection.execute(_get_insert(table), mappings)
+
+
+def import_batch_rows_core(session: orm.Session, rows: BatchRows) -> None:
+    connection = session.connection().execution_options(compiled_cache=_compiled_cache)
+
+    _executemany(connection, Header.__table__, rows.headers)
+    _executemany(connection, Block.__table__, rows.blocks)
+    _executemany(connection, Transaction.__table__, rows.transactions)
+    _executemany(connection, Receipt.__table__, rows.receipts)
+    _executemany(connection, BlockUncle.__table__, rows.block_uncles)
+    _executemany(connection, BlockTransaction.__table__, rows.block_transactions)
+
+    # Only topics which are not known to be in the database are inserted,
+    # and any of those that are there after all are skipped.
+    topics = get_topic_dictionary(session).stage(
+        session, (topic for _, _, topic in rows.log_topics)
+    )
+    _executemany(
+        connection, Topic.__table__, tuple({"topic": topic} for topic in topics)
+    )
+
+    # SQLite has a single writer, so the primary keys of the logs are
+    # assigned here rather than returned from the inserts, so that the
+    # `LogTopic` rows can refer to them.
+    if not rows.logs:
+        return
+    last_log_id = connection.execute(select([func.max(Log.id)])).scalar() or 0
+    log_ids = range(last_log_id + 1, last_log_id + 1 + len(rows.logs))
+    _executemany(
+        connection,
+        Log.__table__,
+        tuple(dict(mapping, id=log_id) for mapping, log_id in zip(rows.logs, log_ids)),
+    )
+    _executemany(
+        connection,
+        LogTopic.__table__,
+        tuple(
+            {"idx": idx, "topic_topic": topic, "log_id": log_ids[log_offset]}
+            for log_offset, idx, topic in rows.log_topics
+        ),
+    )
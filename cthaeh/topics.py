@@ -0,0 +1,141 @@
+"""
+Remember which topics are already in the database.
+
+Nearly every topic of a log has been seen many times before, so rather than
+looking topics up as they are loaded, each database has a `TopicDictionary`
+of the topics known to be in it.  Only the topics of a batch that are not
+in the dictionary are inserted, with a single insert that skips any topic
+which turns out to exist after all.
+
+Topics inserted by a session only become known once its outermost
+transaction commits, and are forgotten if it rolls back, so the dictionary
+never holds a topic whose insert did not last.  The dictionary holds at
+most `max_size` topics, forgetting the least recently used ones first, and
+is filled with up to that many topics from the database when loading
+starts.  Each topic takes about 150 bytes of memory, so the default of 64Ki
+topics takes about 10 MiB.
+"""
+import collections
+import logging
+from typing import Iterable, Set, Tuple
+import weakref
+
+from eth_typing import Hash32
+from sqlalchemy import orm, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+
+from cthaeh.models import Topic
+from cthaeh.session import stage_until_commit
+
+DEFAULT_MAX_TOPICS = 2 ** 16
+
+
+class TopicDictionary:
+    logger = logging.getLogger("cthaeh.topics.TopicDictionary")
+
+    def __init__(self, max_size: int = DEFAULT_MAX_TOPICS) -> None:
+        if max_size < 1:
+            raise ValueError(f"Max size must be at least 1: {max_size}")
+        self.max_size = max_size
+        self._topics: "collections.OrderedDict[Hash32, None]" = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._topics)
+
+    def __contains__(self, topic: object) -> bool:
+        return topic in self._topics
+
+    def warm(self, session: orm.Session) -> None:
+        """
+        Fill the dictionary with the topics already in the database.
+        """
+        result = session.execute(select([Topic.topic]).limit(self.max_size))
+        self.remember(Hash32(topic) for (topic,) in result)
+        self.logger.info("Loaded %d known topics", len(self))
+
+    def remember(self, topics: Iterable[Hash32]) -> None:
+        for topic in topics:
+            self._topics[topic] = None
+            self._topics.move_to_end(topic)
+        while len(self._topics) > self.max_size:
+            self._topics.popitem(last=False)
+
+    def stage(
+        self, session: orm.Session, topics: Iterable[Hash32]
+    ) -> Tuple[Hash32, ...]:
+        """
+        Return the distinct topics that are not known to be in the database,
+        which the caller must insert in the session's transaction.  They
+        become known once that transaction commits.
+        """
+        pending = stage_until_commit(session, self)
+
+        unknown = []
+        for topic in dict.fromkeys(topics):
+            if topic in self._topics:
+                self._topics.move_to_end(topic)
+            elif topic not in pending:
+                unknown.append(topic)
+
+        pending.update(unknown)
+        return tuple(unknown)
+
+
+_topic_dictionaries: "weakref.WeakKeyDictionary[Engine, TopicDictionary]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def configure_topic_dictionary(engine: Engine, max_size: int) -> TopicDictionary:
+    """
+    Replace the dictionary of topics for the database with an empty one
+    which holds at most `max_size` topics.
+    """
+    dictionary = TopicDictionary(max_size)
+    _topic_dictionaries[engine] = dictionary
+    return dictionary
+
+
+def get_topic_dictionary(session: orm.Session) -> TopicDictionary:
+    """
+    The dictionary of topics for the database the session is bound to,
+    shared by every session of the process.
+    """
+    bind = session.get_bind()
+    engine = getattr(bind, "engine", bind)
+    try:
+        return _topic_dictionaries[engine]
+    except KeyError:
+        return _topic_dictionaries.setdefault(engine, TopicDictionary())
+
+
+def insert_topics(session: orm.Session, topics: Tuple[Hash32, ...]) -> None:
+    """
+    Insert topics with a single statement, skipping those which are
+    already in the database.
+    """
+    if not topics:
+        return
+
+    table = Topic.__table__
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        statement = postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect_name == "sqlite":
+        statement = table.insert().prefix_with("OR IGNORE")
+    else:
+        existing: Set[bytes] = {
+            topic
+            for (topic,) in session.execute(
+                select([Topic.topic]).where(Topic.topic.in_(topics))
+            )
+        }
+        topics = tuple(topic for topic in topics if topic not in existing)
+        if not topics:
+            return
+        statement = table.insert()
+
+    session.execute(statement, [{"topic": topic} for topic in topics])
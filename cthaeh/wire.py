@@ -0,0 +1,233 @@
+"""
+A compact, versioned binary encoding of blocks.
+
+Blocks are encoded as a `BlockBatch`, column by column.  After a short
+prefix, each column buffer of the batch is written as a section, which is
+its length followed by the buffer itself, in the order the columns are
+declared.  Integers and offsets are little-endian, and a variable length
+column is written as its offsets followed by its data.
+
+Decoding does not copy: the columns of a decoded batch are `memoryview`
+slices of the encoded buffer, and values are only turned into `bytes` and
+`ir` objects as they are read from the batch.  Decoded batches are read
+only, and `BlockBatch.concat` copies them into a batch which can be grown.
+"""
+from array import array
+import struct
+import sys
+from typing import Iterator, List, Tuple, Union
+
+from cthaeh.block_batch import (
+    BlockBatch,
+    FixedColumn,
+    HeaderColumns,
+    ReceiptColumns,
+    TransactionColumns,
+    VarColumn,
+)
+from cthaeh.ir import Block
+
+MAGIC = b"CTHB"
+VERSION = 1
+
+PREFIX = struct.Struct("<4sHH")
+SECTION_LENGTH = struct.Struct("<Q")
+
+Buffer = Union[bytes, bytearray, memoryview]
+Leaf = Tuple[object, str, object]
+
+
+class DecodingError(ValueError):
+    pass
+
+
+def _iter_leaves(batch: BlockBatch) -> Iterator[Leaf]:
+    """
+    Yield the owner, attribute name and value of each column of a batch, in
+    the order they are encoded.
+    """
+    for name in BlockBatch.__slots__:
+        value = getattr(batch, name)
+        if isinstance(value, (HeaderColumns, TransactionColumns, ReceiptColumns)):
+            for column_name in value.__slots__:
+                yield value, column_name, getattr(value, column_name)
+        else:
+            yield batch, name, value
+
+
+def _array_bytes(values: Union["array[int]", memoryview]) -> Buffer:
+    view = memoryview(values)  # type: ignore
+    if sys.byteorder == "little":
+        return view.cast("B")
+    else:
+        swapped = array(view.format, view.tolist())
+        swapped.byteswap()
+        return swapped.tobytes()
+
+
+def _iter_sections(batch: BlockBatch) -> Iterator[Buffer]:
+    for _, _, leaf in _iter_leaves(batch):
+        if isinstance(leaf, FixedColumn):
+            yield leaf.data
+        elif isinstance(leaf, VarColumn):
+            yield _array_bytes(leaf.offsets)
+            yield leaf.data
+        else:
+            yield _array_bytes(leaf)  # type: ignore
+
+
+def encode_block_batch(batch: BlockBatch) -> bytes:
+    sections = tuple(_iter_sections(batch))
+    encoded = bytearray(PREFIX.pack(MAGIC, VERSION, len(sections)))
+    for section in sections:
+        encoded += SECTION_LENGTH.pack(len(section))
+        encoded += section
+    return bytes(encoded)
+
+
+def encode_block(block: Block) -> bytes:
+    return encode_block_batch(BlockBatch.from_blocks((block,)))
+
+
+class _SectionReader:
+    def __init__(self, buffer: Buffer) -> None:
+        self._view = memoryview(buffer).cast("B")
+        self._offset = 0
+
+    def read_prefix(self) -> int:
+        if len(self._view) < PREFIX.size:
+            raise DecodingError("Encoded block batch is truncated")
+        magic, version, num_sections = PREFIX.unpack_from(self._view)
+        if magic != MAGIC:
+            raise DecodingError(f"Not an encoded block batch: {magic!r}")
+        elif version != VERSION:
+            raise DecodingError(f"Unsupported encoding version: {version}")
+        self._offset = PREFIX.size
+        return num_sections  # type: ignore
+
+    def read(self) -> memoryview:
+        start = self._offset + SECTION_LENGTH.size
+        if start > len(self._view):
+            raise DecodingError("Encoded block batch is truncated")
+        (length,) = SECTION_LENGTH.unpack_from(self._view, self._offset)
+        end = start + length
+        if end > len(self._view):
+            raise DecodingError("Encoded block batch is truncated")
+        self._offset = end
+        return self._view[start:end]
+
+    def read_array(self, typecode: str) -> Union["array[int]", memoryview]:
+        section = self.read()
+        if len(section) % array(typecode).itemsize:
+            raise DecodingError(f"Section is not a whole number of {typecode!r} values")
+        if sys.byteorder == "little":
+            return section.cast(typecode)
+        else:
+            values = array(typecode, section.tobytes())
+            values.byteswap()
+            return values
+
+    def finish(self) -> None:
+        if self._offset != len(self._view):
+            raise DecodingError(
+                f"Encoded block batch has {len(self._view) - self._offset} "
+                "trailing bytes"
+            )
+
+
+def _check(condition: bool, message: str) -> None:
+    if not condition:
+        raise DecodingError(f"Encoded block batch is inconsistent: {message}")
+
+
+def _last(offsets: Union["array[int]", memoryview]) -> int:
+    return offsets[-1] if len(offsets) else 0
+
+
+def _validate(batch: BlockBatch) -> None:
+    for _, name, leaf in _iter_leaves(batch):
+        if isinstance(leaf, VarColumn):
+            _check(_last(leaf.offsets) == len(leaf.data), f"{name} offsets")
+        elif isinstance(leaf, FixedColumn):
+            _check(len(leaf.data) % leaf.width == 0, f"{name} width")
+
+    for headers in (batch.headers, batch.uncles):
+        _check(
+            all(
+                len(getattr(headers, name)) == len(headers)
+                for name in HeaderColumns.__slots__
+            ),
+            "header columns",
+        )
+    transactions = batch.transactions
+    _check(
+        all(
+            len(getattr(transactions, name)) == len(transactions)
+            for name in TransactionColumns.__slots__
+        ),
+        "transaction columns",
+    )
+
+    receipts = batch.receipts
+    num_logs = len(receipts.log_address)
+    _check(
+        all(
+            length == len(transactions)
+            for length in (
+                len(receipts),
+                len(receipts.state_root),
+                len(receipts.bloom),
+                len(receipts.log_ends),
+            )
+        ),
+        "receipt columns",
+    )
+    _check(_last(receipts.log_ends) == num_logs, "log offsets")
+    _check(len(receipts.log_data) == num_logs, "log columns")
+    _check(len(receipts.topic_ends) == num_logs, "log columns")
+    _check(_last(receipts.topic_ends) == len(receipts.topics), "topic offsets")
+    _check(len(batch.uncle_ends) == len(batch), "block offsets")
+    _check(len(batch.transaction_ends) == len(batch), "block offsets")
+    _check(_last(batch.uncle_ends) == len(batch.uncles), "uncle offsets")
+    _check(_last(batch.transaction_ends) == len(transactions), "transaction offsets")
+
+
+def decode_block_batch(buffer: Buffer) -> BlockBatch:
+    """
+    Decode a batch from `buffer`, which the batch holds on to rather than
+    copying.
+    """
+    reader = _SectionReader(buffer)
+    num_sections = reader.read_prefix()
+
+    batch = BlockBatch()
+    leaves: List[Leaf] = list(_iter_leaves(batch))
+    expected_sections = len(leaves) + sum(
+        isinstance(leaf, VarColumn) for _, _, leaf in leaves
+    )
+    if num_sections != expected_sections:
+        raise DecodingError(
+            f"Expected {expected_sections} sections, found {num_sections}"
+        )
+
+    # The columns of the decoded batch are swapped out for views of the
+    # buffer.
+    for owner, name, leaf in leaves:
+        if isinstance(leaf, FixedColumn):
+            leaf.data = reader.read()  # type: ignore
+        elif isinstance(leaf, VarColumn):
+            leaf.offsets = reader.read_array(leaf.offsets.typecode)  # type: ignore
+            leaf.data = reader.read()  # type: ignore
+        else:
+            setattr(owner, name, reader.read_array(leaf.typecode))  # type: ignore
+    reader.finish()
+
+    _validate(batch)
+    return batch
+
+
+def decode_block(buffer: Buffer) -> Block:
+    batch = decode_block_batch(buffer)
+    if len(batch) != 1:
+        raise DecodingError(f"Expected a single block, found {len(batch)}")
+    return batch[0]
@@ -0,0 +1,141 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+from typing import Any, List, Optional, Sequence, Tuple
+
+from async_service import Service
+import trio
+
+from cthaeh.block_batch import BlockBatch
+from cthaeh.extraction import RawBlockData
+from cthaeh.rows import BatchRows, prepare_batch_rows
+from cthaeh.wire import decode_block_batch, encode_block_batch
+
+DEFAULT_BATCH_SIZE = 16
+
+
+# The rows of a batch, apart from the batch itself, in the order of the
+# fields of `BatchRows`.
+RowTables = Tuple[Any, ...]
+
+
+def prepare_raw_block_rows(
+    raw_blocks: Sequence[RawBlockData],
+) -> Tuple[Tuple[bytes, RowTables], ...]:
+    """
+    Extract each block of a batch into its own `BlockBatch` and prepare its
+    rows.  This is the unit of work handed to extraction worker processes.
+
+    The batch is sent back encoded, and the rows of each table are pickled
+    along with it.
+    """
+    results = []
+    for raw_block in raw_blocks:
+        batch = BlockBatch.from_raw_blocks((raw_block,))
+        rows = prepare_batch_rows(batch)
+        results.append((encode_block_batch(batch), rows[1:]))
+    return tuple(results)
+
+
+def _decode_batch_rows(value: Tuple[bytes, RowTables]) -> BatchRows:
+    encoded, tables = value
+    return BatchRows(decode_block_batch(encoded), *tables)
+
+
+class _PendingRows:
+    def __init__(self) -> None:
+        self.ready = trio.Event()
+        self.rows: Optional[BatchRows] = None
+        self.error: Optional[BaseException] = None
+
+    async def wait(self) -> BatchRows:
+        await self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.rows  # type: ignore
+
+
+class ExtractionPool(Service):
+    """
+    Extract blocks into columnar batches and prepare their rows in a pool of
+    worker processes, so that the work is spread across more than one core.
+
+    Blocks submitted while every worker is busy are gathered into batches of
+    up to `batch_size` blocks, so that the busier the pool the fewer round
+    trips are made to the workers.
+    """
+
+    logger = logging.getLogger("cthaeh.workers.ExtractionPool")
+
+    def __init__(self, num_workers: int, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        if num_workers < 1:
+            raise ValueError(f"Number of workers must be positive: {num_workers}")
+        if batch_size < 1:
+            raise ValueError(f"Batch size must be positive: {batch_size}")
+
+        self.num_workers = num_workers
+        self._batch_size = batch_size
+        self._send_channel, self._receive_channel = trio.open_memory_channel[
+            Tuple[RawBlockData, _PendingRows]
+        ](0)
+
+    async def prepare(self, raw_block: RawBlockData) -> BatchRows:
+        """
+        Extract a block from its raw JSON-RPC results into a `BlockBatch`
+        along with its prepared rows.
+        """
+        pending = _PendingRows()
+        await self._send_channel.send((raw_block, pending))
+        return await pending.wait()
+
+    async def run(self) -> None:
+        # Workers are spawned rather than forked from a process running
+        # threads.
+        executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self.logger.info("Started %d extraction workers", self.num_workers)
+
+        idle_workers = trio.Semaphore(self.num_workers)
+        try:
+            async with trio.open_nursery() as nursery:
+                async with self._receive_channel:
+                    async for item in self._receive_channel:
+                        batch = [item]
+                        await idle_workers.acquire()
+                        while len(batch) < self._batch_size:
+                            try:
+                                batch.append(self._receive_channel.receive_nowait())
+                            except trio.WouldBlock:
+                                break
+                        nursery.start_soon(
+                            self._run_batch, executor, batch, idle_workers
+                        )
+        finally:
+            # Shutting down without waiting leaves the executor unable to
+            # clean up at exit, so any batch still running is waited on.
+            with trio.CancelScope(shield=True):
+                await trio.to_thread.run_sync(executor.shutdown)
+
+    async def _run_batch(
+        self,
+        executor: ProcessPoolExecutor,
+        batch: List[Tuple[RawBlockData, _PendingRows]],
+        idle_workers: trio.Semaphore,
+    ) -> None:
+        raw_blocks = tuple(raw_block for raw_block, _ in batch)
+        try:
+            future = executor.submit(prepare_raw_block_rows, raw_blocks)
+            values = await trio.to_thread.run_sync(future.result, cancellable=True)
+            results = tuple(_decode_batch_rows(value) for value in values)
+        except Exception as err:
+            for _, pending in batch:
+                pending.error = err
+                pending.ready.set()
+        else:
+            for (_, pending), rows in zip(batch, results):
+                pending.rows = rows
+                pending.ready.set()
+        finally:
+            idle_workers.release()
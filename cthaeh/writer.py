@@ -0,0 +1,132 @@
+"""
+Writers run the loader's database work.
+
+Imports and commits are synchronous, and a large commit can take long
+enough to hold up everything else on the event loop, like fetching blocks
+and answering JSON-RPC requests.  The `ThreadedWriter` runs all of it on a
+dedicated thread with a session of its own, fed through a bounded channel,
+while the `InlineWriter` runs it on the event loop with the session it was
+given, for databases which cannot be shared between threads, like an
+in-memory SQLite database.
+"""
+from abc import abstractmethod
+import logging
+from typing import Any, Callable, Optional, Tuple, TypeVar
+
+from async_service import Service
+from sqlalchemy import orm
+import trio
+
+TReturn = TypeVar("TReturn")
+
+# Writes are made one after another, so there is rarely more than one
+# waiting, but the channel is bounded all the same.
+DEFAULT_MAX_PENDING = 4
+
+
+class _PendingWrite:
+    def __init__(self, fn: Callable[..., Any], args: Tuple[Any, ...]) -> None:
+        self.fn = fn
+        self.args = args
+        self.done = trio.Event()
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+
+    def run(self, session: orm.Session) -> None:
+        try:
+            self.result = self.fn(session, *self.args)
+        except Exception as err:
+            self.error = err
+
+    def get_result(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class DatabaseWriterAPI(Service):
+    """
+    Run functions against a session which is only used for writing.
+    Writers are services and must be running before anything is written
+    through them.
+    """
+
+    @abstractmethod
+    async def write(self, fn: Callable[..., TReturn], *args: Any) -> TReturn:
+        """
+        Call `fn(session, *args)` with the session of the writer, and return
+        what it returns or raise what it raises.
+        """
+        ...
+
+
+class InlineWriter(DatabaseWriterAPI):
+    def __init__(self, session: orm.Session) -> None:
+        self._session = session
+
+    async def run(self) -> None:
+        await self.manager.wait_finished()
+
+    async def write(self, fn: Callable[..., TReturn], *args: Any) -> TReturn:
+        return fn(self._session, *args)
+
+
+class ThreadedWriter(DatabaseWriterAPI):
+    """
+    Run each write on the same dedicated thread, with a session made by
+    `session_factory` on that thread.
+    """
+
+    logger = logging.getLogger("cthaeh.writer.ThreadedWriter")
+
+    def __init__(
+        self,
+        session_factory: Callable[[], orm.Session],
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ) -> None:
+        self._session_factory = session_factory
+        self._send_channel, self._receive_channel = trio.open_memory_channel[
+            _PendingWrite
+        ](max_pending)
+
+    async def run(self) -> None:
+        # The thread outlives the service being cancelled, so that whatever
+        # is written while shutting down still goes through it.  It exits
+        # once the event loop it receives jobs from has finished.
+        await trio.to_thread.run_sync(
+            self._serve, trio.hazmat.current_trio_token(), cancellable=True
+        )
+
+    async def write(self, fn: Callable[..., TReturn], *args: Any) -> TReturn:
+        pending_write = _PendingWrite(fn, args)
+        await self._send_channel.send(pending_write)
+        await pending_write.done.wait()
+        return pending_write.get_result()  # type: ignore
+
+    def _receive(self, trio_token: trio.hazmat.TrioToken) -> Optional[_PendingWrite]:
+        try:
+            return trio.from_thread.run(
+                self._receive_channel.receive, trio_token=trio_token
+            )
+        except (trio.Cancelled, trio.EndOfChannel, trio.RunFinishedError):
+            return None
+
+    def _serve(self, trio_token: trio.hazmat.TrioToken) -> None:
+        session = self._session_factory()
+        self.logger.debug("Started writer thread")
+        try:
+            while True:
+                pending_write = self._receive(trio_token)
+                if pending_write is None:
+                    break
+
+                pending_write.run(session)
+                try:
+                    trio.from_thread.run_sync(
+                        pending_write.done.set, trio_token=trio_token
+                    )
+                except trio.RunFinishedError:
+                    break
+        finally:
+            session.close()  # type: ignore
+            self.logger.debug("Stopped writer thread")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Compare block retrieval throughput of the thread-hopped web3 path against the
+trio native JSON-RPC clients, using the test suite's `MockNode` served on
+localhost.
+
+    PYTHONPATH=tests/core python scripts/benchmark/client.py --num-blocks 200 --concurrency 8
+"""
+import argparse
+import pathlib
+import tempfile
+import time
+from typing import Awaitable, Callable
+
+from async_service import background_trio_service
+import trio
+from web3 import HTTPProvider, IPCProvider, Web3
+
+from cthaeh.client import HTTPClient, IPCClient, JSONRPCClientAPI
+from cthaeh.exfiltration import fetch_block, retrieve_block
+from cthaeh.ir import Block
+from mock_node import MockNode, MockNodeHTTPServer, MockNodeServer
+
+RetrieveFn = Callable[[int], Awaitable[Block]]
+
+
+async def measure(
+    name: str, retrieve_fn: RetrieveFn, num_blocks: int, concurrency: int
+) -> None:
+    limiter = trio.CapacityLimiter(concurrency)
+
+    async def _retrieve(block_number: int) -> None:
+        async with limiter:
+            await retrieve_fn(block_number)
+
+    start_at = time.perf_counter()
+    async with trio.open_nursery() as nursery:
+        for block_number in range(num_blocks):
+            nursery.start_soon(_retrieve, block_number)
+    elapsed = time.perf_counter() - start_at
+
+    print(
+        f"{name:<28} {num_blocks / elapsed:>10.1f} blocks/sec  "
+        f"({elapsed * 1000 / num_blocks:.2f} ms/block)"
+    )
+
+
+def client_retrieve_fn(client: JSONRPCClientAPI, batch_size: int = None) -> RetrieveFn:
+    async def _retrieve(block_number: int) -> Block:
+        return await fetch_block(client, block_number, batch_size)
+
+    return _retrieve
+
+
+def web3_retrieve_fn(w3: Web3) -> RetrieveFn:
+    async def _retrieve(block_number: int) -> Block:
+        return await retrieve_block(w3, block_number)
+
+    return _retrieve
+
+
+async def main(args: argparse.Namespace) -> None:
+    node = MockNode(
+        num_blocks=args.num_blocks,
+        transactions_per_block=args.transactions_per_block,
+        logs_per_receipt=2,
+        uncles_per_block=1,
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ipc_path = pathlib.Path(temp_dir) / "node.ipc"
+        ipc_server = MockNodeServer(node, ipc_path)
+        http_server = MockNodeHTTPServer(node)
+
+        async with background_trio_service(ipc_server):
+            async with background_trio_service(http_server):
+                await ipc_server.wait_serving()
+                await http_server.wait_serving()
+
+                ipc_client = IPCClient(ipc_path, pool_size=args.pool_size)
+                http_client = HTTPClient(
+                    http_server.endpoint_uri, pool_size=args.pool_size
+                )
+                async with background_trio_service(ipc_client):
+                    async with background_trio_service(http_client):
+                        runs = (
+                            (
+                                "web3 IPC",
+                                web3_retrieve_fn(Web3(IPCProvider(str(ipc_path)))),
+                            ),
+                            ("native IPC", client_retrieve_fn(ipc_client)),
+                            (
+                                "native IPC (batched)",
+                                client_retrieve_fn(ipc_client, args.batch_size),
+                            ),
+                            (
+                                "web3 HTTP",
+                                web3_retrieve_fn(
+                                    Web3(HTTPProvider(http_server.endpoint_uri))
+                                ),
+                            ),
+                            ("native HTTP", client_retrieve_fn(http_client)),
+                            (
+                                "native HTTP (batched)",
+                                client_retrieve_fn(http_client, args.batch_size),
+                            ),
+                        )
+                        for name, retrieve_fn in runs:
+                            await measure(
+                                name, retrieve_fn, args.num_blocks, args.concurrency
+                            )
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--num-blocks", type=int, default=200)
+parser.add_argument("--transactions-per-block", type=int, default=100)
+parser.add_argument("--concurrency", type=int, default=8)
+parser.add_argument("--pool-size", type=int, default=4)
+parser.add_argument("--batch-size", type=int, default=100)
+
+
+if __name__ == "__main__":
+    trio.run(main, parser.parse_args())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Compare the CPU cost of extracting blocks from decoded JSON-RPC results by
+running them through web3's result formatters against extracting them
+directly from the raw results.
+
+    PYTHONPATH=tests/core python scripts/benchmark/extraction.py --num-blocks 50 --transactions 150
+"""
+import argparse
+import time
+from typing import Any, Callable, Sequence, Tuple
+
+from web3._utils.rpc_abi import RPC
+
+from cthaeh.batch import format_results
+from cthaeh.exfiltration import extract_block
+from cthaeh.extraction import extract_raw_block
+from cthaeh.ir import Block
+from mock_node import MockNode
+
+RawBlockData = Tuple[Any, Sequence[Any], Sequence[Any]]
+ExtractFn = Callable[[RawBlockData], Block]
+
+
+def extract_formatted(raw_block_data: RawBlockData) -> Block:
+    raw_block, raw_uncles, raw_receipts = raw_block_data
+    (block_data,) = format_results(((RPC.eth_getBlockByNumber, ()),), (raw_block,))
+    uncles_data = format_results(
+        tuple((RPC.eth_getUncleByBlockHashAndIndex, ()) for _ in raw_uncles), raw_uncles
+    )
+    receipts_data = format_results(
+        tuple((RPC.eth_getTransactionReceipt, ()) for _ in raw_receipts), raw_receipts
+    )
+    return extract_block(
+        block_data,
+        transactions_data=block_data["transactions"],
+        uncles_data=uncles_data,
+        receipts_data=receipts_data,
+    )
+
+
+def extract_raw(raw_block_data: RawBlockData) -> Block:
+    raw_block, raw_uncles, raw_receipts = raw_block_data
+    return extract_raw_block(
+        raw_block,
+        transactions_data=raw_block["transactions"],
+        uncles_data=raw_uncles,
+        receipts_data=raw_receipts,
+    )
+
+
+def measure(
+    name: str,
+    extract_fn: ExtractFn,
+    raw_blocks_data: Sequence[RawBlockData],
+    rounds: int,
+) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start_at = time.perf_counter()
+        for raw_block_data in raw_blocks_data:
+            extract_fn(raw_block_data)
+        best = min(best, time.perf_counter() - start_at)
+
+    per_block = best / len(raw_blocks_data)
+    print(f"{name:<12} {per_block * 1000:>8.3f} ms/block")
+    return per_block
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-blocks", type=int, default=50)
+    parser.add_argument("--transactions", type=int, default=150)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    node = MockNode(
+        num_blocks=args.num_blocks + 1, transactions_per_block=args.transactions
+    )
+    raw_blocks_data = tuple(
+        (
+            raw_block,
+            node.uncles[raw_block["hash"]],
+            tuple(
+                node.receipts[transaction["hash"]]
+                for transaction in raw_block["transactions"]
+            ),
+        )
+        for raw_block in node.blocks[1:]
+    )
+
+    formatted = measure("formatted", extract_formatted, raw_blocks_data, args.rounds)
+    raw = measure("raw", extract_raw, raw_blocks_data, args.rounds)
+    print(f"speedup      {formatted / raw:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Compare loading blocks into a SQLite database with stock settings and ORM
+bulk inserts against the backfill profile with Core `executemany` inserts,
+committing after every batch as the loader does.
+
+    PYTHONPATH=tests/core python scripts/benchmark/sqlite.py --num-blocks 200 --transactions 50
+"""
+import argparse
+import pathlib
+import tempfile
+import time
+from typing import Callable, Sequence
+
+from sqlalchemy import create_engine, orm
+from sqlalchemy.orm import sessionmaker
+
+from cthaeh.block_batch import BlockBatch
+from cthaeh.extraction import RawBlockData
+from cthaeh.loader import import_batch_rows
+from cthaeh.models import Base
+from cthaeh.rows import BatchRows, prepare_batch_rows
+from cthaeh.sqlite import SQLiteProfile, import_batch_rows_core
+from mock_node import MockNode
+
+ImportFn = Callable[[orm.Session, BatchRows], None]
+
+
+def measure(
+    name: str,
+    import_fn: ImportFn,
+    batches: Sequence[BlockBatch],
+    backfill_profile: bool,
+) -> float:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        engine = create_engine(f"sqlite:///{pathlib.Path(temp_dir) / 'db.sqlite3'}")
+        if backfill_profile:
+            SQLiteProfile(engine, backfill=True)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+
+        start_at = time.perf_counter()
+        for batch in batches:
+            import_fn(session, prepare_batch_rows(batch))
+            session.commit()
+        elapsed = time.perf_counter() - start_at
+        session.close()
+
+    num_blocks = sum(len(batch) for batch in batches)
+    blocks_per_second = num_blocks / elapsed
+    print(f"{name:<10} {blocks_per_second:>10.1f} blocks/sec")
+    return blocks_per_second
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-blocks", type=int, default=200)
+    parser.add_argument("--transactions", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    node = MockNode(
+        num_blocks=args.num_blocks,
+        transactions_per_block=args.transactions,
+        logs_per_receipt=2,
+        uncles_per_block=1,
+    )
+    raw_blocks = tuple(
+        RawBlockData(
+            block=raw_block,
+            uncles=node.uncles[raw_block["hash"]],
+            receipts=tuple(
+                node.receipts[transaction["hash"]]
+                for transaction in raw_block["transactions"]
+            ),
+        )
+        for raw_block in node.blocks
+    )
+    batches = tuple(
+        BlockBatch.from_raw_blocks(
+            raw_blocks[index : index + args.batch_size]  # noqa: E203
+        )
+        for index in range(0, len(raw_blocks), args.batch_size)
+    )
+
+    stock = measure("stock", import_batch_rows, batches, backfill_profile=False)
+    backfill = measure(
+        "backfill", import_batch_rows_core, batches, backfill_profile=True
+    )
+    print(f"speedup    {backfill / stock:>10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Compare the cost of moving blocks between processes by pickling `ir.Block`
+objects against the binary wire format, both for a whole round trip and for
+decoding alone, along with the size of each encoding.
+
+    PYTHONPATH=tests/core python scripts/benchmark/wire.py --num-blocks 50 --transactions 150
+"""
+import argparse
+import pickle
+import time
+from typing import Any, Callable, Sequence
+
+from cthaeh.block_batch import BlockBatch
+from cthaeh.extraction import extract_raw_block
+from cthaeh.ir import Block
+from cthaeh.wire import decode_block_batch, encode_block_batch
+from mock_node import MockNode
+
+RoundTripFn = Callable[[Sequence[Block]], Any]
+
+
+def pickle_round_trip(blocks: Sequence[Block]) -> Any:
+    return pickle.loads(pickle.dumps(tuple(blocks), pickle.HIGHEST_PROTOCOL))
+
+
+def wire_round_trip(blocks: Sequence[Block]) -> Any:
+    return decode_block_batch(encode_block_batch(BlockBatch.from_blocks(blocks)))
+
+
+def measure(
+    name: str, round_trip_fn: RoundTripFn, blocks: Sequence[Block], rounds: int
+) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start_at = time.perf_counter()
+        round_trip_fn(blocks)
+        best = min(best, time.perf_counter() - start_at)
+
+    per_block = best / len(blocks)
+    print(
+        f"{name:<16} {per_block * 1000:>8.3f} ms/block  "
+        f"{len(blocks) / best:>10.1f} blocks/sec"
+    )
+    return per_block
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-blocks", type=int, default=50)
+    parser.add_argument("--transactions", type=int, default=150)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    node = MockNode(
+        num_blocks=args.num_blocks + 1,
+        transactions_per_block=args.transactions,
+        logs_per_receipt=2,
+        uncles_per_block=1,
+    )
+    blocks = tuple(
+        extract_raw_block(
+            raw_block,
+            transactions_data=raw_block["transactions"],
+            uncles_data=node.uncles[raw_block["hash"]],
+            receipts_data=tuple(
+                node.receipts[transaction["hash"]]
+                for transaction in raw_block["transactions"]
+            ),
+        )
+        for raw_block in node.blocks[1:]
+    )
+
+    pickled = pickle.dumps(blocks, pickle.HIGHEST_PROTOCOL)
+    encoded = encode_block_batch(BlockBatch.from_blocks(blocks))
+    print(f"pickle size      {len(pickled) / len(blocks) / 1024:>8.1f} KiB/block")
+    print(f"wire size        {len(encoded) / len(blocks) / 1024:>8.1f} KiB/block")
+
+    pickled_time = measure("pickle", pickle_round_trip, blocks, args.rounds)
+    wire_time = measure("wire", wire_round_trip, blocks, args.rounds)
+    print(f"speedup          {pickled_time / wire_time:>8.2f}x")
+
+    # Decoding alone, which is all the receiving side of a process split
+    # pays for until it reads the blocks.
+    measure("pickle decode", lambda _: pickle.loads(pickled), blocks, args.rounds)
+    measure("wire decode", lambda _: decode_block_batch(encoded), blocks, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
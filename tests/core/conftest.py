@@ -1,8 +1,13 @@
 import pytest
 from sqlalchemy import create_engine
+from web3 import Web3
 
+from cthaeh.block_batch import BlockBatch
+from cthaeh.client import Web3Client
+from cthaeh.exfiltration import fetch_raw_block
 from cthaeh.models import Base
 from cthaeh.session import Session
+from mock_node import MockNode, MockNodeProvider
 
 
 @pytest.fixture(scope="session")
@@ -32,3 +37,20 @@ def session(_Session, _schema):
     finally:
         transaction.rollback()
         session.close()
+
+
+@pytest.fixture
+def mock_node():
+    return MockNode(
+        num_blocks=6, transactions_per_block=3, logs_per_receipt=2, uncles_per_block=1
+    )
+
+
+@pytest.fixture
+async def batches(mock_node):
+    client = Web3Client(Web3(MockNodeProvider(mock_node)))
+    raw_blocks = [await fetch_raw_block(client, number) for number in range(6)]
+    return (
+        BlockBatch.from_raw_blocks(raw_blocks[:3]),
+        BlockBatch.from_raw_blocks(raw_blocks[3:]),
+    )
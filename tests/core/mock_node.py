@@ -0,0 +1,577 @@
+from http import HTTPStatus
+import io
+import itertools
+import json
+import logging
+import math
+import pathlib
+import random
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from async_service import Service
+from eth_typing import HexStr
+from eth_utils import encode_hex, to_hex
+import trio
+from web3.providers.base import BaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+RawBlock = Dict[str, Any]
+RawReceipt = Dict[str, Any]
+
+
+def _random_bytes(rng: random.Random, size: int) -> bytes:
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+
+def _random_hex(rng: random.Random, size: int) -> HexStr:
+    return encode_hex(_random_bytes(rng, size))
+
+
+def _build_raw_header(
+    rng: random.Random, block_number: int, parent_hash: HexStr
+) -> RawBlock:
+    return {
+        "number": to_hex(block_number),
+        "hash": _random_hex(rng, 32),
+        "parentHash": parent_hash,
+        "mixHash": _random_hex(rng, 32),
+        "nonce": _random_hex(rng, 8),
+        "sha3Uncles": _random_hex(rng, 32),
+        "logsBloom": _random_hex(rng, 256),
+        "transactionsRoot": _random_hex(rng, 32),
+        "stateRoot": _random_hex(rng, 32),
+        "receiptsRoot": _random_hex(rng, 32),
+        "miner": _random_hex(rng, 20),
+        "difficulty": to_hex(rng.randint(1, 2 ** 48)),
+        "totalDifficulty": to_hex(rng.randint(1, 2 ** 64)),
+        "extraData": _random_hex(rng, rng.randint(0, 32)),
+        "size": to_hex(rng.randint(512, 2 ** 16)),
+        "gasLimit": to_hex(8_000_000),
+        "gasUsed": to_hex(rng.randint(0, 8_000_000)),
+        "timestamp": to_hex(1_438_269_988 + block_number * 15),
+        "uncles": [],
+    }
+
+
+def _build_raw_log(
+    rng: random.Random, raw_block: RawBlock, raw_transaction: RawBlock, log_index: int
+) -> Dict[str, Any]:
+    return {
+        "address": _random_hex(rng, 20),
+        "topics": [_random_hex(rng, 32) for _ in range(rng.randint(0, 4))],
+        "data": _random_hex(rng, rng.randint(0, 96)),
+        "blockNumber": raw_block["number"],
+        "blockHash": raw_block["hash"],
+        "transactionHash": raw_transaction["hash"],
+        "transactionIndex": raw_transaction["transactionIndex"],
+        "logIndex": to_hex(log_index),
+        "removed": False,
+    }
+
+
+class MockNodeError(Exception):
+    """
+    Raised by a request handler to respond to the request with a JSON-RPC
+    error.
+    """
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+class MockNode:
+    """
+    An in-memory chain of randomly generated blocks which answers the subset
+    of the JSON-RPC API that cthaeh uses, shaped the way go-ethereum shapes
+    its responses.
+    """
+
+    logger = logging.getLogger("mock_node.MockNode")
+
+    def __init__(
+        self,
+        num_blocks: int,
+        transactions_per_block: int = 4,
+        logs_per_receipt: int = 2,
+        uncles_per_block: int = 1,
+        seed: int = 0,
+        unsupported_methods: Collection[str] = (),
+        max_logs_per_query: Optional[int] = None,
+        head: Optional[int] = None,
+    ) -> None:
+        rng = random.Random(seed)
+        self.unsupported_methods = frozenset(unsupported_methods)
+        self.max_logs_per_query = max_logs_per_query
+        # Blocks past the head are generated up front but are not visible
+        # until the head is advanced to them.
+        self.head = num_blocks - 1 if head is None else head
+        self._head_listeners: List[Callable[[RawBlock], None]] = []
+
+        self.blocks: List[RawBlock] = []
+        self.blocks_by_hash: Dict[HexStr, RawBlock] = {}
+        self.receipts: Dict[HexStr, RawReceipt] = {}
+        self.uncles: Dict[HexStr, Tuple[RawBlock, ...]] = {}
+
+        parent_hash = HexStr("0x" + "00" * 32)
+
+        for block_number in range(num_blocks):
+            raw_block = _build_raw_header(rng, block_number, parent_hash)
+
+            if block_number == 0:
+                num_uncles = 0
+                num_transactions = 0
+            else:
+                num_uncles = rng.randint(0, uncles_per_block)
+                num_transactions = transactions_per_block
+
+            uncles = tuple(
+                _build_raw_header(
+                    rng, block_number - 1, self.blocks[block_number - 2]["hash"]
+                )
+                if block_number > 1
+                else _build_raw_header(rng, 0, parent_hash)
+                for _ in range(num_uncles)
+            )
+            raw_block["uncles"] = [uncle["hash"] for uncle in uncles]
+
+            transactions = []
+            log_index = 0
+            for transaction_index in range(num_transactions):
+                raw_transaction = {
+                    "blockHash": raw_block["hash"],
+                    "blockNumber": raw_block["number"],
+                    "from": _random_hex(rng, 20),
+                    "gas": to_hex(rng.randint(21000, 1_000_000)),
+                    "gasPrice": to_hex(rng.randint(1, 10 ** 11)),
+                    "hash": _random_hex(rng, 32),
+                    "input": _random_hex(rng, rng.randint(0, 128)),
+                    "nonce": to_hex(rng.randint(0, 1000)),
+                    "to": None if rng.random() < 0.1 else _random_hex(rng, 20),
+                    "transactionIndex": to_hex(transaction_index),
+                    "value": to_hex(rng.randint(0, 10 ** 20)),
+                    "v": to_hex(rng.choice((27, 28))),
+                    "r": _random_hex(rng, 32),
+                    "s": _random_hex(rng, 32),
+                }
+                transactions.append(raw_transaction)
+
+                logs = []
+                for _ in range(rng.randint(0, logs_per_receipt * 2)):
+                    logs.append(
+                        _build_raw_log(rng, raw_block, raw_transaction, log_index)
+                    )
+                    log_index += 1
+
+                self.receipts[raw_transaction["hash"]] = {
+                    "blockHash": raw_block["hash"],
+                    "blockNumber": raw_block["number"],
+                    "contractAddress": None,
+                    "cumulativeGasUsed": to_hex(rng.randint(21000, 8_000_000)),
+                    "from": raw_transaction["from"],
+                    "gasUsed": to_hex(rng.randint(21000, 1_000_000)),
+                    "logs": logs,
+                    "logsBloom": _random_hex(rng, 256),
+                    "root": _random_hex(rng, 32),
+                    "to": raw_transaction["to"],
+                    "transactionHash": raw_transaction["hash"],
+                    "transactionIndex": raw_transaction["transactionIndex"],
+                }
+
+            raw_block["transactions"] = transactions
+
+            self.blocks.append(raw_block)
+            self.blocks_by_hash[raw_block["hash"]] = raw_block
+            self.uncles[raw_block["hash"]] = uncles
+            parent_hash = raw_block["hash"]
+
+    #
+    # Head
+    #
+    def advance_head(self) -> RawBlock:
+        """
+        Make the next generated block visible, notifying any head listeners.
+        """
+        if self.head + 1 >= len(self.blocks):
+            raise IndexError("No more blocks to advance the head to")
+
+        self.head += 1
+        raw_block = self.blocks[self.head]
+        for listener in tuple(self._head_listeners):
+            listener(raw_block)
+        return raw_block
+
+    def add_head_listener(self, listener: Callable[[RawBlock], None]) -> None:
+        self._head_listeners.append(listener)
+
+    def remove_head_listener(self, listener: Callable[[RawBlock], None]) -> None:
+        self._head_listeners.remove(listener)
+
+    #
+    # Request handling
+    #
+    def make_request(self, method: str, params: Sequence[Any]) -> Any:
+        handler = self._handlers[method]
+        return handler(self, *params)
+
+    def process(self, request: Mapping[str, Any]) -> Dict[str, Any]:
+        response: Dict[str, Any] = {"jsonrpc": "2.0", "id": request.get("id")}
+        method = request["method"]
+
+        if method in self._handlers and method not in self.unsupported_methods:
+            try:
+                response["result"] = self.make_request(
+                    method, request.get("params", [])
+                )
+            except MockNodeError as err:
+                response["error"] = {"code": err.code, "message": str(err)}
+        else:
+            response["error"] = {
+                "code": -32601,
+                "message": f"the method {method} does not exist/is not available",
+            }
+        return response
+
+    def process_payload(self, payload: Any) -> Any:
+        if isinstance(payload, list):
+            return [self.process(request) for request in payload]
+        else:
+            return self.process(payload)
+
+    def _get_block_by_number(self, block_number: str) -> RawBlock:
+        if block_number == "latest":
+            return self.blocks[self.head]
+        elif block_number == "earliest":
+            return self.blocks[0]
+        elif int(block_number, 16) > self.head:
+            raise IndexError(f"Block {block_number} is past the head")
+        else:
+            return self.blocks[int(block_number, 16)]
+
+    def _format_block(self, raw_block: RawBlock, full_transactions: bool) -> RawBlock:
+        if full_transactions:
+            return raw_block
+        else:
+            return dict(
+                raw_block,
+                transactions=[
+                    transaction["hash"] for transaction in raw_block["transactions"]
+                ],
+            )
+
+    def _eth_blockNumber(self) -> HexStr:
+        return to_hex(self.head)
+
+    def _eth_getBlockByNumber(
+        self, block_number: str, full_transactions: bool
+    ) -> Optional[RawBlock]:
+        try:
+            raw_block = self._get_block_by_number(block_number)
+        except IndexError:
+            return None
+        return self._format_block(raw_block, full_transactions)
+
+    def _eth_getBlockByHash(self, block_hash: HexStr, full_transactions: bool) -> Any:
+        if block_hash not in self.blocks_by_hash:
+            return None
+        return self._format_block(self.blocks_by_hash[block_hash], full_transactions)
+
+    def _eth_getTransactionReceipt(self, transaction_hash: HexStr) -> Any:
+        return self.receipts.get(transaction_hash)
+
+    def _eth_getBlockReceipts(self, block_number: str) -> Any:
+        try:
+            raw_block = self._get_block_by_number(block_number)
+        except IndexError:
+            return None
+        return [
+            self.receipts[transaction["hash"]]
+            for transaction in raw_block["transactions"]
+        ]
+
+    def _eth_getUncleByBlockHashAndIndex(self, block_hash: HexStr, index: str) -> Any:
+        uncles = self.uncles.get(block_hash, ())
+        try:
+            return uncles[int(index, 16)]
+        except IndexError:
+            return None
+
+    def _eth_getUncleByBlockNumberAndIndex(self, block_number: str, index: str) -> Any:
+        try:
+            raw_block = self._get_block_by_number(block_number)
+        except IndexError:
+            return None
+        return self._eth_getUncleByBlockHashAndIndex(raw_block["hash"], index)
+
+    def _eth_getLogs(self, filter_params: Mapping[str, Any]) -> Any:
+        if "blockHash" in filter_params:
+            raw_blocks: Sequence[RawBlock] = (
+                self.blocks_by_hash[filter_params["blockHash"]],
+            )
+        else:
+            from_block = self._get_block_by_number(
+                filter_params.get("fromBlock", "latest")
+            )
+            to_block = self._get_block_by_number(filter_params.get("toBlock", "latest"))
+            from_index = int(from_block["number"], 16)
+            to_index = int(to_block["number"], 16) + 1
+            raw_blocks = self.blocks[from_index:to_index]
+
+        logs = [
+            log
+            for raw_block in raw_blocks
+            for transaction in raw_block["transactions"]
+            for log in self.receipts[transaction["hash"]]["logs"]
+        ]
+        if self.max_logs_per_query is not None and len(logs) > self.max_logs_per_query:
+            raise MockNodeError(
+                -32005, f"query returned more than {self.max_logs_per_query} results"
+            )
+        return logs
+
+    _handlers: Dict[str, Callable[..., Any]] = {
+        "eth_blockNumber": _eth_blockNumber,
+        "eth_getBlockByNumber": _eth_getBlockByNumber,
+        "eth_getBlockByHash": _eth_getBlockByHash,
+        "eth_getTransactionReceipt": _eth_getTransactionReceipt,
+        "eth_getBlockReceipts": _eth_getBlockReceipts,
+        "parity_getBlockReceipts": _eth_getBlockReceipts,
+        "eth_getUncleByBlockHashAndIndex": _eth_getUncleByBlockHashAndIndex,
+        "eth_getUncleByBlockNumberAndIndex": _eth_getUncleByBlockNumberAndIndex,
+        "eth_getLogs": _eth_getLogs,
+    }
+
+
+class MockNodeProvider(BaseProvider):
+    """
+    A web3 provider which answers requests directly from a `MockNode`.
+    """
+
+    def __init__(self, node: MockNode) -> None:
+        self.node = node
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        return self.node.process(  # type: ignore
+            {"jsonrpc": "2.0", "id": 0, "method": method, "params": params}
+        )
+
+
+class MockNodeServer(Service):
+    """
+    Serve a `MockNode` over an IPC socket, including support for batch
+    requests and `eth_subscribe` subscriptions to `newHeads`.
+    """
+
+    logger = logging.getLogger("mock_node.MockNodeServer")
+
+    def __init__(self, node: MockNode, ipc_path: pathlib.Path) -> None:
+        self.node = node
+        self.ipc_path = ipc_path
+        self._serving = trio.Event()
+        self._subscription_counter = itertools.count(1)
+
+    async def wait_serving(self) -> None:
+        await self._serving.wait()
+
+    async def run(self) -> None:
+        with trio.socket.socket(trio.socket.AF_UNIX, trio.socket.SOCK_STREAM) as sock:
+            await sock.bind(str(self.ipc_path))
+            sock.listen(128)
+
+            self._serving.set()
+
+            try:
+                while self.manager.is_running:
+                    conn, _ = await sock.accept()
+                    self.manager.run_task(self._handle_connection, conn)
+            finally:
+                self.ipc_path.unlink()
+
+    async def _handle_connection(self, socket: trio.socket.SocketType) -> None:
+        buffer = io.StringIO()
+        decoder = json.JSONDecoder()
+        send_lock = trio.Lock()
+        subscription_ids: Set[HexStr] = set()
+        notification_send_channel, notification_receive_channel = trio.open_memory_channel[
+            RawBlock
+        ](
+            math.inf
+        )
+
+        async def _send(message: Any) -> None:
+            async with send_lock:
+                await _send_all(socket, json.dumps(message).encode())
+
+        async def _send_notifications() -> None:
+            async for raw_block in notification_receive_channel:
+                header = dict(self.node._format_block(raw_block, False))
+                header.pop("transactions")
+                for subscription_id in tuple(subscription_ids):
+                    await _send(
+                        {
+                            "jsonrpc": "2.0",
+                            "method": "eth_subscription",
+                            "params": {
+                                "subscription": subscription_id,
+                                "result": header,
+                            },
+                        }
+                    )
+
+        self.node.add_head_listener(notification_send_channel.send_nowait)
+        try:
+            with socket:
+                async with trio.open_nursery() as nursery:
+                    nursery.start_soon(_send_notifications)
+
+                    while True:
+                        data = await socket.recv(65536)
+                        if not data:
+                            break
+                        buffer.write(data.decode())
+
+                        for payload in _iter_decoded(buffer, decoder):
+                            if self._is_subscription_request(payload):
+                                response = self._process_subscription_request(
+                                    payload, subscription_ids
+                                )
+                            else:
+                                response = self.node.process_payload(payload)
+                            await _send(response)
+
+                    nursery.cancel_scope.cancel()
+        finally:
+            self.node.remove_head_listener(notification_send_channel.send_nowait)
+
+    def _is_subscription_request(self, payload: Any) -> bool:
+        if not isinstance(payload, dict):
+            return False
+        method = payload["method"]
+        if method in self.node.unsupported_methods:
+            return False
+        return method in {"eth_subscribe", "eth_unsubscribe"}
+
+    def _process_subscription_request(
+        self, request: Mapping[str, Any], subscription_ids: Set[HexStr]
+    ) -> Dict[str, Any]:
+        response: Dict[str, Any] = {"jsonrpc": "2.0", "id": request.get("id")}
+        params = request.get("params", [])
+
+        if request["method"] == "eth_unsubscribe":
+            response["result"] = params[0] in subscription_ids
+            subscription_ids.discard(params[0])
+        elif params == ["newHeads"]:
+            subscription_id = to_hex(next(self._subscription_counter))
+            subscription_ids.add(subscription_id)
+            response["result"] = subscription_id
+        else:
+            response["error"] = {
+                "code": -32602,
+                "message": f"unsupported subscription: {params}",
+            }
+        return response
+
+
+class MockNodeHTTPServer(Service):
+    """
+    Serve a `MockNode` over HTTP on localhost, keeping connections alive
+    between requests.  Requests for one of the node's unsupported methods are
+    answered with `unsupported_status`, as some gateways reject them with a
+    4xx rather than a JSON-RPC error.
+    """
+
+    logger = logging.getLogger("mock_node.MockNodeHTTPServer")
+
+    endpoint_uri: str
+
+    def __init__(self, node: MockNode, unsupported_status: int = 200) -> None:
+        self.node = node
+        self.unsupported_status = unsupported_status
+        self._serving = trio.Event()
+
+    async def wait_serving(self) -> None:
+        await self._serving.wait()
+
+    async def run(self) -> None:
+        listeners = await trio.open_tcp_listeners(0, host="127.0.0.1")
+        _, port = listeners[0].socket.getsockname()  # type: ignore
+        self.endpoint_uri = f"http://127.0.0.1:{port}"
+
+        self._serving.set()
+        await trio.serve_listeners(self._handle_connection, listeners)
+
+    async def _handle_connection(self, stream: trio.SocketStream) -> None:
+        buffer = b""
+
+        async with stream:
+            while True:
+                while b"\r\n\r\n" not in buffer:
+                    data = await stream.receive_some(65536)
+                    if not data:
+                        return
+                    buffer += data
+
+                raw_head, _, buffer = buffer.partition(b"\r\n\r\n")
+                headers = dict(
+                    (name.strip().lower(), value.strip())
+                    for name, _, value in (
+                        line.partition(b":") for line in raw_head.split(b"\r\n")[1:]
+                    )
+                )
+                content_length = int(headers[b"content-length"])
+                while len(buffer) < content_length:
+                    buffer += await stream.receive_some(65536)
+                body, buffer = buffer[:content_length], buffer[content_length:]
+
+                payload = json.loads(body)
+                response = self.node.process_payload(payload)
+                response_body = json.dumps(response).encode()
+                if (
+                    isinstance(payload, dict)
+                    and payload.get("method") in self.node.unsupported_methods
+                ):
+                    status = self.unsupported_status
+                else:
+                    status = 200
+                await stream.send_all(
+                    b"HTTP/1.1 %d %s\r\n"
+                    b"Content-Type: application/json\r\n"
+                    b"Content-Length: %d\r\n"
+                    b"\r\n"
+                    % (status, HTTPStatus(status).phrase.encode(), len(response_body))
+                    + response_body
+                )
+
+
+async def _send_all(socket: trio.socket.SocketType, data: bytes) -> None:
+    with memoryview(data) as view:
+        while view:
+            sent = await socket.send(view)
+            view = view[sent:]
+
+
+def _iter_decoded(buffer: io.StringIO, decoder: json.JSONDecoder) -> Iterator[Any]:
+    raw = buffer.getvalue().lstrip()
+    while raw:
+        try:
+            payload, offset = decoder.raw_decode(raw)
+        except json.JSONDecodeError:
+            break
+        yield payload
+        raw = raw[offset:].lstrip()
+
+    buffer.seek(0)
+    buffer.write(raw)
+    buffer.truncate()
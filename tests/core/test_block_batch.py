@@ -0,0 +1,129 @@
+import pickle
+
+from async_service import background_trio_service
+import pytest
+import trio
+from web3 import Web3
+
+from cthaeh.block_batch import BlockBatch
+from cthaeh.client import Web3Client
+from cthaeh.exfiltration import Exfiltrator, fetch_raw_block
+from cthaeh.extraction import extract_raw_block_data
+from cthaeh.loader import import_block_batch
+from cthaeh.models import Block, Header, Log, Transaction
+from mock_node import MockNode, MockNodeProvider
+
+
+@pytest.fixture
+def mock_node():
+    return MockNode(num_blocks=8, transactions_per_block=4, uncles_per_block=2)
+
+
+@pytest.fixture
+def client(mock_node):
+    return Web3Client(Web3(MockNodeProvider(mock_node)))
+
+
+@pytest.fixture
+async def raw_blocks(client):
+    return tuple([await fetch_raw_block(client, number) for number in range(8)])
+
+
+def _deep(blocks):
+    # `Block` equality only compares hashes.
+    return tuple(tuple(block) for block in blocks)
+
+
+@pytest.mark.trio
+async def test_block_batch_views_match_extracted_blocks(raw_blocks):
+    blocks = tuple(extract_raw_block_data(raw_block) for raw_block in raw_blocks)
+
+    from_raw = BlockBatch.from_raw_blocks(raw_blocks)
+    assert len(from_raw) == 8
+    assert from_raw.last_block_number == 7
+    assert _deep(from_raw) == _deep(blocks)
+
+    # A contract creation has no `to` address.
+    creation = blocks[1].transactions[0]._replace(to=None)
+    transactions = (creation,) + blocks[1].transactions[1:]
+    blocks = blocks[:1] + (blocks[1]._replace(transactions=transactions),) + blocks[2:]
+    assert _deep(BlockBatch.from_blocks(blocks)) == _deep(blocks)
+
+
+@pytest.mark.trio
+async def test_block_batch_concat_and_pickle(raw_blocks):
+    batches = tuple(
+        BlockBatch.from_raw_blocks(raw_blocks[index : index + 3])  # noqa: E203
+        for index in range(0, 8, 3)
+    )
+    batch = BlockBatch.concat(batches)
+
+    assert _deep(batch) == _deep(BlockBatch.from_raw_blocks(raw_blocks))
+    assert _deep(pickle.loads(pickle.dumps(batch))) == _deep(batch)
+    assert len(BlockBatch()) == 0
+    assert BlockBatch().last_block_number is None
+
+
+@pytest.mark.trio
+async def test_import_block_batch(session, mock_node, raw_blocks):
+    import_block_batch(session, BlockBatch.from_raw_blocks(raw_blocks))
+
+    assert session.query(Block).count() == 8
+    assert session.query(Header).count() == 8 + sum(
+        len(raw_block["uncles"]) for raw_block in mock_node.blocks
+    )
+    assert session.query(Transaction).count() == len(mock_node.receipts)
+
+    for raw_block in mock_node.blocks:
+        block = (
+            session.query(Block)
+            .join(Header)
+            .filter(Header.hash == bytes.fromhex(raw_block["hash"][2:]))
+            .one()
+        )
+        assert tuple(
+            "0x" + transaction.hash.hex() for transaction in block.transactions
+        ) == tuple(transaction["hash"] for transaction in raw_block["transactions"])
+        assert tuple("0x" + uncle.hash.hex() for uncle in block.uncles) == tuple(
+            raw_block["uncles"]
+        )
+
+        for transaction, raw_transaction in zip(
+            block.transactions, raw_block["transactions"]
+        ):
+            raw_logs = mock_node.receipts[raw_transaction["hash"]]["logs"]
+            logs = sorted(transaction.receipt.logs, key=lambda log: log.idx)
+            assert tuple(
+                tuple("0x" + topic.topic.hex() for topic in log.topics) for log in logs
+            ) == tuple(tuple(raw_log["topics"]) for raw_log in raw_logs)
+            assert tuple("0x" + log.data.hex() for log in logs) == tuple(
+                raw_log["data"] for raw_log in raw_logs
+            )
+
+    assert session.query(Log).count() == sum(
+        len(receipt["logs"]) for receipt in mock_node.receipts.values()
+    )
+
+
+@pytest.mark.trio
+async def test_exfiltrator_relays_batches(client):
+    send_channel, receive_channel = trio.open_memory_channel(0)
+    exfiltrator = Exfiltrator(
+        client=client,
+        block_send_channel=send_channel,
+        start_at=0,
+        end_at=8,
+        concurrency_factor=4,
+        load_batch_size=3,
+    )
+
+    async with background_trio_service(exfiltrator):
+        with trio.fail_after(30):
+            async with receive_channel:
+                batches = tuple([batch async for batch in receive_channel])
+
+    assert all(isinstance(batch, BlockBatch) for batch in batches)
+    assert all(1 <= len(batch) <= 3 for batch in batches)
+    assert tuple(
+        block.header.block_number for batch in batches for block in batch
+    ) == tuple(range(8))
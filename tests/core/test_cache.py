@@ -0,0 +1,130 @@
+import os
+
+from async_service import background_trio_service
+import pytest
+import trio
+from web3 import Web3
+
+from cthaeh.cache import BlockCache
+from cthaeh.client import Web3Client
+from cthaeh.exfiltration import Exfiltrator, fetch_raw_block
+from cthaeh.extraction import decode_hash32
+from mock_node import MockNode, MockNodeProvider
+
+MAX_SIZE = 1024 * 1024
+
+
+@pytest.fixture
+def mock_node():
+    return MockNode(num_blocks=8, transactions_per_block=4, uncles_per_block=2)
+
+
+@pytest.fixture
+def client(mock_node):
+    return Web3Client(Web3(MockNodeProvider(mock_node)))
+
+
+@pytest.fixture
+async def raw_blocks(client):
+    return tuple([await fetch_raw_block(client, number) for number in range(8)])
+
+
+@pytest.mark.trio
+async def test_cache_roundtrip(tmp_path, raw_blocks):
+    cache = BlockCache(tmp_path, MAX_SIZE, segment_size=3)
+    for raw_block in raw_blocks:
+        cache.put(raw_block)
+
+    for number, raw_block in enumerate(raw_blocks):
+        block_hash = decode_hash32(raw_block.block["hash"])
+        assert cache.get(number) == raw_block
+        assert cache.get(number, block_hash) == raw_block
+        assert cache.get(number, block_hash[::-1]) is None
+
+    assert cache.get(8) is None
+    assert cache.get_stats().num_segments == 3
+
+
+@pytest.mark.trio
+async def test_cache_persists_across_instances(tmp_path, raw_blocks):
+    cache = BlockCache(tmp_path, MAX_SIZE, segment_size=3)
+    for raw_block in raw_blocks:
+        cache.put(raw_block)
+
+    reopened = BlockCache(tmp_path, MAX_SIZE, segment_size=3)
+    assert reopened.get(5) == raw_blocks[5]
+
+    stats = reopened.get_stats()
+    assert stats.num_blocks == 8
+    assert (stats.lowest_block, stats.highest_block) == (0, 7)
+
+
+@pytest.mark.trio
+async def test_cache_evicts_least_recently_used_segments(tmp_path, raw_blocks):
+    cache = BlockCache(tmp_path, MAX_SIZE, segment_size=1)
+    for raw_block in raw_blocks:
+        cache.put(raw_block)
+
+    # Segments were used in order, except for block 0 which was used last.
+    for number in range(8):
+        os.utime(tmp_path / f"{number:012d}.seg", (1000 + number, 1000 + number))
+    os.utime(tmp_path / f"{0:012d}.seg", (2000, 2000))
+
+    # Only leave room for about half of the blocks.
+    cache = BlockCache(tmp_path, cache.get_stats().size // 2, segment_size=1)
+
+    stats = cache.get_stats()
+    assert 2 <= stats.num_blocks < 8
+    assert stats.size <= cache.max_size
+    assert cache.get(0) == raw_blocks[0]
+    assert cache.get(1) is None
+    assert cache.get(7) == raw_blocks[7]
+
+
+@pytest.mark.trio
+async def test_cache_recovers_from_partial_record(tmp_path, raw_blocks):
+    cache = BlockCache(tmp_path, MAX_SIZE, segment_size=8)
+    for raw_block in raw_blocks[:3]:
+        cache.put(raw_block)
+
+    segment_path = tmp_path / f"{0:012d}.seg"
+    intact_size = segment_path.stat().st_size
+    # Simulate a crash part way through writing a record.
+    cache.put(raw_blocks[3])
+    with segment_path.open("r+b") as segment_file:
+        segment_file.truncate(segment_path.stat().st_size - 10)
+
+    reopened = BlockCache(tmp_path, MAX_SIZE, segment_size=8)
+    assert reopened.get(2) == raw_blocks[2]
+    assert segment_path.stat().st_size == intact_size
+
+    reopened.put(raw_blocks[3])
+    assert BlockCache(tmp_path, MAX_SIZE, segment_size=8).get(3) == raw_blocks[3]
+
+
+@pytest.mark.trio
+async def test_exfiltrator_reads_through_cache(tmp_path, client):
+    cache = BlockCache(tmp_path, MAX_SIZE)
+
+    async def _exfiltrate():
+        send_channel, receive_channel = trio.open_memory_channel(0)
+        exfiltrator = Exfiltrator(
+            client=client,
+            block_send_channel=send_channel,
+            start_at=1,
+            end_at=8,
+            concurrency_factor=3,
+            cache=cache,
+        )
+        async with background_trio_service(exfiltrator) as manager:
+            blocks = tuple([await receive_channel.receive() for _ in range(7)])
+            manager.cancel()
+        return blocks, exfiltrator.get_stats()
+
+    first_blocks, first_stats = await _exfiltrate()
+    assert (first_stats["cache_hits"], first_stats["cache_misses"]) == (0, 7)
+
+    second_blocks, second_stats = await _exfiltrate()
+    assert (second_stats["cache_hits"], second_stats["cache_misses"]) == (7, 0)
+
+    assert tuple(map(tuple, second_blocks)) == tuple(map(tuple, first_blocks))
@@ -0,0 +1,208 @@
+import json
+import pathlib
+import tempfile
+
+from async_service import background_trio_service
+import pytest
+import trio
+import trio.testing
+from web3 import IPCProvider, Web3
+
+from cthaeh._utils import gather
+from cthaeh.batch import BatchRequestError, unwrap_batch_response
+from cthaeh.client import (
+    HTTPClient,
+    IPCClient,
+    RPCError,
+    _IPCConnection,
+    _unwrap_response,
+)
+from cthaeh.exfiltration import fetch_block, retrieve_block
+from mock_node import MockNode, MockNodeHTTPServer, MockNodeServer
+
+
+@pytest.fixture
+def mock_node():
+    return MockNode(num_blocks=8, transactions_per_block=4, uncles_per_block=2)
+
+
+@pytest.fixture
+def ipc_path():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield pathlib.Path(temp_dir) / "node.ipc"
+
+
+@pytest.fixture
+async def ipc_server(mock_node, ipc_path):
+    server = MockNodeServer(mock_node, ipc_path)
+    async with background_trio_service(server):
+        await server.wait_serving()
+        yield server
+
+
+@pytest.fixture
+async def http_server(mock_node):
+    server = MockNodeHTTPServer(mock_node)
+    async with background_trio_service(server):
+        await server.wait_serving()
+        yield server
+
+
+@pytest.fixture(params=("ipc", "http"))
+async def client(request, ipc_path, ipc_server, http_server):
+    if request.param == "ipc":
+        client = IPCClient(ipc_path, pool_size=2)
+    elif request.param == "http":
+        client = HTTPClient(http_server.endpoint_uri, pool_size=2)
+    else:
+        raise Exception(f"Unsupported client: {request.param}")
+
+    async with background_trio_service(client):
+        yield client
+
+
+@pytest.mark.trio
+async def test_client_make_request(client, mock_node):
+    block_number = await client.make_request("eth_blockNumber", [])
+
+    assert block_number == hex(len(mock_node.blocks) - 1)
+
+
+@pytest.mark.trio
+async def test_client_make_request_error(client):
+    with pytest.raises(RPCError):
+        await client.make_request("eth_unknownMethod", [])
+
+
+@pytest.mark.trio
+async def test_client_concurrent_requests_are_multiplexed(client, mock_node):
+    requests = tuple(
+        (client.make_request, "eth_getBlockByNumber", [hex(block_number), False])
+        for block_number in range(len(mock_node.blocks))
+    )
+    results = await gather(*(requests * 4))
+
+    assert tuple(result["hash"] for result in results) == tuple(
+        raw_block["hash"] for raw_block in mock_node.blocks * 4
+    )
+
+
+@pytest.mark.trio
+async def test_client_make_batch_request(client, mock_node):
+    requests = tuple(
+        ("eth_getBlockByNumber", [hex(block_number), False])
+        for block_number in range(len(mock_node.blocks))
+    )
+    results = await client.make_batch_request(requests)
+
+    assert tuple(result["hash"] for result in results) == tuple(
+        raw_block["hash"] for raw_block in mock_node.blocks
+    )
+
+    with pytest.raises(BatchRequestError):
+        await client.make_batch_request(requests + (("eth_unknownMethod", []),))
+
+
+@pytest.mark.parametrize("max_batch_size", (None, 3))
+@pytest.mark.trio
+async def test_client_fetch_block_matches_web3(
+    client, ipc_path, mock_node, max_batch_size
+):
+    w3 = Web3(IPCProvider(str(ipc_path)))
+
+    for block_number in range(len(mock_node.blocks)):
+        expected = await retrieve_block(w3, block_number)
+        actual = await fetch_block(client, block_number, max_batch_size)
+
+        assert tuple(actual) == tuple(expected)
+
+
+@pytest.mark.trio
+async def test_ipc_client_reconnects(ipc_path, ipc_server):
+    client = IPCClient(ipc_path, pool_size=1)
+
+    async with background_trio_service(client):
+        await client.make_request("eth_blockNumber", [])
+
+        (connection,) = client._connections
+        await connection._stream.aclose()
+        # give the reader a chance to notice the closed connection
+        await trio.sleep(0.01)
+
+        await client.make_request("eth_blockNumber", [])
+        assert client._connections[0] is not connection
+
+
+@pytest.mark.trio
+async def test_ipc_connection_reassembles_split_responses():
+    client_stream, node_stream = trio.testing.memory_stream_pair()
+    connection = _IPCConnection(client_stream)
+
+    response = json.dumps({"jsonrpc": "2.0", "id": 0, "result": "é" * 4096})
+    raw_response = response.encode("utf8")
+
+    async def respond():
+        # split the response part way through a multibyte character
+        for offset in range(0, len(raw_response), 1001):
+            await node_stream.send_all(raw_response[offset : offset + 1001])
+            await trio.sleep(0)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(connection.read_responses)
+        nursery.start_soon(respond)
+
+        assert await connection.send(0, b"") == json.loads(response)
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.parametrize(
+    "error_response",
+    (
+        {"jsonrpc": "2.0", "id": None, "error": {"code": -32700}},
+        [{"jsonrpc": "2.0", "id": None, "error": {"code": -32600}}],
+    ),
+)
+@pytest.mark.trio
+async def test_ipc_connection_batch_error_without_id(error_response):
+    client_stream, node_stream = trio.testing.memory_stream_pair()
+    connection = _IPCConnection(client_stream)
+    requests = (("eth_blockNumber", []), ("eth_chainId", []))
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(connection.read_responses)
+        nursery.start_soon(
+            node_stream.send_all, json.dumps(error_response).encode("utf8")
+        )
+
+        with trio.fail_after(1):
+            responses = await connection.send(3, b"", (3, 4))
+
+        with pytest.raises(BatchRequestError):
+            unwrap_batch_response(requests, responses, (3, 4))
+        nursery.cancel_scope.cancel()
+
+
+@pytest.mark.parametrize(
+    "error_response",
+    (
+        {"jsonrpc": "2.0", "id": None, "error": {"code": -32700}},
+        [{"jsonrpc": "2.0", "id": None, "error": {"code": -32600}}],
+    ),
+)
+@pytest.mark.trio
+async def test_ipc_connection_request_error_without_id(error_response):
+    client_stream, node_stream = trio.testing.memory_stream_pair()
+    connection = _IPCConnection(client_stream)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(connection.read_responses)
+        nursery.start_soon(
+            node_stream.send_all, json.dumps(error_response).encode("utf8")
+        )
+
+        with trio.fail_after(1):
+            response = await connection.send(3, b"")
+
+        with pytest.raises(RPCError):
+            _unwrap_response("eth_blockNumber", [], response)
+        nursery.cancel_scope.cancel()
@@ -0,0 +1,159 @@
+from async_service import background_trio_service
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+import trio
+from web3 import Web3
+
+from cthaeh.client import Web3Client
+from cthaeh.commit import CommitPolicy
+from cthaeh.exfiltration import fetch_raw_block
+from cthaeh.extraction import extract_raw_block_data
+from cthaeh.loader import BlockLoader
+from cthaeh.models import Base, Block, query_row_counts
+from mock_node import MockNode, MockNodeProvider
+
+
+def test_commit_policy_limits():
+    policy = CommitPolicy(
+        max_blocks=4, max_rows=100, min_rows=10, max_bytes=1000, max_age=1.0
+    )
+    assert not policy.has_pending
+    assert not policy.should_commit(now=100)
+
+    policy.record_import(num_blocks=3, num_rows=10, num_bytes=10, now=10)
+    assert policy.deadline == 11
+    assert not policy.should_commit(now=10.5)
+    assert policy.should_commit(now=11)
+
+    policy.record_import(num_blocks=1, num_rows=10, num_bytes=10, now=10.5)
+    assert policy.deadline == 11
+    assert policy.should_commit(now=10.5)
+
+    policy.record_commit(0.01)
+    assert not policy.has_pending
+
+    policy.record_import(num_blocks=1, num_rows=100, num_bytes=10, now=20)
+    assert policy.should_commit(now=20)
+    policy.record_commit(0.01)
+
+    policy.record_import(num_blocks=1, num_rows=1, num_bytes=1000, now=30)
+    assert policy.should_commit(now=30)
+
+
+def test_commit_policy_adapts_row_limit():
+    policy = CommitPolicy(max_rows=1000, min_rows=100, target_latency=1.0)
+
+    for expected in (500, 250, 125, 100, 100):
+        policy.record_import(num_blocks=1, num_rows=1, num_bytes=1, now=0)
+        policy.record_commit(2.0)
+        assert policy.row_limit == expected
+
+    # Fast commits only raise the limit when they were cut short by it.
+    policy.record_import(num_blocks=1, num_rows=1, num_bytes=1, now=0)
+    policy.record_commit(0.1)
+    assert policy.row_limit == 100
+
+    policy.record_import(num_blocks=1, num_rows=100, num_bytes=1, now=0)
+    policy.record_commit(0.1)
+    assert policy.row_limit == 125
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    (
+        {"max_blocks": 0},
+        {"min_rows": 10, "max_rows": 5},
+        {"max_bytes": 0},
+        {"max_age": 0},
+        {"target_latency": 0},
+    ),
+)
+def test_commit_policy_validation(kwargs):
+    with pytest.raises(ValueError):
+        CommitPolicy(**kwargs)
+
+
+@pytest.fixture
+async def blocks():
+    mock_node = MockNode(num_blocks=8, transactions_per_block=2, uncles_per_block=1)
+    client = Web3Client(Web3(MockNodeProvider(mock_node)))
+    return tuple(
+        [
+            extract_raw_block_data(await fetch_raw_block(client, number))
+            for number in range(8)
+        ]
+    )
+
+
+@pytest.fixture
+def loader_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    commits = []
+    event.listen(session, "after_commit", lambda _: commits.append(None))
+    try:
+        yield session, commits
+    finally:
+        session.close()
+
+
+@pytest.mark.trio
+async def test_block_loader_commits_in_groups(loader_session, blocks):
+    session, commits = loader_session
+    send_channel, receive_channel = trio.open_memory_channel(0)
+    policy = CommitPolicy(max_blocks=4, max_age=60)
+    loader = BlockLoader(session, receive_channel, commit_policy=policy)
+
+    async with background_trio_service(loader):
+        with trio.fail_after(10):
+            async with send_channel:
+                for block in blocks:
+                    await send_channel.send(block)
+            # One commit for each group of four blocks and a final one once
+            # the channel is closed.
+            while len(commits) < 3:
+                await trio.sleep(0.01)
+
+    assert len(commits) == 3
+    assert session.query(Block).count() == len(blocks)
+    assert not policy.has_pending
+
+
+@pytest.mark.trio
+async def test_block_loader_commits_after_max_age(loader_session, blocks):
+    session, commits = loader_session
+    send_channel, receive_channel = trio.open_memory_channel(0)
+    loader = BlockLoader(
+        session, receive_channel, commit_policy=CommitPolicy(max_age=0.05)
+    )
+
+    async with background_trio_service(loader):
+        with trio.fail_after(10):
+            async with send_channel:
+                await send_channel.send(blocks[0])
+                while not commits:
+                    await trio.sleep(0.01)
+
+                assert session.query(Block).count() == 1
+
+
+@pytest.mark.trio
+async def test_block_loader_counts_rows(loader_session, blocks):
+    session, _ = loader_session
+    send_channel, receive_channel = trio.open_memory_channel(0)
+    loader = BlockLoader(session, receive_channel)
+
+    async with background_trio_service(loader):
+        with trio.fail_after(10):
+            async with send_channel:
+                for block in blocks:
+                    await send_channel.send(block)
+            await loader.loaded.wait()
+
+    row_counts = loader.get_row_counts()
+    assert row_counts["block"] == len(blocks)
+    assert row_counts == query_row_counts(session, 0)
+    assert loader.num_rows_loaded == sum(row_counts.values())
+    assert query_row_counts(session, 8) == dict.fromkeys(row_counts, 0)
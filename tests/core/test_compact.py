@@ -0,0 +1,77 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cthaeh import compact
+from cthaeh.app import determine_start_block
+from cthaeh.filter import FilterParams, filter_logs, filter_logs_compact
+from cthaeh.loader import get_batch_rows_importer, import_block_batch
+from cthaeh.rows import prepare_batch_rows
+from cthaeh.rpc import _log_record_to_rpc_response, _log_to_rpc_response
+
+
+@pytest.fixture
+def compact_session():
+    engine = create_engine("sqlite://")
+    compact.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def test_uses_compact_schema(session, compact_session):
+    assert compact.uses_compact_schema(compact_session.get_bind())
+    assert not compact.uses_compact_schema(session.get_bind())
+    assert not compact.uses_compact_schema(create_engine("sqlite://"))
+    assert get_batch_rows_importer(compact_session) is compact.import_batch_rows_compact
+
+
+def _sort_logs(logs):
+    return sorted(
+        logs,
+        key=lambda log: (log["blockNumber"], log["transactionIndex"], log["logIndex"]),
+    )
+
+
+@pytest.mark.trio
+async def test_compact_schema_serves_the_same_logs(
+    session, compact_session, mock_node, batches
+):
+    for batch in batches:
+        import_block_batch(session, batch)
+        compact.import_batch_rows_compact(compact_session, prepare_batch_rows(batch))
+    compact_session.commit()
+
+    assert determine_start_block(compact_session) == 6
+    assert compact_session.query(compact.header).count() == sum(
+        len(batch) + len(batch.uncles) for batch in batches
+    )
+
+    first_log = next(
+        raw_log
+        for receipt in mock_node.receipts.values()
+        for raw_log in receipt["logs"]
+        if len(raw_log["topics"]) >= 2
+    )
+    address = bytes.fromhex(first_log["address"][2:])
+    topic = bytes.fromhex(first_log["topics"][1][2:])
+    all_params = (
+        FilterParams(),
+        FilterParams(from_block=2, to_block=4),
+        FilterParams(address=address),
+        FilterParams(topics=(None, topic)),
+        FilterParams(topics=(None, (topic, b"\x00" * 32))),
+    )
+
+    for params in all_params:
+        expected = _sort_logs(
+            _log_to_rpc_response(log) for log in filter_logs(session, params)
+        )
+        actual = [
+            _log_record_to_rpc_response(log)
+            for log in filter_logs_compact(compact_session, params)
+        ]
+        assert actual
+        assert actual == expected
@@ -0,0 +1,76 @@
+import pytest
+
+from cthaeh.concurrency import ConcurrencyController
+
+
+def test_concurrency_controller_fixed():
+    controller = ConcurrencyController(initial=3, minimum=3, maximum=3)
+    assert controller.is_fixed
+
+    for _ in range(100):
+        controller.record_success(0.1)
+    assert controller.target == 3
+
+    for _ in range(100):
+        controller.record_error()
+    assert controller.target == 3
+
+
+def test_concurrency_controller_additive_increase():
+    controller = ConcurrencyController(initial=2, minimum=1, maximum=8)
+
+    for _ in range(3):
+        controller.record_success(0.1)
+    assert controller.target == 3
+
+    for _ in range(1000):
+        controller.record_success(0.1)
+    assert controller.target == 8
+    assert controller.limiter.total_tokens == 8
+
+
+def test_concurrency_controller_multiplicative_decrease_on_errors():
+    controller = ConcurrencyController(initial=8, minimum=2, maximum=8)
+
+    for _ in range(8):
+        controller.record_success(0.1)
+    controller.record_error()
+    assert controller.target == 6
+
+    # only one decrease is applied per round of fetches
+    controller.record_error()
+    assert controller.target == 6
+
+    for _ in range(100):
+        for _ in range(controller.target):
+            controller.record_error()
+    assert controller.target == 2
+
+
+def test_concurrency_controller_decrease_on_latency():
+    controller = ConcurrencyController(
+        initial=8, minimum=1, maximum=8, smoothing_factor=0.5
+    )
+    for _ in range(16):
+        controller.record_success(0.1)
+    assert controller.target == 8
+
+    for _ in range(16):
+        controller.record_success(1.0)
+    assert controller.target < 8
+
+
+def test_concurrency_controller_holds_with_deep_collation_buffer():
+    controller = ConcurrencyController(initial=2, minimum=1, maximum=8)
+
+    for _ in range(100):
+        controller.record_success(0.1, buffer_depth=10)
+    assert controller.target == 2
+
+
+@pytest.mark.parametrize(
+    "initial,minimum,maximum", ((1, 2, 3), (4, 2, 3), (0, 0, 1), (2, 3, 1))
+)
+def test_concurrency_controller_invalid_bounds(initial, minimum, maximum):
+    with pytest.raises(ValueError):
+        ConcurrencyController(initial=initial, minimum=minimum, maximum=maximum)
@@ -1,8 +1,21 @@
+import pathlib
+import tempfile
+
+from async_service import background_trio_service
 import pytest
-from web3 import EthereumTesterProvider, Web3
+import trio
+from web3 import EthereumTesterProvider, IPCProvider, Web3
 
+from cthaeh.client import HTTPClient, Web3Client
 from cthaeh.constants import BLANK_ROOT_HASH, GENESIS_PARENT_HASH
-from cthaeh.exfiltration import retrieve_block
+from cthaeh.exfiltration import (
+    BLOCK_RECEIPTS_METHODS,
+    Exfiltrator,
+    probe_block_receipts_method,
+    retrieve_block,
+    retrieve_block_batched,
+)
+from mock_node import MockNode, MockNodeHTTPServer, MockNodeProvider, MockNodeServer
 
 
 @pytest.fixture
@@ -24,3 +37,114 @@ async def test_exfiltration_of_genesis_block(w3):
     assert header.bloom == b""
     assert header.transaction_root == BLANK_ROOT_HASH
     assert header.receipt_root == BLANK_ROOT_HASH
+
+
+@pytest.fixture
+def mock_node():
+    return MockNode(num_blocks=8, transactions_per_block=4, uncles_per_block=2)
+
+
+@pytest.fixture
+def ipc_path():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield pathlib.Path(temp_dir) / "node.ipc"
+
+
+@pytest.fixture
+async def mock_node_w3(mock_node, ipc_path):
+    server = MockNodeServer(mock_node, ipc_path)
+    async with background_trio_service(server):
+        await server.wait_serving()
+        yield Web3(IPCProvider(str(ipc_path)))
+
+
+@pytest.mark.parametrize("max_batch_size", (1, 3, 1000))
+@pytest.mark.trio
+async def test_batched_exfiltration_matches_unbatched(mock_node_w3, max_batch_size):
+    for block_number in range(8):
+        expected = await retrieve_block(mock_node_w3, block_number)
+        actual = await retrieve_block_batched(
+            mock_node_w3, block_number, max_batch_size
+        )
+
+        assert tuple(actual) == tuple(expected)
+
+
+@pytest.mark.trio
+async def test_batched_exfiltration_without_batch_transport(mock_node):
+    w3 = Web3(MockNodeProvider(mock_node))
+
+    for block_number in range(8):
+        expected = await retrieve_block(w3, block_number)
+        actual = await retrieve_block_batched(w3, block_number, 2)
+
+        assert tuple(actual) == tuple(expected)
+
+
+@pytest.mark.parametrize(
+    "unsupported_methods,expected",
+    (
+        ((), "eth_getBlockReceipts"),
+        (("eth_getBlockReceipts",), "parity_getBlockReceipts"),
+        (("eth_getBlockReceipts", "parity_getBlockReceipts"), None),
+    ),
+)
+@pytest.mark.trio
+async def test_probe_block_receipts_method(unsupported_methods, expected):
+    node = MockNode(num_blocks=2, unsupported_methods=unsupported_methods)
+    client = Web3Client(Web3(MockNodeProvider(node)))
+
+    assert await probe_block_receipts_method(client) == expected
+
+
+@pytest.mark.trio
+async def test_probe_block_receipts_method_rejected_over_http():
+    node = MockNode(num_blocks=2, unsupported_methods=("eth_getBlockReceipts",))
+    server = MockNodeHTTPServer(node, unsupported_status=400)
+
+    async with background_trio_service(server):
+        await server.wait_serving()
+        client = HTTPClient(server.endpoint_uri)
+        async with background_trio_service(client):
+            assert await probe_block_receipts_method(client) == (
+                "parity_getBlockReceipts"
+            )
+
+
+@pytest.mark.parametrize("receipts_method", BLOCK_RECEIPTS_METHODS)
+@pytest.mark.trio
+async def test_block_receipts_exfiltration_matches_per_transaction(
+    mock_node_w3, receipts_method
+):
+    for block_number in range(8):
+        expected = await retrieve_block(mock_node_w3, block_number)
+        actual = await retrieve_block(mock_node_w3, block_number, receipts_method)
+        actual_batched = await retrieve_block_batched(
+            mock_node_w3, block_number, 2, receipts_method
+        )
+
+        assert tuple(actual) == tuple(expected)
+        assert tuple(actual_batched) == tuple(expected)
+
+
+@pytest.mark.parametrize("max_concurrency_factor", (None, 8))
+@pytest.mark.trio
+async def test_exfiltrator_relays_blocks_in_order(mock_node, max_concurrency_factor):
+    client = Web3Client(Web3(MockNodeProvider(mock_node)))
+    send_channel, receive_channel = trio.open_memory_channel(0)
+    exfiltrator = Exfiltrator(
+        client=client,
+        block_send_channel=send_channel,
+        start_at=1,
+        end_at=8,
+        concurrency_factor=3,
+        min_concurrency_factor=1 if max_concurrency_factor else None,
+        max_concurrency_factor=max_concurrency_factor,
+    )
+
+    async with background_trio_service(exfiltrator) as manager:
+        blocks = tuple([await receive_channel.receive() for _ in range(7)])
+        manager.cancel()
+
+    assert tuple(block.header.block_number for block in blocks) == tuple(range(1, 8))
+    assert 1 <= exfiltrator.get_stats()["concurrency"] <= (max_concurrency_factor or 3)
@@ -0,0 +1,88 @@
+import pytest
+from web3._utils.rpc_abi import RPC
+
+from cthaeh.batch import format_results
+from cthaeh.exfiltration import extract_block
+from cthaeh.extraction import (
+    decode_address,
+    decode_hash32,
+    decode_hex,
+    decode_quantity_bytes,
+    extract_raw_block,
+    extract_raw_transaction,
+)
+from mock_node import MockNode
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    (("0x", b""), ("0x00", b"\x00"), ("0x1", b"\x01"), ("0x123", b"\x01\x23")),
+)
+def test_decode_hex(value, expected):
+    assert decode_hex(value) == expected
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    (("0x0", b"\x00"), ("0x1", b"\x01"), ("0xff", b"\xff"), ("0x100", b"\x01\x00")),
+)
+def test_decode_quantity_bytes(value, expected):
+    assert decode_quantity_bytes(value) == expected
+
+
+def test_decode_fixed_length_values():
+    with pytest.raises(ValueError):
+        decode_hash32("0x" + "00" * 31)
+    with pytest.raises(ValueError):
+        decode_address("0x" + "00" * 32)
+
+
+def _format_block(node, raw_block):
+    (block_data,) = format_results(((RPC.eth_getBlockByNumber, ()),), (raw_block,))
+    raw_receipts = tuple(
+        node.receipts[transaction["hash"]] for transaction in raw_block["transactions"]
+    )
+    receipts_data = format_results(
+        tuple((RPC.eth_getTransactionReceipt, ()) for _ in raw_receipts), raw_receipts
+    )
+    return block_data, receipts_data
+
+
+@pytest.mark.parametrize("block_number", range(6))
+def test_raw_extraction_matches_formatted_extraction(block_number):
+    node = MockNode(num_blocks=6, transactions_per_block=3, uncles_per_block=2)
+    raw_block = node.blocks[block_number]
+    raw_uncles = node.uncles[raw_block["hash"]]
+    raw_receipts = tuple(
+        node.receipts[transaction["hash"]] for transaction in raw_block["transactions"]
+    )
+
+    block_data, receipts_data = _format_block(node, raw_block)
+    expected = extract_block(
+        block_data,
+        transactions_data=block_data["transactions"],
+        uncles_data=raw_uncles,
+        receipts_data=receipts_data,
+    )
+    actual = extract_raw_block(
+        raw_block,
+        transactions_data=raw_block["transactions"],
+        uncles_data=raw_uncles,
+        receipts_data=raw_receipts,
+    )
+
+    # `Block` equality only compares header hashes.
+    assert tuple(actual) == tuple(expected)
+
+
+def test_raw_transaction_extraction_with_short_signature_values():
+    node = MockNode(num_blocks=2)
+    raw_transaction = dict(node.blocks[1]["transactions"][0], r="0x1a2b3", s="0x0")
+    (transaction_data,) = format_results(
+        ((RPC.eth_getTransactionByHash, ()),), (raw_transaction,)
+    )
+
+    transaction = extract_raw_transaction(raw_transaction)
+
+    assert transaction.r == bytes(transaction_data["r"]) == b"\x01\xa2\xb3"
+    assert transaction.s == bytes(transaction_data["s"])
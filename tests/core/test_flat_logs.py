@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from cthaeh import compact, flat_logs
+from cthaeh.filter import FilterParams, filter_logs, filter_logs_flat
+from cthaeh.indexes import IndexBuilder, create_tables_without_indexes
+from cthaeh.loader import get_batch_rows_importer, import_block_batch
+from cthaeh.models import Base
+from cthaeh.rows import prepare_batch_rows
+from cthaeh.rpc import _log_record_to_rpc_response, _log_to_rpc_response
+from cthaeh.sqlite import import_batch_rows_core
+from cthaeh.writer import InlineWriter
+
+
+def _make_session(*all_metadata):
+    engine = create_engine("sqlite://")
+    for metadata in all_metadata:
+        metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+@pytest.fixture(params=(Base.metadata, compact.metadata))
+def flat_session(request):
+    session = _make_session(request.param, flat_logs.metadata)
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def test_uses_flat_logs(session, flat_session):
+    assert flat_logs.uses_flat_logs(flat_session.get_bind())
+    assert not flat_logs.uses_flat_logs(session.get_bind())
+    assert get_batch_rows_importer(session) is import_batch_rows_core
+    assert get_batch_rows_importer(flat_session) is not import_batch_rows_core
+
+
+def _sort_logs(logs):
+    return sorted(
+        logs,
+        key=lambda log: (log["blockNumber"], log["transactionIndex"], log["logIndex"]),
+    )
+
+
+@pytest.mark.trio
+async def test_flat_logs_serve_the_same_logs(session, flat_session, mock_node, batches):
+    import_batch_rows = get_batch_rows_importer(flat_session)
+    for batch in batches:
+        import_block_batch(session, batch)
+        import_batch_rows(flat_session, prepare_batch_rows(batch))
+    flat_session.commit()
+
+    assert flat_session.query(flat_logs.flatlog).count() == sum(
+        len(batch.receipts.log_address) for batch in batches
+    )
+
+    first_log = next(
+        raw_log
+        for receipt in mock_node.receipts.values()
+        for raw_log in receipt["logs"]
+        if len(raw_log["topics"]) >= 2
+    )
+    address = bytes.fromhex(first_log["address"][2:])
+    topic = bytes.fromhex(first_log["topics"][1][2:])
+    all_params = (
+        FilterParams(),
+        FilterParams(from_block=2, to_block=4),
+        FilterParams(address=address),
+        FilterParams(address=(address, b"\x00" * 20), from_block=1),
+        FilterParams(topics=(None, topic)),
+        FilterParams(topics=(None, (topic, b"\x00" * 32))),
+    )
+
+    for params in all_params:
+        expected = _sort_logs(
+            _log_to_rpc_response(log) for log in filter_logs(session, params)
+        )
+        actual = [
+            _log_record_to_rpc_response(log)
+            for log in filter_logs_flat(flat_session, params)
+        ]
+        assert actual
+        assert actual == expected
+
+
+@pytest.mark.trio
+async def test_build_deferred_flat_log_indexes():
+    engine = create_engine("sqlite://")
+    for metadata in (Base.metadata, flat_logs.metadata):
+        create_tables_without_indexes(engine, metadata)
+    session = sessionmaker(bind=engine)()
+
+    builder = IndexBuilder(engine, Base.metadata, flat_logs.metadata)
+    missing_names = {index.name for index in builder.get_missing_indexes()}
+    assert "ix_flatlog_topic0_block_number" in missing_names
+    assert "ix_log_address" in missing_names
+
+    await builder.build(InlineWriter(session))
+
+    assert builder.get_missing_indexes() == ()
+    assert "ix_flatlog_topic0_block_number" in {
+        index["name"] for index in inspect(engine).get_indexes("flatlog")
+    }
+    session.close()
@@ -0,0 +1,105 @@
+import pathlib
+import tempfile
+
+from async_service import background_trio_service
+import pytest
+import trio
+from web3 import Web3
+
+from cthaeh.client import IPCClient, Web3Client
+from cthaeh.exfiltration import Exfiltrator
+from cthaeh.head import HeadTracker
+from cthaeh.retry import RetryingClient
+from mock_node import MockNode, MockNodeProvider, MockNodeServer
+
+
+@pytest.fixture
+def mock_node():
+    return MockNode(num_blocks=12, transactions_per_block=2, head=4)
+
+
+@pytest.fixture
+def ipc_path():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield pathlib.Path(temp_dir) / "node.ipc"
+
+
+@pytest.fixture
+async def ipc_client(mock_node, ipc_path):
+    server = MockNodeServer(mock_node, ipc_path)
+    async with background_trio_service(server):
+        await server.wait_serving()
+        yield RetryingClient(IPCClient(ipc_path, pool_size=1))
+
+
+async def _wait_for_head(head, block_number):
+    with trio.fail_after(2):
+        await head.wait_for_block(block_number)
+
+
+@pytest.mark.trio
+async def test_head_tracker_follows_subscription(mock_node, ipc_client):
+    # A poll interval this long means only the subscription can keep up.
+    head = HeadTracker(ipc_client, poll_interval=1000)
+
+    async with background_trio_service(ipc_client):
+        async with background_trio_service(head):
+            await _wait_for_head(head, 4)
+            for block_number in range(5, 8):
+                mock_node.advance_head()
+                await _wait_for_head(head, block_number)
+
+            assert head.head == 7
+            assert head.is_subscribed
+
+
+@pytest.mark.trio
+async def test_head_tracker_falls_back_to_polling(autojump_clock, mock_node):
+    client = Web3Client(Web3(MockNodeProvider(mock_node)))
+    head = HeadTracker(client, poll_interval=5)
+
+    async with background_trio_service(head):
+        assert await head.wait_for_block(4) == 4
+
+        mock_node.advance_head()
+        started_at = trio.current_time()
+        assert await head.wait_for_block(5) == 5
+        assert 0 < trio.current_time() - started_at <= 5
+
+    assert not head.is_subscribed
+
+
+@pytest.mark.trio
+async def test_exfiltrator_only_fetches_up_to_head(mock_node, ipc_client):
+    send_channel, receive_channel = trio.open_memory_channel(0)
+    exfiltrator = Exfiltrator(
+        client=ipc_client,
+        block_send_channel=send_channel,
+        start_at=0,
+        end_at=None,
+        concurrency_factor=4,
+        head_poll_interval=1000,
+    )
+
+    async with background_trio_service(ipc_client):
+        async with background_trio_service(exfiltrator) as manager:
+            with trio.fail_after(2):
+                for block_number in range(5):
+                    block = await receive_channel.receive()
+                    assert block.header.block_number == block_number
+
+            # Nothing past the head is fetched.
+            with trio.move_on_after(0.1):
+                await receive_channel.receive()
+                raise AssertionError("Received a block past the head")
+            assert exfiltrator.caught_up.is_set()
+            assert ipc_client.get_stats()["retries"] == 0
+
+            for block_number in range(5, 8):
+                mock_node.advance_head()
+                with trio.fail_after(2):
+                    block = await receive_channel.receive()
+                assert block.header.block_number == block_number
+
+            assert exfiltrator.get_stats()["head"] == 7
+            manager.cancel()
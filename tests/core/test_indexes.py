@@ -0,0 +1,91 @@
+import json
+import pathlib
+
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+import trio
+from web3 import Web3
+
+from cthaeh import compact
+from cthaeh.block_batch import BlockBatch
+from cthaeh.client import Web3Client
+from cthaeh.exfiltration import fetch_raw_block
+from cthaeh.indexes import (
+    IndexBuilder,
+    create_tables_without_indexes,
+    get_deferrable_indexes,
+)
+from cthaeh.loader import get_batch_rows_importer
+from cthaeh.models import Base, Log
+from cthaeh.rows import prepare_batch_rows
+from cthaeh.rpc import RPCServer
+from cthaeh.writer import InlineWriter
+from mock_node import MockNode, MockNodeProvider
+
+
+def _get_index_names(engine):
+    inspector = inspect(engine)
+    return {
+        index["name"]
+        for table_name in inspector.get_table_names()
+        for index in inspector.get_indexes(table_name)
+    }
+
+
+def test_deferrable_indexes():
+    names = {index.name for index in get_deferrable_indexes(Base.metadata)}
+
+    assert {
+        "ix_idx_topic_topic_log_id",
+        "ix_log_address",
+        "ix_logtopic_topic_topic",
+        "ix_header_block_number",
+    } <= names
+    assert "ix_block_header_hash_transaction_hash" not in names
+
+
+@pytest.mark.parametrize("metadata", (Base.metadata, compact.metadata))
+@pytest.mark.trio
+async def test_build_deferred_indexes(metadata):
+    engine = create_engine("sqlite://")
+    create_tables_without_indexes(engine, metadata)
+    session = sessionmaker(bind=engine)()
+
+    deferrable_indexes = get_deferrable_indexes(metadata)
+    assert not _get_index_names(engine) & {index.name for index in deferrable_indexes}
+
+    builder = IndexBuilder(engine, metadata)
+    assert not builder.ready.is_set()
+    assert builder.get_missing_indexes() == deferrable_indexes
+
+    mock_node = MockNode(num_blocks=4, transactions_per_block=3)
+    client = Web3Client(Web3(MockNodeProvider(mock_node)))
+    batch = BlockBatch.from_raw_blocks(
+        [await fetch_raw_block(client, number) for number in range(4)]
+    )
+    get_batch_rows_importer(session)(session, prepare_batch_rows(batch))
+
+    await builder.build(InlineWriter(session))
+
+    assert builder.ready.is_set()
+    assert builder.get_missing_indexes() == ()
+    assert _get_index_names(engine) >= {index.name for index in deferrable_indexes}
+    assert session.query(Log.id).count() == len(batch.receipts.log_address)
+    session.close()
+
+
+@pytest.mark.trio
+async def test_rpc_server_waits_for_indexes(session):
+    indexes_ready = trio.Event()
+    rpc_server = RPCServer(
+        pathlib.Path("unused.ipc"), session, indexes_ready=indexes_ready
+    )
+    request = {"jsonrpc": "2.0", "id": 1, "method": "eth_getLogs", "params": [{}]}
+
+    response = json.loads(await rpc_server.execute_rpc(request))
+    assert "indexes" in response["error"]
+
+    indexes_ready.set()
+    response = json.loads(await rpc_server.execute_rpc(request))
+    assert response["result"] == []
@@ -0,0 +1,136 @@
+from async_service import background_trio_service
+from eth_utils import to_canonical_address, to_int
+import pytest
+import trio
+from web3 import Web3
+
+from cthaeh.client import Web3Client
+from cthaeh.exfiltration import fetch_block
+from cthaeh.filter import FilterParams, filter_logs
+from cthaeh.loader import import_block
+from cthaeh.log_exfiltration import (
+    LogExfiltrator,
+    TooManyResults,
+    is_too_many_results_error,
+    retrieve_logs,
+)
+from cthaeh.rpc import _log_to_rpc_response
+from mock_node import MockNode, MockNodeProvider
+
+
+@pytest.fixture
+def mock_node():
+    return MockNode(num_blocks=8, transactions_per_block=4, max_logs_per_query=16)
+
+
+@pytest.fixture
+def client(mock_node):
+    return Web3Client(Web3(MockNodeProvider(mock_node)))
+
+
+async def _exfiltrate_logs(client, start_at, end_at, **kwargs):
+    send_channel, receive_channel = trio.open_memory_channel(0)
+    exfiltrator = LogExfiltrator(
+        client=client,
+        block_send_channel=send_channel,
+        start_at=start_at,
+        end_at=end_at,
+        **kwargs,
+    )
+
+    async with background_trio_service(exfiltrator):
+        async with receive_channel:
+            blocks = tuple([block async for block in receive_channel])
+
+    return exfiltrator, blocks
+
+
+@pytest.mark.parametrize(
+    "error,expected",
+    (
+        ({"code": -32005, "message": "query returned more than 10000 results"}, True),
+        ({"code": -32000, "message": "Log response size exceeded."}, True),
+        ({"code": -32602, "message": "exceed maximum block range: 5000"}, True),
+        ({"code": -32601, "message": "the method eth_getLogs does not exist"}, False),
+        ("query returned more than 10000 results", False),
+    ),
+)
+def test_is_too_many_results_error(error, expected):
+    assert is_too_many_results_error(error) is expected
+
+
+@pytest.mark.trio
+async def test_retrieve_logs_raises_too_many_results(mock_node, client):
+    with pytest.raises(TooManyResults):
+        await retrieve_logs(client, 0, 7)
+
+    logs = await retrieve_logs(client, 1, 1)
+    assert len(logs) == sum(
+        len(mock_node.receipts[transaction["hash"]]["logs"])
+        for transaction in mock_node.blocks[1]["transactions"]
+    )
+
+
+@pytest.mark.parametrize("batch_size", (None, 3))
+@pytest.mark.trio
+async def test_log_exfiltrator_matches_full_blocks(client, batch_size):
+    exfiltrator, blocks = await _exfiltrate_logs(
+        client, 0, 8, batch_size=batch_size, initial_window_size=8
+    )
+
+    # The initial window holds more logs than the node is willing to return
+    # and has to shrink.
+    assert exfiltrator.get_stats()["window"] < 8
+
+    assert tuple(block.header.block_number for block in blocks) == tuple(range(8))
+    for block in blocks:
+        expected = await fetch_block(client, block.header.block_number)
+
+        assert block.header == expected.header
+        assert block.uncles == ()
+        assert tuple(transaction.hash for transaction in block.transactions) == tuple(
+            transaction.hash for transaction in expected.transactions
+        )
+        assert tuple(receipt.logs for receipt in block.receipts) == tuple(
+            receipt.logs for receipt in expected.receipts
+        )
+
+
+@pytest.mark.trio
+async def test_log_exfiltrator_grows_window_when_sparse(client):
+    exfiltrator, blocks = await _exfiltrate_logs(
+        client, 0, 8, initial_window_size=1, max_window_size=4
+    )
+
+    assert len(blocks) == 8
+    assert exfiltrator.get_stats()["window"] == 4
+
+
+@pytest.mark.trio
+async def test_logs_only_blocks_serve_filter_logs(session, mock_node, client):
+    _, blocks = await _exfiltrate_logs(client, 0, 8, initial_window_size=2)
+    for block in blocks:
+        import_block(session, block)
+
+    expected_logs = tuple(
+        log
+        for raw_block in mock_node.blocks
+        for transaction in raw_block["transactions"]
+        for log in mock_node.receipts[transaction["hash"]]["logs"]
+    )
+    address = to_canonical_address(expected_logs[0]["address"])
+
+    results = filter_logs(session, FilterParams())
+    assert len(results) == len(expected_logs)
+
+    (result,) = filter_logs(session, FilterParams(address=address))
+    rpc_log = _log_to_rpc_response(result)
+    expected_log = expected_logs[0]
+
+    assert rpc_log["blockHash"] == expected_log["blockHash"]
+    assert rpc_log["transactionHash"] == expected_log["transactionHash"]
+    assert to_int(hexstr=rpc_log["transactionIndex"]) == to_int(
+        hexstr=expected_log["transactionIndex"]
+    )
+    assert rpc_log["topics"] == expected_log["topics"]
+    assert rpc_log["data"] == expected_log["data"]
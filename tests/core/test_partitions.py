@@ -0,0 +1,106 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+
+from cthaeh.flat_logs import flatlog
+from cthaeh.partitions import (
+    LogPartitioner,
+    create_partitioned_flat_logs,
+    get_create_partition_ddl,
+    get_create_partitioned_table_ddl,
+    get_log_partitioner,
+    get_partition_starts,
+    metadata,
+    partitioning,
+)
+from cthaeh.session import _remember_committed
+
+
+@pytest.mark.parametrize(
+    "width,low,high,expected",
+    (
+        (10, 0, 0, (0,)),
+        (10, 0, 9, (0,)),
+        (10, 0, 10, (0, 10)),
+        (10, 15, 31, (10, 20, 30)),
+        (1000, 999, 1000, (0, 1000)),
+    ),
+)
+def test_get_partition_starts(width, low, high, expected):
+    assert tuple(get_partition_starts(width, low, high)) == expected
+
+
+def test_partition_ddl():
+    create_table = get_create_partitioned_table_ddl(flatlog, postgresql.dialect())
+    assert create_table.startswith("\nCREATE TABLE flatlog (")
+    assert create_table.endswith(") PARTITION BY RANGE (block_number)")
+    assert "PRIMARY KEY (block_number, transaction_index, log_index, block_hash)" in (
+        create_table
+    )
+
+    assert get_create_partition_ddl("flatlog", 2000, 1000) == (
+        'CREATE TABLE IF NOT EXISTS "flatlog_2000" PARTITION OF "flatlog" '
+        "FOR VALUES FROM (2000) TO (3000)"
+    )
+
+
+def test_partitioning_requires_postgres():
+    with pytest.raises(ValueError):
+        create_partitioned_flat_logs(create_engine("sqlite://"), 1000)
+
+
+class _RecordingSession:
+    transaction = None
+
+    def __init__(self, fail_commit=False):
+        self.statements = []
+        self.info = {}
+        self.fail_commit = fail_commit
+
+    def execute(self, statement):
+        self.statements.append(statement)
+
+    def commit(self):
+        if self.fail_commit:
+            raise Exception("commit failed")
+        _remember_committed(self)
+
+
+def test_log_partitioner_creates_partitions_ahead():
+    partitioner = LogPartitioner(width=100, partitions_ahead=2)
+    session = _RecordingSession()
+
+    assert partitioner.get_missing_partitions(150, 180) == (100, 200, 300)
+    partitioner.create_partitions(session, (100, 200, 300))
+    assert session.statements == [
+        get_create_partition_ddl("flatlog", start, 100) for start in (100, 200, 300)
+    ]
+
+    # Only partitions which have not been created yet are missing.
+    assert partitioner.get_missing_partitions(190, 210) == (400,)
+    assert partitioner.get_missing_partitions(250, 260) == (400,)
+    assert partitioner.get_missing_partitions(150, 180) == ()
+
+
+def test_log_partitioner_forgets_partitions_without_commit():
+    partitioner = LogPartitioner(width=100, partitions_ahead=0)
+    session = _RecordingSession(fail_commit=True)
+
+    with pytest.raises(Exception, match="commit failed"):
+        partitioner.create_partitions(session, (100,))
+
+    # The partitions are created again next time.
+    assert partitioner.get_missing_partitions(150, 180) == (100,)
+
+
+def test_get_log_partitioner():
+    engine = create_engine("sqlite://")
+    assert get_log_partitioner(engine) is None
+
+    metadata.create_all(engine)
+    assert get_log_partitioner(engine) is None
+
+    engine.execute(partitioning.insert(), {"table_name": "flatlog", "width": 500})
+    partitioner = get_log_partitioner(engine)
+    assert partitioner is not None
+    assert partitioner.width == 500
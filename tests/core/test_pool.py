@@ -0,0 +1,139 @@
+from async_service import background_trio_service
+import pytest
+import trio
+
+from cthaeh.client import BlockHashMismatch, JSONRPCClientAPI, RPCError
+from cthaeh.pool import NodePool
+from cthaeh.retry import RetryingClient
+from mock_node import MockNode
+
+
+class FakeNodeClient(JSONRPCClientAPI):
+    def __init__(self, node, latency=0.01):
+        self.node = node
+        self.latency = latency
+        self.is_failing = False
+        self.num_requests = 0
+
+    async def run(self):
+        await self.manager.wait_finished()
+
+    async def make_request(self, method, params):
+        self.num_requests += 1
+        await trio.sleep(self.latency)
+        if self.is_failing:
+            raise ConnectionError("Node is down")
+
+        response = self.node.process({"id": 0, "method": method, "params": params})
+        if "error" in response:
+            raise RPCError(method, params, response["error"])
+        return response["result"]
+
+    async def make_batch_request(self, requests):
+        return tuple(
+            [await self.make_request(method, params) for method, params in requests]
+        )
+
+
+@pytest.fixture
+def node():
+    return MockNode(num_blocks=8)
+
+
+def _make_pool(clients, **kwargs):
+    kwargs.setdefault("poll_interval", 1000)
+    return NodePool(
+        tuple((f"node-{idx}", client) for idx, client in enumerate(clients)), **kwargs
+    )
+
+
+@pytest.mark.trio
+async def test_pool_spreads_concurrent_requests(autojump_clock, node):
+    clients = tuple(FakeNodeClient(node, latency=1) for _ in range(3))
+    pool = _make_pool(clients)
+
+    async with background_trio_service(pool):
+        async with trio.open_nursery() as nursery:
+            for _ in range(60):
+                nursery.start_soon(pool.make_request, "eth_blockNumber", [])
+
+    assert all(client.num_requests >= 15 for client in clients)
+
+
+@pytest.mark.trio
+async def test_pool_prefers_faster_nodes(autojump_clock, node):
+    fast = FakeNodeClient(node, latency=0.1)
+    slow = FakeNodeClient(node, latency=1)
+    pool = _make_pool((slow, fast))
+
+    async with background_trio_service(pool):
+        for _ in range(20):
+            await pool.make_request("eth_blockNumber", [])
+
+    assert fast.num_requests > 3 * slow.num_requests
+
+
+@pytest.mark.trio
+async def test_pool_ejects_and_reinstates_failing_nodes(autojump_clock, node):
+    flaky = FakeNodeClient(node)
+    healthy = FakeNodeClient(node, latency=0.02)
+    pool = _make_pool((flaky, healthy), eject_after=3, eject_duration=10)
+
+    async with background_trio_service(pool):
+        flaky.is_failing = True
+        for _ in range(10):
+            try:
+                await pool.make_request("eth_blockNumber", [])
+            except ConnectionError:
+                pass
+
+        assert pool.get_stats()["nodes"] == "1/2"
+        assert pool.get_stats()["ejections"] == 1
+        num_flaky_requests = flaky.num_requests
+
+        flaky.is_failing = False
+        await trio.sleep(11)
+        assert pool.get_stats()["nodes"] == "2/2"
+
+        for _ in range(10):
+            await pool.make_request("eth_blockNumber", [])
+
+    assert flaky.num_requests > num_flaky_requests
+
+
+@pytest.mark.trio
+async def test_pool_does_not_eject_for_node_independent_errors(autojump_clock, node):
+    client = FakeNodeClient(MockNode(num_blocks=8, unsupported_methods={"eth_foo"}))
+    pool = _make_pool((client, FakeNodeClient(node)), eject_after=1)
+
+    async with background_trio_service(pool):
+        for _ in range(3):
+            with pytest.raises(RPCError):
+                await pool.make_request("eth_foo", [])
+
+    assert pool.get_stats()["ejections"] == 0
+
+
+@pytest.mark.trio
+async def test_pool_cross_checks_blocks_at_head(autojump_clock, node):
+    forked = FakeNodeClient(MockNode(num_blocks=8, seed=1))
+    clients = (forked, FakeNodeClient(node), FakeNodeClient(node))
+    pool = _make_pool(clients, head_check_depth=2)
+    client = RetryingClient(pool)
+
+    async with background_trio_service(client):
+        # The forked node is picked first and is outvoted.
+        with pytest.raises(BlockHashMismatch):
+            await pool.make_request("eth_getBlockByNumber", ["0x7", False])
+        assert pool.get_stats()["hash_mismatches"] == 1
+
+        # Retrying moves on to a node in the majority.
+        result = await client.make_request("eth_getBlockByNumber", ["0x7", False])
+        assert result["hash"] == node.blocks[7]["hash"]
+
+        # Blocks deeper than the check depth are not cross-checked.
+        num_requests = sum(node_client.num_requests for node_client in clients)
+        await pool.make_request("eth_getBlockByNumber", ["0x1", False])
+        assert (
+            sum(node_client.num_requests for node_client in clients) == num_requests + 1
+        )
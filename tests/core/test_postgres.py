@@ -0,0 +1,114 @@
+import struct
+
+import pytest
+from web3 import Web3
+
+from cthaeh.block_batch import BlockBatch
+from cthaeh.client import Web3Client
+from cthaeh.exfiltration import fetch_raw_block
+from cthaeh.postgres import (
+    COPY_HEADER,
+    TOPIC_STAGING_TABLE,
+    _encode_bool,
+    _encode_bytea,
+    _encode_int4,
+    _encode_int8,
+    encode_copy_rows,
+    prepare_copy_payloads,
+)
+from cthaeh.rows import prepare_batch_rows
+from mock_node import MockNode, MockNodeProvider
+
+
+def _decode_copy_rows(payload):
+    assert payload.startswith(COPY_HEADER)
+    offset = len(COPY_HEADER)
+    rows = []
+    while True:
+        (num_fields,) = struct.unpack_from("!h", payload, offset)
+        offset += 2
+        if num_fields == -1:
+            break
+        row = []
+        for _ in range(num_fields):
+            (length,) = struct.unpack_from("!i", payload, offset)
+            offset += 4
+            if length == -1:
+                row.append(None)
+            else:
+                row.append(payload[offset : offset + length])  # noqa: E203
+                offset += length
+        rows.append(tuple(row))
+    assert offset == len(payload)
+    return rows
+
+
+def _int(value):
+    return int.from_bytes(value, "big", signed=True)
+
+
+def test_encode_copy_rows():
+    payload = encode_copy_rows(
+        (_encode_bytea, _encode_int8, _encode_int4, _encode_bool),
+        ((b"\x01\x02", -2, 7, True), (None, 2 ** 40, 0, False)),
+    )
+
+    assert payload == b"".join(
+        (
+            COPY_HEADER,
+            b"\x00\x04",
+            b"\x00\x00\x00\x02\x01\x02",
+            b"\x00\x00\x00\x08" + (-2).to_bytes(8, "big", signed=True),
+            b"\x00\x00\x00\x04\x00\x00\x00\x07",
+            b"\x00\x00\x00\x01\x01",
+            b"\x00\x04",
+            b"\xff\xff\xff\xff",
+            b"\x00\x00\x00\x08" + (2 ** 40).to_bytes(8, "big"),
+            b"\x00\x00\x00\x04\x00\x00\x00\x00",
+            b"\x00\x00\x00\x01\x00",
+            b"\xff\xff",
+        )
+    )
+
+
+@pytest.mark.trio
+async def test_prepare_copy_payloads():
+    mock_node = MockNode(num_blocks=4, transactions_per_block=3, uncles_per_block=1)
+    client = Web3Client(Web3(MockNodeProvider(mock_node)))
+    batch = BlockBatch.from_raw_blocks(
+        [await fetch_raw_block(client, number) for number in range(4)]
+    )
+    rows = prepare_batch_rows(batch)
+    num_logs = len(batch.receipts.log_address)
+    log_ids = tuple(range(100, 100 + num_logs))
+
+    payloads = {
+        table: (columns, _decode_copy_rows(payload))
+        for table, columns, payload in prepare_copy_payloads(rows, log_ids)
+    }
+
+    columns, headers = payloads["header"]
+    assert len(headers) == len(batch) + len(batch.uncles)
+    header = dict(zip(columns, headers[0]))
+    assert header["hash"] == batch.headers.hash[0]
+    assert header["_parent_hash"] is None
+    assert _int(header["block_number"]) == 0
+    assert header["is_canonical"] == b"\x01"
+
+    columns, logs = payloads["log"]
+    assert tuple(_int(dict(zip(columns, log))["id"]) for log in logs) == log_ids
+
+    topics = tuple(
+        batch.receipts.topics[index] for index in range(len(batch.receipts.topics))
+    )
+    _, staged_topics = payloads[TOPIC_STAGING_TABLE]
+    assert sorted(topic for (topic,) in staged_topics) == sorted(set(topics))
+
+    columns, log_topics = payloads["logtopic"]
+    assert len(log_topics) == len(topics)
+    assert {_int(dict(zip(columns, row))["log_id"]) for row in log_topics} <= set(
+        log_ids
+    )
+
+    with pytest.raises(ValueError):
+        prepare_copy_payloads(rows, log_ids[1:])
@@ -0,0 +1,108 @@
+from async_service import background_trio_service
+import pytest
+import trio
+from web3 import Web3
+
+from cthaeh.client import Web3Client
+from cthaeh.exfiltration import Exfiltrator
+from cthaeh.reorder import ReorderWindow
+from mock_node import MockNode, MockNodeProvider
+
+
+@pytest.mark.trio
+async def test_reorder_window_releases_in_order():
+    window = ReorderWindow(10, capacity=4)
+    for key in (12, 11, 13, 10):
+        window.put(key, f"item-{key}")
+    assert window.depth == 4
+
+    assert [await window.get() for _ in range(4)] == [
+        f"item-{key}" for key in range(10, 14)
+    ]
+    assert window.depth == 0
+    assert window.next_key == 14
+
+
+def test_reorder_window_get_nowait():
+    window = ReorderWindow(0, capacity=4)
+    window.put(1, "item-1")
+
+    with pytest.raises(trio.WouldBlock):
+        window.get_nowait()
+
+    window.put(0, "item-0")
+    assert window.get_nowait() == "item-0"
+    assert window.get_nowait() == "item-1"
+    assert window.next_key == 2
+    assert window.depth == 0
+
+
+@pytest.mark.trio
+async def test_reorder_window_rejects_keys_outside_window():
+    window = ReorderWindow(10, capacity=4)
+
+    with pytest.raises(ValueError):
+        window.put(14, "item")
+    with pytest.raises(ValueError):
+        window.put(9, "item")
+
+    window.put(11, "item")
+    with pytest.raises(ValueError):
+        window.put(11, "item")
+
+
+@pytest.mark.trio
+async def test_reorder_window_reserve_waits_for_room(autojump_clock):
+    window = ReorderWindow(0, capacity=2)
+    reserved = []
+
+    async def _reserve(key):
+        await window.reserve(key)
+        reserved.append(key)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(_reserve, 1)
+        nursery.start_soon(_reserve, 3)
+        await trio.sleep(1)
+        assert reserved == [1]
+
+        window.put(0, "item-0")
+        window.put(1, "item-1")
+        await trio.sleep(1)
+        assert reserved == [1]
+
+        assert await window.get() == "item-0"
+        await trio.sleep(1)
+        assert reserved == [1]
+
+        assert await window.get() == "item-1"
+        await trio.sleep(1)
+        assert reserved == [1, 3]
+
+
+@pytest.mark.trio
+async def test_exfiltrator_applies_backpressure_with_small_window(autojump_clock):
+    node = MockNode(num_blocks=32, transactions_per_block=2)
+    client = Web3Client(Web3(MockNodeProvider(node)))
+    send_channel, receive_channel = trio.open_memory_channel(0)
+    exfiltrator = Exfiltrator(
+        client=client,
+        block_send_channel=send_channel,
+        start_at=0,
+        end_at=32,
+        concurrency_factor=16,
+        window_size=4,
+    )
+
+    async with background_trio_service(exfiltrator):
+        block_numbers = []
+        window_stats = set()
+        async with receive_channel:
+            async for block in receive_channel:
+                # A slow consumer fills the window and holds fetching back.
+                await trio.sleep(1)
+                window_stats.add(exfiltrator.get_stats()["window"])
+                block_numbers.append(block.header.block_number)
+
+    assert block_numbers == list(range(32))
+    assert "4/4" in window_stats
@@ -0,0 +1,181 @@
+import json
+import pathlib
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from web3 import Web3
+
+from cthaeh import flat_logs, retention
+from cthaeh.block_batch import BlockBatch
+from cthaeh.client import Web3Client
+from cthaeh.exfiltration import fetch_raw_block
+from cthaeh.loader import get_batch_rows_importer
+from cthaeh.models import Base, Header, query_row_counts
+from cthaeh.partitions import LogPartitioner
+from cthaeh.retention import (
+    Pruner,
+    RetentionPolicy,
+    _prune_flat_logs,
+    get_pruned_below,
+    prune_blocks,
+    uses_pruning,
+)
+from cthaeh.rows import prepare_batch_rows
+from cthaeh.rpc import RPCServer
+from cthaeh.writer import InlineWriter
+from mock_node import MockNode, MockNodeProvider
+
+NUM_BLOCKS = 8
+
+
+def _enable_foreign_keys(dbapi_connection, _):
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+@pytest.fixture
+async def loaded_session():
+    engine = create_engine("sqlite://")
+    # Foreign keys are enforced, so that pruning has to delete in order.
+    event.listen(engine, "connect", _enable_foreign_keys)
+    for metadata in (Base.metadata, flat_logs.metadata, retention.metadata):
+        metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    mock_node = MockNode(
+        num_blocks=NUM_BLOCKS,
+        transactions_per_block=3,
+        logs_per_receipt=2,
+        uncles_per_block=1,
+    )
+    client = Web3Client(Web3(MockNodeProvider(mock_node)))
+    batch = BlockBatch.from_raw_blocks(
+        [await fetch_raw_block(client, number) for number in range(NUM_BLOCKS)]
+    )
+    get_batch_rows_importer(session)(session, prepare_batch_rows(batch))
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.mark.parametrize(
+    "kwargs", ({}, {"max_blocks": 0}, {"max_age": 0}, {"max_blocks": 1, "max_age": -1})
+)
+def test_retention_policy_validation(kwargs):
+    with pytest.raises(ValueError):
+        RetentionPolicy(**kwargs)
+
+
+@pytest.mark.trio
+async def test_retention_policy(loaded_session):
+    assert RetentionPolicy(max_blocks=3).get_retained_from(loaded_session) == 5
+    assert RetentionPolicy(max_blocks=100).get_retained_from(loaded_session) == 0
+    assert RetentionPolicy(max_age=10 ** 12).get_retained_from(loaded_session) == 0
+
+
+@pytest.mark.trio
+async def test_prune_blocks(loaded_session):
+    kept_counts = query_row_counts(loaded_session, 4)
+    assert prune_blocks(loaded_session, 0, 4) > 0
+    loaded_session.commit()
+
+    assert set(query_row_counts(loaded_session, 0, 3).values()) == {0}
+    assert query_row_counts(loaded_session, 4) == kept_counts
+    assert loaded_session.query(Header).count() == kept_counts["header"]
+
+    oldest_kept = (
+        loaded_session.query(Header)
+        .filter(Header.block_number == 4, Header.is_canonical.is_(True))
+        .one()
+    )
+    assert oldest_kept._parent_hash is None
+
+
+@pytest.mark.trio
+async def test_pruner(loaded_session):
+    pruner = Pruner(
+        loaded_session.get_bind(),
+        InlineWriter(loaded_session),
+        RetentionPolicy(max_blocks=3),
+        batch_size=2,
+    )
+    await pruner.prune()
+
+    assert get_pruned_below(loaded_session) == 5
+    assert set(query_row_counts(loaded_session, 0, 4).values()) == {0}
+    assert query_row_counts(loaded_session, 5)["block"] == 3
+    assert {
+        block_number
+        for (block_number,) in loaded_session.query(flat_logs.flatlog.c.block_number)
+    } <= {5, 6, 7}
+
+    # Nothing is left to prune until more blocks are loaded.
+    await pruner.prune()
+    assert get_pruned_below(loaded_session) == 5
+
+
+@pytest.mark.trio
+async def test_prune_partly_expired_partition(loaded_session):
+    # SQLite has no partitions, so dropping the one holding blocks #0-#2
+    # leaves their logs behind, while those of #3 and #4 are deleted from
+    # the partition which still holds retained blocks.  The genesis block
+    # has no logs.
+    _prune_flat_logs(loaded_session, LogPartitioner(width=3), 0, 5)
+    loaded_session.commit()
+
+    assert {
+        block_number
+        for (block_number,) in loaded_session.query(flat_logs.flatlog.c.block_number)
+    } == {1, 2, 5, 6, 7}
+
+
+@pytest.mark.trio
+async def test_pruner_commits_through_callback(loaded_session):
+    writer = InlineWriter(loaded_session)
+    commits = []
+
+    async def commit():
+        commits.append(None)
+        await writer.write(lambda session: session.commit())
+
+    await Pruner(
+        loaded_session.get_bind(),
+        writer,
+        RetentionPolicy(max_blocks=3),
+        batch_size=2,
+        commit=commit,
+    ).prune()
+
+    # One commit for each of the batches #0-#1, #2-#3 and #4.
+    assert len(commits) == 3
+    assert get_pruned_below(loaded_session) == 5
+
+
+@pytest.mark.trio
+async def test_rpc_server_refuses_pruned_blocks(loaded_session):
+    assert uses_pruning(loaded_session.get_bind())
+    await Pruner(
+        loaded_session.get_bind(),
+        InlineWriter(loaded_session),
+        RetentionPolicy(max_blocks=3),
+    ).prune()
+    rpc_server = RPCServer(pathlib.Path("unused.ipc"), loaded_session)
+
+    async def get_logs(params):
+        request = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "eth_getLogs",
+            "params": [params],
+        }
+        return json.loads(await rpc_server.execute_rpc(request))
+
+    for params in ({}, {"fromBlock": "0x0"}, {"fromBlock": "0x4", "toBlock": "0x7"}):
+        response = await get_logs(params)
+        assert "pruned" in response["error"]
+
+    response = await get_logs({"fromBlock": "0x5"})
+    assert "error" not in response
+    assert {log["blockNumber"] for log in response["result"]} <= {"0x5", "0x6", "0x7"}
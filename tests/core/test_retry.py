@@ -0,0 +1,135 @@
+import random
+
+from async_service import background_trio_service
+import pytest
+import trio
+
+from cthaeh.batch import BatchRequestError
+from cthaeh.client import JSONRPCClientAPI, RPCError
+from cthaeh.retry import RetryingClient, is_retryable_error
+
+
+class ScriptedClient(JSONRPCClientAPI):
+    """
+    Answer each request according to the next step of a script.  A step is
+    either an exception to raise or the number of seconds to wait before
+    answering.
+    """
+
+    def __init__(self, script=()):
+        self.script = list(script)
+        self.num_requests = 0
+
+    async def run(self):
+        await self.manager.wait_finished()
+
+    async def make_request(self, method, params):
+        self.num_requests += 1
+        step = self.script.pop(0) if self.script else 0
+        if isinstance(step, Exception):
+            raise step
+        await trio.sleep(step)
+        return self.num_requests
+
+    async def make_batch_request(self, requests):
+        return tuple(
+            [await self.make_request(method, params)] for method, params in requests
+        )
+
+
+@pytest.mark.parametrize(
+    "error,expected",
+    (
+        (ConnectionError(), True),
+        (trio.TooSlowError(), True),
+        (RPCError("eth_blockNumber", [], {"code": -32000, "message": "busy"}), True),
+        (RPCError("eth_foo", [], {"code": -32601, "message": "no method"}), False),
+        (BatchRequestError("busy", {"code": -32000, "message": "busy"}), True),
+        (BatchRequestError("no method", {"code": -32601, "message": "no"}), False),
+        (BatchRequestError("Expected 2 responses to batch request. Got 1"), True),
+        (ValueError(), False),
+    ),
+)
+def test_is_retryable_error(error, expected):
+    assert is_retryable_error(error) is expected
+
+
+@pytest.mark.trio
+async def test_retries_transient_errors(autojump_clock):
+    inner = ScriptedClient([ConnectionError(), ConnectionError()])
+    client = RetryingClient(inner, max_retries=2, rng=random.Random(0))
+
+    async with background_trio_service(client):
+        assert await client.make_request("eth_blockNumber", []) == 3
+
+    assert client.get_stats()["retries"] == 2
+
+
+@pytest.mark.trio
+async def test_gives_up_after_max_retries(autojump_clock):
+    inner = ScriptedClient([ConnectionError()] * 3)
+    client = RetryingClient(inner, max_retries=2, rng=random.Random(0))
+
+    async with background_trio_service(client):
+        with pytest.raises(ConnectionError):
+            await client.make_request("eth_blockNumber", [])
+
+    assert inner.num_requests == 3
+
+
+@pytest.mark.trio
+async def test_does_not_retry_permanent_errors(autojump_clock):
+    error = RPCError("eth_foo", [], {"code": -32601, "message": "no method"})
+    inner = ScriptedClient([error])
+    client = RetryingClient(inner, max_retries=2)
+
+    async with background_trio_service(client):
+        with pytest.raises(RPCError):
+            await client.make_request("eth_foo", [])
+
+    assert inner.num_requests == 1
+
+
+@pytest.mark.trio
+async def test_abandons_requests_after_timeout(autojump_clock):
+    inner = ScriptedClient([60])
+    client = RetryingClient(inner, max_retries=1, timeout=5)
+
+    async with background_trio_service(client):
+        started_at = trio.current_time()
+        assert await client.make_request("eth_blockNumber", []) == 2
+        assert trio.current_time() - started_at < 10
+
+    assert client.get_stats()["timeouts"] == 1
+
+
+@pytest.mark.trio
+async def test_hedges_slow_requests(autojump_clock):
+    # Establish the latency distribution before the slow request.
+    inner = ScriptedClient([1] * 4 + [0.5] * 36 + [60])
+    client = RetryingClient(inner, hedge_percentile=90)
+
+    async with background_trio_service(client):
+        for _ in range(40):
+            await client.make_request("eth_getTransactionReceipt", [])
+
+        started_at = trio.current_time()
+        # The hedged duplicate is the 42nd request.
+        assert await client.make_request("eth_getTransactionReceipt", []) == 42
+        assert trio.current_time() - started_at == pytest.approx(1)
+
+    assert client.get_stats()["hedges"] == 1
+    assert client.get_stats()["hedge_wins"] == 1
+
+
+@pytest.mark.trio
+async def test_hedging_waits_for_enough_samples(autojump_clock):
+    inner = ScriptedClient([1, 1, 60])
+    client = RetryingClient(inner, hedge_percentile=50)
+
+    async with background_trio_service(client):
+        for _ in range(3):
+            await client.make_request("eth_getTransactionReceipt", [])
+
+    assert client.get_stats()["hedges"] == 0
+    assert inner.num_requests == 3
@@ -0,0 +1,85 @@
+import pathlib
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cthaeh.loader import get_batch_rows_importer
+from cthaeh.models import Base, Block, Log, LogTopic, Topic
+from cthaeh.rows import prepare_batch_rows
+from cthaeh.sqlite import SQLiteProfile, import_batch_rows_core
+
+
+@pytest.fixture
+def file_engine():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = pathlib.Path(temp_dir) / "db.sqlite3"
+        yield create_engine(f"sqlite:///{db_path}")
+
+
+def test_sqlite_sessions_use_core_inserts(session):
+    assert get_batch_rows_importer(session) is import_batch_rows_core
+
+
+@pytest.mark.trio
+async def test_import_batch_rows_core(session, mock_node, batches):
+    first_batch, second_batch = batches
+    known_topic = first_batch.receipts.topics[0]
+    session.add(Topic(topic=known_topic))
+    session.flush()
+
+    import_batch_rows_core(session, prepare_batch_rows(first_batch))
+    import_batch_rows_core(session, prepare_batch_rows(second_batch))
+
+    assert session.query(Block).count() == 6
+    assert session.query(Log).count() == sum(
+        len(receipt["logs"]) for receipt in mock_node.receipts.values()
+    )
+
+    for raw_block in mock_node.blocks:
+        for raw_transaction in raw_block["transactions"]:
+            raw_logs = mock_node.receipts[raw_transaction["hash"]]["logs"]
+            logs = (
+                session.query(Log)
+                .filter(Log.receipt_hash == bytes.fromhex(raw_transaction["hash"][2:]))
+                .order_by(Log.idx)
+                .all()
+            )
+            assert tuple(
+                tuple("0x" + topic.topic.hex() for topic in log.topics) for log in logs
+            ) == tuple(tuple(raw_log["topics"]) for raw_log in raw_logs)
+
+    assert session.query(LogTopic).count() == len(first_batch.receipts.topics) + len(
+        second_batch.receipts.topics
+    )
+
+
+def _get_pragma(connection, name):
+    return connection.execute(f"PRAGMA {name}").scalar()
+
+
+def test_sqlite_profile(file_engine):
+    profile = SQLiteProfile(file_engine, backfill=True)
+    Base.metadata.create_all(file_engine)
+    session = sessionmaker(bind=file_engine)()
+
+    assert _get_pragma(session, "journal_mode") == "wal"
+    assert _get_pragma(session, "synchronous") == 0
+    assert _get_pragma(session, "mmap_size") > 0
+
+    profile.make_durable(session)
+    assert not profile.is_backfilling
+    assert _get_pragma(session, "synchronous") == 2
+
+    with file_engine.connect() as connection:
+        assert _get_pragma(connection, "synchronous") == 2
+    session.close()
+
+
+def test_sqlite_profile_without_backfill(file_engine):
+    SQLiteProfile(file_engine)
+
+    with file_engine.connect() as connection:
+        assert _get_pragma(connection, "journal_mode") == "wal"
+        assert _get_pragma(connection, "synchronous") == 2
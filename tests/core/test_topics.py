@@ -0,0 +1,94 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cthaeh.models import Base, Topic
+from cthaeh.topics import (
+    TopicDictionary,
+    configure_topic_dictionary,
+    get_topic_dictionary,
+    insert_topics,
+)
+
+TOPIC_A = b"\x0a" * 32
+TOPIC_B = b"\x0b" * 32
+TOPIC_C = b"\x0c" * 32
+
+
+@pytest.fixture
+def topic_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def test_topic_dictionary_is_bounded():
+    dictionary = TopicDictionary(max_size=2)
+    dictionary.remember((TOPIC_A, TOPIC_B))
+    dictionary.remember((TOPIC_A, TOPIC_C))
+
+    assert len(dictionary) == 2
+    assert TOPIC_A in dictionary
+    assert TOPIC_B not in dictionary
+    assert TOPIC_C in dictionary
+
+
+def test_topics_become_known_on_commit(topic_session):
+    dictionary = get_topic_dictionary(topic_session)
+    assert get_topic_dictionary(topic_session) is dictionary
+
+    topics = dictionary.stage(topic_session, (TOPIC_A, TOPIC_B, TOPIC_A))
+    assert topics == (TOPIC_A, TOPIC_B)
+    insert_topics(topic_session, topics)
+    # Topics staged in the open transaction are not inserted twice.
+    assert dictionary.stage(topic_session, (TOPIC_B, TOPIC_C)) == (TOPIC_C,)
+    assert TOPIC_A not in dictionary
+
+    topic_session.rollback()
+    assert dictionary.stage(topic_session, (TOPIC_A,)) == (TOPIC_A,)
+    insert_topics(topic_session, (TOPIC_A,))
+
+    topic_session.begin_nested()
+    topic_session.commit()
+    assert TOPIC_A not in dictionary
+
+    topic_session.commit()
+    assert TOPIC_A in dictionary
+    assert TOPIC_B not in dictionary
+    assert dictionary.stage(topic_session, (TOPIC_A, TOPIC_B)) == (TOPIC_B,)
+
+
+def test_insert_topics_skips_known_topics(topic_session):
+    topic_session.add(Topic(topic=TOPIC_A))
+    topic_session.flush()
+
+    insert_topics(topic_session, (TOPIC_A, TOPIC_B))
+    insert_topics(topic_session, ())
+
+    assert {topic.topic for topic in topic_session.query(Topic)} == {TOPIC_A, TOPIC_B}
+
+
+def test_warm_topic_dictionary(topic_session):
+    topic_session.add_all((Topic(topic=TOPIC_A), Topic(topic=TOPIC_B)))
+    topic_session.commit()
+
+    dictionary = TopicDictionary()
+    dictionary.warm(topic_session)
+
+    assert len(dictionary) == 2
+    assert dictionary.stage(topic_session, (TOPIC_A, TOPIC_B, TOPIC_C)) == (TOPIC_C,)
+
+
+def test_configure_topic_dictionary(topic_session):
+    topic_session.add_all((Topic(topic=TOPIC_A), Topic(topic=TOPIC_B)))
+    topic_session.commit()
+
+    dictionary = configure_topic_dictionary(topic_session.get_bind(), max_size=1)
+    assert get_topic_dictionary(topic_session) is dictionary
+
+    dictionary.warm(topic_session)
+    assert len(dictionary) == 1
@@ -0,0 +1,135 @@
+from hypothesis import HealthCheck, given, settings
+from hypothesis import strategies as st
+import pytest
+
+from cthaeh.block_batch import BlockBatch
+from cthaeh.ir import Block, Header, Log, Receipt, Transaction
+from cthaeh.wire import (
+    DecodingError,
+    decode_block,
+    decode_block_batch,
+    encode_block,
+    encode_block_batch,
+)
+
+hashes = st.binary(min_size=32, max_size=32)
+addresses = st.binary(min_size=20, max_size=20)
+quantities = st.integers(min_value=0, max_value=2 ** 63 - 1)
+payloads = st.binary(max_size=16)
+
+headers = st.builds(
+    Header,
+    is_canonical=st.booleans(),
+    hash=hashes,
+    parent_hash=hashes,
+    uncles_hash=hashes,
+    coinbase=addresses,
+    state_root=hashes,
+    transaction_root=hashes,
+    receipt_root=hashes,
+    bloom=payloads,
+    difficulty=payloads,
+    block_number=quantities,
+    gas_limit=quantities,
+    gas_used=quantities,
+    timestamp=quantities,
+    extra_data=payloads,
+    nonce=payloads,
+)
+transactions = st.builds(
+    Transaction,
+    hash=hashes,
+    nonce=quantities,
+    gas_price=quantities,
+    gas=quantities,
+    to=st.none() | addresses,
+    value=payloads,
+    data=payloads,
+    v=payloads,
+    r=payloads,
+    s=payloads,
+    sender=addresses,
+)
+logs = st.builds(
+    Log,
+    address=addresses,
+    topics=st.lists(hashes, max_size=2).map(tuple),
+    data=payloads,
+)
+receipts = st.builds(
+    Receipt,
+    state_root=payloads,
+    gas_used=quantities,
+    bloom=payloads,
+    logs=st.lists(logs, max_size=2).map(tuple),
+)
+
+
+@st.composite
+def blocks(draw):
+    transactions_and_receipts = draw(
+        st.lists(st.tuples(transactions, receipts), max_size=3)
+    )
+    return Block(
+        header=draw(headers),
+        transactions=tuple(transaction for transaction, _ in transactions_and_receipts),
+        uncles=tuple(draw(st.lists(headers, max_size=1))),
+        receipts=tuple(receipt for _, receipt in transactions_and_receipts),
+    )
+
+
+# Blocks are made up of many fixed size hashes, which hypothesis considers
+# large examples.
+LARGE_DATA = [HealthCheck.data_too_large]
+
+
+def _deep(blocks):
+    # `Block` equality only compares hashes.
+    return tuple(tuple(block) for block in blocks)
+
+
+@settings(max_examples=50, suppress_health_check=LARGE_DATA)
+@given(block=blocks())
+def test_block_round_trip(block):
+    assert tuple(decode_block(encode_block(block))) == tuple(block)
+
+
+@settings(max_examples=50, suppress_health_check=LARGE_DATA)
+@given(blocks=st.lists(blocks(), max_size=3))
+def test_block_batch_round_trip(blocks):
+    encoded = encode_block_batch(BlockBatch.from_blocks(blocks))
+    batch = decode_block_batch(encoded)
+
+    assert _deep(batch) == _deep(blocks)
+    # Re-encoding a decoded batch gives the same bytes, and decoded batches
+    # can be copied into a new batch.
+    assert encode_block_batch(batch) == encoded
+    assert _deep(BlockBatch.concat((batch, batch))) == _deep(blocks) * 2
+
+
+@settings(max_examples=20, suppress_health_check=LARGE_DATA)
+@given(block=blocks())
+def test_decoding_does_not_copy(block):
+    encoded = bytearray(encode_block(block))
+    batch = decode_block_batch(encoded)
+
+    assert batch.headers.hash.data.obj is encoded
+    assert batch.transactions.data.data.obj is encoded
+
+
+@settings(max_examples=50, suppress_health_check=LARGE_DATA)
+@given(block=blocks(), data=st.data())
+def test_decoding_truncated_or_corrupt_input(block, data):
+    encoded = encode_block(block)
+
+    with pytest.raises(DecodingError):
+        decode_block(encoded[: data.draw(st.integers(0, len(encoded) - 1))])
+    with pytest.raises(DecodingError):
+        decode_block(encoded + b"\x00")
+    with pytest.raises(DecodingError):
+        decode_block(b"XXXX" + encoded[4:])
+
+
+def test_decode_block_requires_a_single_block():
+    with pytest.raises(DecodingError):
+        decode_block(encode_block_batch(BlockBatch()))
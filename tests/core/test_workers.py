@@ -0,0 +1,108 @@
+from async_service import background_trio_service
+import pytest
+import trio
+from web3 import Web3
+
+from cthaeh.block_batch import BlockBatch
+from cthaeh.client import Web3Client
+from cthaeh.exfiltration import Exfiltrator, fetch_raw_block
+from cthaeh.extraction import extract_raw_block_data
+from cthaeh.loader import import_batch_rows
+from cthaeh.models import Block, Header
+from cthaeh.rows import BatchRows, prepare_batch_rows
+from cthaeh.workers import ExtractionPool
+from mock_node import MockNode, MockNodeProvider
+
+
+@pytest.fixture
+def mock_node():
+    return MockNode(num_blocks=8, transactions_per_block=4, uncles_per_block=2)
+
+
+@pytest.fixture
+def client(mock_node):
+    return Web3Client(Web3(MockNodeProvider(mock_node)))
+
+
+@pytest.mark.trio
+async def test_extraction_pool_prepares_batches(client):
+    raw_blocks = tuple([await fetch_raw_block(client, number) for number in range(8)])
+    pool = ExtractionPool(num_workers=2, batch_size=3)
+
+    async with background_trio_service(pool):
+        results = [None] * len(raw_blocks)
+
+        async def _prepare(index):
+            results[index] = await pool.prepare(raw_blocks[index])
+
+        with trio.fail_after(30):
+            async with trio.open_nursery() as nursery:
+                for index in range(len(raw_blocks)):
+                    nursery.start_soon(_prepare, index)
+
+    assert all(len(rows.batch) == 1 for rows in results)
+    assert tuple(tuple(rows.batch[0]) for rows in results) == tuple(
+        tuple(extract_raw_block_data(raw_block)) for raw_block in raw_blocks
+    )
+    assert tuple(rows[1:] for rows in results) == tuple(
+        prepare_batch_rows(BlockBatch.from_raw_blocks((raw_block,)))[1:]
+        for raw_block in raw_blocks
+    )
+
+
+@pytest.mark.parametrize("load_batch_size", (None, 3))
+@pytest.mark.trio
+async def test_exfiltrator_with_extraction_workers(
+    session, mock_node, client, load_batch_size
+):
+    send_channel, receive_channel = trio.open_memory_channel(0)
+    exfiltrator = Exfiltrator(
+        client=client,
+        block_send_channel=send_channel,
+        start_at=0,
+        end_at=8,
+        concurrency_factor=4,
+        extraction_workers=2,
+        load_batch_size=load_batch_size,
+    )
+
+    async with background_trio_service(exfiltrator):
+        with trio.fail_after(30):
+            async with receive_channel:
+                batches = tuple([batch async for batch in receive_channel])
+
+    assert all(isinstance(rows, BatchRows) for rows in batches)
+    assert tuple(
+        block_number
+        for rows in batches
+        for block_number in rows.batch.headers.block_number
+    ) == tuple(range(8))
+
+    for rows in batches:
+        import_batch_rows(session, rows)
+
+    for raw_block in mock_node.blocks:
+        header = (
+            session.query(Header)
+            .filter(Header.block_number == int(raw_block["number"], 16))
+            .filter(Header.is_canonical.is_(True))
+            .one()
+        )
+        assert header.hash.hex() == raw_block["hash"][2:]
+
+        block = session.query(Block).filter(Block.header_hash == header.hash).one()
+        assert tuple(
+            "0x" + transaction.hash.hex() for transaction in block.transactions
+        ) == tuple(transaction["hash"] for transaction in raw_block["transactions"])
+        assert tuple("0x" + uncle.hash.hex() for uncle in block.uncles) == tuple(
+            raw_block["uncles"]
+        )
+
+        for transaction, raw_transaction in zip(
+            block.transactions, raw_block["transactions"]
+        ):
+            raw_logs = mock_node.receipts[raw_transaction["hash"]]["logs"]
+            assert tuple(
+                tuple("0x" + topic.topic.hex() for topic in log.topics)
+                for log in transaction.receipt.logs
+            ) == tuple(tuple(raw_log["topics"]) for raw_log in raw_logs)
@@ -0,0 +1,92 @@
+import threading
+import time
+
+from async_service import background_trio_service
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import trio
+from web3 import Web3
+
+from cthaeh.client import Web3Client
+from cthaeh.exfiltration import fetch_raw_block
+from cthaeh.extraction import extract_raw_block_data
+from cthaeh.loader import BlockLoader
+from cthaeh.models import Base, Block
+from cthaeh.writer import InlineWriter, ThreadedWriter
+from mock_node import MockNode, MockNodeProvider
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # An in-memory database is not shared between threads.
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite3'}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.mark.trio
+async def test_threaded_writer_writes_on_a_dedicated_thread(session_factory):
+    writer = ThreadedWriter(session_factory)
+
+    async with background_trio_service(writer):
+        thread_ids = {
+            await writer.write(lambda session: threading.get_ident()) for _ in range(4)
+        }
+        assert len(thread_ids) == 1
+        assert threading.get_ident() not in thread_ids
+
+        assert await writer.write(lambda session, value: value + 1, 1) == 2
+        with pytest.raises(ZeroDivisionError):
+            await writer.write(lambda session: 1 / 0)
+
+
+@pytest.mark.trio
+async def test_threaded_writer_leaves_the_event_loop_running(session_factory):
+    writer = ThreadedWriter(session_factory)
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(None)
+            await trio.sleep(0.01)
+
+    async with background_trio_service(writer):
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(tick)
+            await writer.write(lambda session: time.sleep(0.2))
+            nursery.cancel_scope.cancel()
+
+    assert len(ticks) > 5
+
+
+@pytest.mark.trio
+async def test_inline_writer(session):
+    writer = InlineWriter(session)
+    assert await writer.write(lambda writer_session: writer_session) is session
+
+
+@pytest.mark.trio
+async def test_block_loader_with_threaded_writer(session_factory):
+    mock_node = MockNode(num_blocks=4, transactions_per_block=2)
+    client = Web3Client(Web3(MockNodeProvider(mock_node)))
+    blocks = [
+        extract_raw_block_data(await fetch_raw_block(client, number))
+        for number in range(4)
+    ]
+
+    writer = ThreadedWriter(session_factory)
+    send_channel, receive_channel = trio.open_memory_channel(0)
+    loader = BlockLoader(session_factory(), receive_channel, writer=writer)
+
+    async with background_trio_service(writer):
+        async with background_trio_service(loader):
+            with trio.fail_after(10):
+                async with send_channel:
+                    for block in blocks:
+                        await send_channel.send(block)
+                await loader.loaded.wait()
+
+    reader = session_factory()
+    assert reader.query(Block).count() == len(blocks)
+    reader.close()